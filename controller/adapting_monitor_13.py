@@ -1,74 +1,302 @@
 import logging
+import time
 from os import environ as env
+from typing import Optional
 
+import numpy as np
+import yaml
+from ryu.app.wsgi import WSGIApplication
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import DEAD_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, DEAD_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
+from ryu.topology import event as topology_event
 
 from flow import *
+import metrics
+from classifier import SliceClassifier
+from dispatcher import DatapathDispatcher
+from ingest import FlowStatsIngest, MultipartReplies
+from poller import AdaptivePoller
 from qos_manager import QoSManager, ThreadedQoSManager
+from recorder import Recorder
+from rest_client import EndpointLatency, RestClient
+from rounds import RoundTracker
+from rule_installer import QOS_TABLE_ID, RULE_COOKIE, RULE_COOKIE_MASK, RuleInstaller
+from slice_api import SliceController
+from topology import Topology
+
+
+# The classes configured along with the application
+CONFIGURED_CLASSES = (RestClient, DatapathDispatcher, QoSManager, FlowStat, metrics.MetricsServer, Recorder,
+                      AdaptivePoller, config_handler.ConfigWatcher, Topology)
 
 
 class AdaptingMonitor13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {"wsgi": WSGIApplication}
     TIME_STEP = 5  # The number of seconds between two stat request
     FLOWS_LIMITS: Dict[FlowId, int] = {}  # Rate limits associated to different flows
     LOG_STAT_SEQUENCE_DELIMITER = "=" * 50
-    STAT_LOG_FORMAT = "csv"
+    STAT_LOG_FORMAT = "csv"  # "csv" and "human" are logged, "binary" is recorded by `recorder.Recorder`
+    RULE_INSTALLATION = "openflow"  # How classification rules are installed: "openflow" in one batch, or "rest"
+    MEASUREMENT = "flow"  # What the load is measured on: "flow" (bytes matched by rules) or "queue" (bytes sent)
+    ROUND_TIMEOUT: Optional[float] = None  # Max seconds to wait for the replies of a round, min poll interval if None
 
     def __init__(self, *args, **kwargs):
         super(AdaptingMonitor13, self).__init__(*args, **kwargs)
 
         self.logger = logging.getLogger("adapting_monitor")
 
-        config_file = env.get("CONFIG_FILE", "configs/default.yml")
-        self.logger.info("Using %s as config file.", config_file)
-        self.configure(config_file)
+        self.config_file = env.get("CONFIG_FILE", "configs/default.yml")
+        self.logger.info("Using %s as config file.", self.config_file)
+        self.configure(self.config_file)
 
         self.datapaths = {}
         self.qos_manager = ThreadedQoSManager(AdaptingMonitor13.FLOWS_LIMITS)
-        self.stats: Dict[int, FlowStatManager] = {}  # Key: datapath id
+        # The slices of the config file, the only ones a reload changes. The others have been added through the API.
+        self.config_slices: Dict[FlowId, int] = dict(AdaptingMonitor13.FLOWS_LIMITS)
+        self.rule_installer = RuleInstaller()
+        self.classifier = SliceClassifier(AdaptingMonitor13.FLOWS_LIMITS)  # Maps the matches of the rules to flows
+        self.dispatcher = DatapathDispatcher()
+        self.stats: Dict[int, BaseFlowStatManager] = {}  # Key: datapath id
+        self.drop_stats: Dict[int, BaseFlowStatManager] = {}  # Dropped packets per flow in queue measurement mode
+        self.rounds = RoundTracker()
+        self.max_speeds = FlowMaxIndex()  # The global view of the flows, the max of their speed on every datapath
+        self.poller = AdaptivePoller(AdaptingMonitor13.TIME_STEP)
+        self._record_rows: Dict[int, tuple] = {}  # Key: datapath id, the flow indices of the recorder and limit rows
+        self.reply_delay = EndpointLatency()  # Time the stats replies of the round spend queued before being handled
+        self.ingest: Dict[int, FlowStatsIngest] = {}  # Key: datapath id, the fast path of the flow stats replies
+        self.queue_replies: Dict[int, MultipartReplies] = {}  # Key: datapath id, the queue stats replies in progress
+        self.topology = Topology()  # Last learnt from the topology discovery of Ryu, for the egress queue placement
+
+        if "wsgi" in kwargs:  # Not when the application is created outside of ryu-manager, e.g. by a benchmark
+            kwargs["wsgi"].register(SliceController, {"monitor": self})
 
     def start(self):
         super(AdaptingMonitor13, self).start()
         self.logger.info(self.__class__.LOG_STAT_SEQUENCE_DELIMITER)
         self.threads.append(hub.spawn(self._monitor))
-        self.threads.append(hub.spawn(self._adapt))
-        self.threads.append(hub.spawn(self._flow_stats_logger))
+        if config_handler.ConfigWatcher.INTERVAL > 0:
+            self.threads.append(hub.spawn(self._config_watcher))
+        if QoSManager.QUEUE_PLACEMENT == "egress":
+            # Not required through ryu.topology.api, which would load the switches app, and its host discovery of every
+            # packet-in, in every deployment
+            if app_manager.lookup_service_brick("switches") is None:
+                self.logger.error("queue_placement is egress but the ryu.topology.switches app is not running, start "
+                                  "ryu-manager with it. Queues are placed on all ports.")
+                QoSManager.QUEUE_PLACEMENT = "all"
+            else:
+                if not getattr(self.CONF, "observe_links", False):
+                    self.logger.warning("queue_placement is egress but links are not observed, start ryu-manager with "
+                                        "--observe-links or no port can be reached through the links.")
+                self.threads.append(hub.spawn(self._topology_watcher))
+        if metrics.MetricsServer.ADDR:
+            metrics.REGISTRY.add_collector(self._collect_metrics)
+            self.threads.append(hub.spawn(metrics.MetricsServer().serve, metrics.MetricsServer.ADDR))
+        if self.__class__.STAT_LOG_FORMAT == "binary":
+            self.threads.append(hub.spawn(self._flow_stats_recorder))
+        else:
+            self.threads.append(hub.spawn(self._flow_stats_logger))
 
     def stop(self):
         super().stop()
         self.logger.info(self.__class__.LOG_STAT_SEQUENCE_DELIMITER)
 
     def _monitor(self):
+        """
+        Request the statistics of the datapaths in rounds of the minimum poll interval, and adapt the queues as soon as
+        every polled datapath has answered in the round, or the round has timed out.
+
+        The requests of a round are sent at the phase of each datapath, spread over the period, so the replies do not
+        queue up in the hub all at once.
+        """
         self.logger.info("Network monitoring started.")
         while self.is_active:
-            for dp in list(self.datapaths.values()):
-                self._request_stats(dp)
-            hub.sleep(AdaptingMonitor13.TIME_STEP)
+            # Read at every round, as a reload of the config may change them
+            period = self.poller.min_interval
+            timeout = AdaptingMonitor13.ROUND_TIMEOUT
+            if timeout is None:
+                timeout = period
+            period_end = time.time() + period
+            self._expire_replies(period_end - 2 * period - timeout)
+            due = self.poller.due(period_end)
+            stats_round = self.rounds.start(due)
+            for dpid in due:
+                scheduled = self.poller.scheduled(dpid)
+                hub.sleep(max(0.0, scheduled - time.time()))
+                datapath = self.datapaths.get(dpid)
+                if datapath is None:  # Disconnected meanwhile
+                    self.rounds.remove_datapath(dpid)
+                    continue
+                now = time.time()
+                # Keep the phase of the datapath, unless it has fallen behind by a whole period
+                self.poller.polled(dpid, scheduled if now - scheduled < period else now)
+                self._request_stats(datapath)
+            if not stats_round.done.wait(timeout):
+                self.logger.warning("Round %d timed out, no stats from %s.", stats_round.round_id,
+                                    ", ".join("%016x" % dpid for dpid in sorted(stats_round.pending)))
+            if due:
+                self.logger.debug("Round %d: reply queueing delay avg %.4f s, max %.4f s", stats_round.round_id,
+                                  self.reply_delay.avg_time(), self.reply_delay.max_time)
+                self.reply_delay = EndpointLatency()  # Late replies of this round count in the next one
+                # The adaptation may be slow to push, so it must not delay the next round
+                hub.spawn(self._adapt, stats_round.started)
+            hub.sleep(max(0.0, period_end - time.time()))
         self.logger.info("Network monitoring stopped.")
 
-    def _adapt(self):
-        self.logger.info("Queue adaptation loop started.")
+    def _expire_replies(self, before: float):
+        """
+        Forget the multipart replies in progress whose first part has arrived before a time, e.g. whose rest was lost
+        to an error of the switch, so they do not pile up.
+        """
+        for dpid in list(self.ingest):
+            expired = self.ingest[dpid].replies.expire(before) + self.queue_replies[dpid].expire(before)
+            if expired:
+                self.logger.warning("%016x: %d incomplete stats replies expired.", dpid, expired)
+
+    def _send_event(self, ev, state):
+        # Stamp the events as they are queued for the handlers, to measure how long the replies wait in the queue
+        ev.queued_at = time.time()
+        super()._send_event(ev, state)
+
+    def _adapt(self, round_started: float):
+        """
+        :param round_started: When the stats requests of the round that triggered the adaptation have been sent.
+        """
+        # To make adaptation global to the network, the QoSManager need to see a projection of flowstats that has
+        # the maximum measured value for each flow, thus accumulating the measurements from all datapaths.
+        flowstat_max_per_flow = self.max_speeds.export()
+        if flowstat_max_per_flow:
+            if self.qos_manager.adapt_queues(flowstat_max_per_flow, False):
+                metrics.ROUND_TO_APPLIED_SECONDS.observe(time.time() - round_started)
+
+    def _config_watcher(self):
+        """
+        Reload the config file whenever it changes.
+        """
+        watcher = config_handler.ConfigWatcher(self.config_file)
+        while self.is_active and config_handler.ConfigWatcher.INTERVAL > 0:
+            hub.sleep(config_handler.ConfigWatcher.INTERVAL)
+            if watcher.changed():
+                self.reload_config(self.config_file)
+
+    def _topology_watcher(self):
+        """
+        Learn the topology from the topology discovery of Ryu, and move the queues to the egress ports of the slices
+        whenever it changes.
+        """
         while self.is_active:
-            # To make adaptation global to the network, the QoSManager need to see a projection of flowstats that has
-            # the maximum measured value for each flow, thus accumulating the measurements from all datapaths.
-            flowstat_max_per_flow: Dict[FlowId, float] = {}
-            for fsm in list(self.stats.values()):
-                for fid, avg_speed in fsm.export_avg_speeds_bps().items():
-                    if fid not in flowstat_max_per_flow or \
-                            avg_speed > flowstat_max_per_flow[fid]:
-                        flowstat_max_per_flow[fid] = avg_speed
-            if flowstat_max_per_flow:
-                self.qos_manager.adapt_queues(flowstat_max_per_flow, False)
-            hub.sleep(AdaptingMonitor13.TIME_STEP)
-        self.logger.info("Queue adaptation loop stopped.")
+            hub.sleep(Topology.REFRESH_INTERVAL)
+            topology = Topology()
+            for link in self.send_request(topology_event.EventLinkRequest()).links:
+                topology.add_link(link.src.dpid, link.src.name.decode('utf-8'), link.dst.dpid)
+            for host in self.send_request(topology_event.EventHostRequest()).hosts:
+                for address in host.ipv4:
+                    topology.add_host(address, host.port.dpid, host.port.name.decode('utf-8'))
+            if topology == self.topology:
+                continue
+            self.topology = topology
+            for dpid in self._place_queues():
+                self.dispatcher.submit(dpid, self.qos_manager.set_queues, dpid, blocking=True)
+
+    def _place_queues(self) -> List[int]:
+        """
+        Place the queues on the egress ports of the slices in the last learnt topology, if so configured.
+
+        Until every slice has a known host, and the links of a datapath among others are known, the queues stay on
+        every port of the datapath, so no slice goes without its queue.
+
+        :return: The datapaths whose placement has changed, whose newly placed ports need `set_queues`.
+        """
+        if QoSManager.QUEUE_PLACEMENT != "egress":
+            return []
+        egress = self.topology.egress_ports(self.qos_manager.flows_limits)
+        changed = []
+        for dpid in list(self.datapaths):
+            if egress is None or (len(self.datapaths) > 1 and not self.topology.linked(dpid)):
+                ports = self.qos_manager.datapath_ports[dpid]
+            else:
+                ports = egress.get(dpid, set())
+            if self.qos_manager.place_queues(dpid, ports):
+                self.logger.info("Queues of %016x placed on %s.", dpid, ", ".join(sorted(ports)) or "no port")
+                changed.append(dpid)
+        return changed
+
+    def reload_config(self, config_path: str) -> bool:
+        """
+        Validate the config file at `config_path` and apply only what differs from the running settings.
+
+        The settings in `LIVE_SETTINGS` take effect at once: the stats windows are resized keeping their newest samples,
+        and the differences of the flows from the previously applied file are applied by `update_slices`, so only the
+        changed rules and queues are pushed. The slices added or removed through the API are kept as they are, unless
+        the file changes them. The other settings need a restart, so their changes are logged and ignored. An invalid
+        file, including a single invalid flow entry, is ignored as a whole.
+
+        :return: Whether the file has been applied.
+        """
+        classes = CONFIGURED_CLASSES + (AdaptingMonitor13,)
+        running = config_handler.class_settings(classes)
+        try:
+            AdaptingMonitor13.FLOWS_LIMITS = {}  # `configure` adds the flows of the file to it
+            AdaptingMonitor13.configure(config_path, strict=True)
+            AdaptivePoller(AdaptingMonitor13.TIME_STEP)  # Validates the poll intervals
+
+            config_slices = AdaptingMonitor13.FLOWS_LIMITS
+            init_limits = {flow: entry.limit for flow, entry in self.qos_manager.FLOWS_INIT_LIMITS.items()}
+            removed = [flow for flow in self.config_slices if flow not in config_slices and flow in init_limits]
+            # A slice of the file which is missing, e.g. removed through the API, is only added again if the file
+            # changes it
+            changed_slices = {flow: limit for flow, limit in config_slices.items()
+                              if self.config_slices.get(flow) != limit}
+            added = {flow: limit for flow, limit in changed_slices.items() if flow not in init_limits}
+            resized = {flow: limit for flow, limit in changed_slices.items()
+                       if flow in init_limits and limit != init_limits[flow]}
+            # The new slices must not overlap the ones added through the API either
+            SliceClassifier([flow for flow in init_limits if flow not in removed] + list(added))
+        except (KeyError, TypeError, ValueError, OSError, yaml.YAMLError) as e:
+            config_handler.restore_settings(running)
+            self.logger.error("Config file %s not applied, keeping the running settings: %s", config_path, e)
+            metrics.CONFIG_RELOADS.labels(result="invalid").inc()
+            return False
+
+        changed = {key for key, value in config_handler.class_settings(classes).items() if value != running[key]}
+        for cls, name in changed - LIVE_SETTINGS - {(AdaptingMonitor13, "FLOWS_LIMITS")}:
+            self.logger.warning("%s.%s changed in the config file, it takes effect after a restart.", cls.__name__,
+                                name)
+            setattr(cls, name, running[(cls, name)])
+        changed &= LIVE_SETTINGS
+
+        if changed & {(AdaptingMonitor13, "TIME_STEP"), (AdaptivePoller, "MIN_INTERVAL"),
+                      (AdaptivePoller, "MAX_INTERVAL")}:
+            self.poller.set_intervals(AdaptingMonitor13.TIME_STEP, time.time())
+        if (QoSManager, "DEFAULT_MAX_RATE") in changed:
+            self.qos_manager.apply_settings()
+        # The FlowStatManagers follow FlowStat.WINDOW_SIZE at their next put, keeping their newest samples
+
+        self.config_slices = dict(config_slices)
+        self.logger.info("Config file %s reloaded: %d settings changed, %d slices added, %d removed, %d resized.",
+                         config_path, len(changed), len(added), len(removed), len(resized))
+        metrics.CONFIG_RELOADS.labels(result="applied").inc()
+        if added or removed or resized:
+            failures = self.update_slices(added, removed, resized)
+            for dpid, reason in failures.items():
+                self.logger.error("Slices not updated on %016x: %s", dpid, reason)
+        elif (QoSManager, "DEFAULT_MAX_RATE") in changed:
+            self.qos_manager.set_queues(blocking=True)
+        return True
+
+    def _collect_metrics(self):
+        metrics.FLOWS.set(len(self.max_speeds))
+        metrics.DATAPATHS.set(len(self.datapaths))
+        if self.__class__.MEASUREMENT == "queue":
+            metrics.QUEUE_DROPS.set(float(sum(fsm.export_avg_speeds_array().sum()
+                                              for fsm in list(self.drop_stats.values()))))
 
     @classmethod
-    def configure(cls, config_path: str) -> None:
+    def configure(cls, config_path: str, strict: bool = False) -> None:
         """
         Configure the application based on the values in the file available at `config_path`.
 
@@ -76,6 +304,7 @@ class AdaptingMonitor13(app_manager.RyuApp):
         with the config file, as it should definitely result in application failure.
 
         :param config_path: Path to the configuration file
+        :param strict: Raise `config_handler.ConfigError` for an invalid flow entry instead of skipping it.
         """
         logger = logging.getLogger("config")
 
@@ -90,10 +319,17 @@ class AdaptingMonitor13(app_manager.RyuApp):
                 logger.info("flow configuration added: ({}, {})".format(
                     new_flow_id, flow["base_ratelimit"])
                 )
-            except (TypeError, KeyError) as e:
+            except (TypeError, KeyError, ValueError) as e:
+                if strict:
+                    raise config_handler.ConfigError("config: Invalid Flow object: {}. Reason: {}".format(flow, e)) \
+                        from e
                 logger.error("Invalid Flow object: {}. Reason: {}".format(flow, e))
         if len(cls.FLOWS_LIMITS) <= 0:
             raise config_handler.ConfigError("config: No valid flow definition found.")
+        try:
+            SliceClassifier(cls.FLOWS_LIMITS)
+        except ValueError as e:
+            raise config_handler.ConfigError("config: {}".format(e)) from e
 
         # Optional fields
         if "time_step" in ch.config:
@@ -102,15 +338,37 @@ class AdaptingMonitor13(app_manager.RyuApp):
         else:
             logger.debug("time_step not set")
 
+        if "round_timeout" in ch.config:
+            cls.ROUND_TIMEOUT = float(ch.config["round_timeout"])
+            logger.info("round_timeout set to {}".format(cls.ROUND_TIMEOUT))
+        else:
+            logger.debug("round_timeout not set")
+
         if "stat_log_format" in ch.config:
             cls.STAT_LOG_FORMAT = ch.config["stat_log_format"]
             logger.info("stat_log_format set to {}".format(cls.STAT_LOG_FORMAT))
         else:
             logger.debug("stat_log_format not set")
 
+        if "measurement" in ch.config:
+            if ch.config["measurement"] not in ("flow", "queue"):
+                raise config_handler.ConfigError("config: measurement must be either flow or queue")
+            cls.MEASUREMENT = ch.config["measurement"]
+            logger.info("measurement set to {}".format(cls.MEASUREMENT))
+        else:
+            logger.debug("measurement not set")
+
+        if "rule_installation" in ch.config:
+            if ch.config["rule_installation"] not in ("openflow", "rest"):
+                raise config_handler.ConfigError("config: rule_installation must be either openflow or rest")
+            cls.RULE_INSTALLATION = ch.config["rule_installation"]
+            logger.info("rule_installation set to {}".format(cls.RULE_INSTALLATION))
+        else:
+            logger.debug("rule_installation not set")
+
         # Configure other classes
-        QoSManager.configure(ch)
-        FlowStat.configure(ch)
+        for configured_cls in CONFIGURED_CLASSES:
+            configured_cls.configure(ch)
 
     @set_ev_cls(ofp_event.EventOFPStateChange,
                 [MAIN_DISPATCHER, DEAD_DISPATCHER])
@@ -125,37 +383,214 @@ class AdaptingMonitor13(app_manager.RyuApp):
                 all_ports = sorted([port.name.decode('utf-8') for port in datapath.ports.values()])
                 datapath.cname = all_ports[0]
                 datapath.ports = all_ports[1:]
-                self.stats[datapath.id] = FlowStatManager()
-                self.qos_manager.set_ovsdb_addr(datapath.id, blocking=True)
-                self.qos_manager.set_rules(datapath.id, blocking=True)
-                self.qos_manager.set_queues(datapath.id, blocking=False)  # Blocking=False will make it not run
-                # unnecessarily when a global queue adaptation is in progress.
+                self.stats[datapath.id] = new_flow_stat_manager()
+                self.drop_stats[datapath.id] = new_flow_stat_manager()
+                self.ingest[datapath.id] = FlowStatsIngest(self.stats[datapath.id], self.classifier)
+                self.queue_replies[datapath.id] = MultipartReplies("queue")
+                self.qos_manager.register_datapath(datapath.id, datapath.ports)
+                self._place_queues()
+                self.poller.add_datapath(datapath.id, time.time())
+                # Configuration is slow and may wait for replies arriving through this event loop, so it must not
+                # block it.
+                self.dispatcher.submit(datapath.id, self._configure_datapath, datapath)
         elif ev.state == DEAD_DISPATCHER:
             if datapath.id in self.datapaths:
                 self.logger.debug('unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
                 del self.stats[datapath.id]
+                del self.drop_stats[datapath.id]
+                del self.ingest[datapath.id]
+                del self.queue_replies[datapath.id]
+                self.qos_manager.unregister_datapath(datapath.id)
+                self.dispatcher.forget(datapath.id)
+                self.rounds.remove_datapath(datapath.id)
+                self.max_speeds.remove_datapath(datapath.id)
+                self.poller.remove_datapath(datapath.id)
+                self._record_rows.pop(datapath.id, None)
+
+    def _configure_datapath(self, datapath):
+        """
+        Set up the OVSDB address, the classification rules and the queues of a newly connected datapath.
+
+        Runs on a green thread of `self.dispatcher`.
+        """
+        self.qos_manager.set_ovsdb_addr(datapath.id, blocking=True)
+        if self.__class__.RULE_INSTALLATION == "openflow":
+            failures = self.rule_installer.install(datapath, self.qos_manager.get_queue_ids())
+            if failures:
+                self.logger.error("%d classification rules failed on %016x.", len(failures), datapath.id)
+        else:
+            self.qos_manager.set_rules(datapath.id, blocking=True)
+        self.qos_manager.set_queues(datapath.id, blocking=True)
+        self.logger.info("Datapath %016x configured.", datapath.id)
+
+    def update_slices(self, added: Dict[FlowId, int] = None, removed: Iterable[FlowId] = (),
+                      resized: Dict[FlowId, int] = None) -> Dict[int, str]:
+        """
+        Add, remove and resize slices at runtime, and push only the affected rules and queues to the datapaths.
+
+        The other slices keep their current limits and statistics. New slices start at their initial limit, and so do
+        resized ones. The ids of the queues of removed slices are allocated again to new slices.
+
+        :param added: The initial limit in bits/s of every new slice.
+        :param removed: The slices to remove.
+        :param resized: The new initial limit in bits/s of existing slices.
+        :return: The reason of failure per datapath id which has not taken every change. Empty on success.
+        :raises KeyError: If a slice to remove or resize does not exist. Nothing is changed then.
+        :raises ValueError: If a new slice exists already or overlaps another one. Nothing is changed then.
+        """
+        added = {} if added is None else added
+        removed = list(removed)
+        resized = {} if resized is None else resized
+        current = self.qos_manager.flows_limits
+        for flow in removed + list(resized):
+            if flow not in current:
+                raise KeyError("Slice {} does not exist".format(flow))
+        for flow in added:
+            if flow in current and flow not in removed:
+                raise ValueError("Slice {} already exists".format(flow))
+        classifier = SliceClassifier([flow for flow in current if flow not in removed] + list(added))
+
+        # Nothing below yields until the rules are pushed, so the stats handlers and the adaptation never see a
+        # partial change
+        removed_rules = {flow: self.qos_manager.remove_flow(flow) for flow in removed}
+        for flow in removed:
+            for fsm in list(self.stats.values()) + list(self.drop_stats.values()):
+                if flow in fsm:
+                    fsm.remove(flow)
+            self.max_speeds.remove_flow(flow)
+        for flow, limit in resized.items():
+            self.qos_manager.resize_flow(flow, limit)
+        added_rules = {flow: self.qos_manager.add_flow(flow, limit) for flow, limit in added.items()}
+        self.classifier = classifier
+        for ingest in self.ingest.values():  # The rows of its cache may have moved
+            ingest.reset(classifier)
+        for replies in self.queue_replies.values():  # Their sums may belong to removed flows
+            replies.clear()
+        self._record_rows.clear()  # Removing flows moves the rows of the others
+        self._place_queues()  # The new slices may leave through other ports, pushed with the queues below
+
+        futures = {dpid: self.dispatcher.submit(dpid, self._update_datapath_slices, datapath, added_rules,
+                                                removed_rules)
+                   for dpid, datapath in list(self.datapaths.items())}
+        failures = {}
+        for dpid, future in futures.items():
+            future.wait()
+            if future.exception is not None:
+                failures[dpid] = str(future.exception)
+        return failures
+
+    def _update_datapath_slices(self, datapath, added: Dict[FlowId, int], removed: Dict[FlowId, int]):
+        """
+        Remove the rules of the removed slices, push the queues that have changed, then install the rules of the new
+        slices, so no traffic is classified into a queue which does not exist.
+
+        Runs on a green thread of `self.dispatcher`.
+
+        :param added: The queue id of every new slice.
+        :param removed: The queue id every removed slice had.
+        :raises RuntimeError: If the datapath has not taken every change.
+        """
+        errors = []
+        if removed:
+            # Rules set through rest_qos match the same way, only their cookie differs, which a strict delete ignores
+            failures = self.rule_installer.remove(datapath, removed)
+            errors.extend("rule of {} not removed: {}".format(flow, reason) for flow, reason in failures.items())
+        self.qos_manager.set_queues(datapath.id, blocking=True)
+        stale = self.qos_manager.stale_ports(datapath.id)
+        if stale:
+            errors.append("queues not set on {}".format(", ".join(stale)))
+        if added:
+            if self.__class__.RULE_INSTALLATION == "openflow":
+                failures = self.rule_installer.install(datapath, added)
+                errors.extend("rule of {} not installed: {}".format(flow, reason) for flow, reason in failures.items())
+            else:
+                self.qos_manager.set_rules(datapath.id, list(added), blocking=True)
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        self.logger.info("Slices updated on %016x.", datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _error_msg_handler(self, ev):
+        self.rule_installer.error_handler(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        self.rule_installer.barrier_reply_handler(ev.msg)
 
     def _request_stats(self, datapath):
         self.logger.debug('send stats request: %016x', datapath.id)
+        ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        req = parser.OFPFlowStatsRequest(datapath)
+        if self.__class__.MEASUREMENT == "queue":
+            req = parser.OFPQueueStatsRequest(datapath, 0, ofproto.OFPP_ANY, ofproto.OFPQ_ALL)
+            self._send_round_request(datapath, req)
+            return
+
+        # Only ask for the classification rules, so the size of the reply does not depend on the number of hosts
+        # learnt by the switch in the other tables. Rules installed through rest_qos do not carry our cookie.
+        if self.__class__.RULE_INSTALLATION == "openflow":
+            cookie, cookie_mask = RULE_COOKIE, RULE_COOKIE_MASK
+        else:
+            cookie, cookie_mask = 0, 0
+        req = parser.OFPFlowStatsRequest(datapath, table_id=QOS_TABLE_ID, out_port=ofproto.OFPP_ANY,
+                                         out_group=ofproto.OFPG_ANY, cookie=cookie, cookie_mask=cookie_mask)
+        self._send_round_request(datapath, req)
+
+    def _send_round_request(self, datapath, req):
+        datapath.set_xid(req)
+        self.rounds.register_request(datapath.id, req.xid)
         datapath.send_msg(req)
 
+    def _update_poll_interval(self, dpid: int, speeds_bps: np.ndarray):
+        """
+        Tighten the poll interval of a datapath if any of its flows is changing or close to its limit.
+        """
+        fsm = self.stats[dpid]
+        limits = self.qos_manager.flows_limits
+        urgent = AdaptivePoller.is_urgent(speeds_bps, fsm.export_speed_variances_array() * 64,
+                                          (limits[flow].limit if flow in limits else -1 for flow in fsm.flows))
+        self.poller.update(dpid, urgent)
+
+    def _start_of_reply(self, ev) -> float:
+        """
+        Record how long a stats reply has waited in the event queue of the application.
+
+        :return: The start of the handling, for `_end_of_reply`.
+        """
+        now = time.time()
+        if hasattr(ev, "queued_at"):
+            self.reply_delay.record(now - ev.queued_at)
+            metrics.STATS_REPLY_QUEUED_SECONDS.observe(now - ev.queued_at)
+        return now
+
+    def _end_of_reply(self, ev, started: float, reply_type: str):
+        """
+        Tell the round tracker that a part of a stats reply has been processed.
+
+        :param started: The return value of `_start_of_reply`.
+        :param reply_type: The label of the reply in the metrics.
+        """
+        msg = ev.msg
+        metrics.STATS_REPLY_PARSE_SECONDS.labels(type=reply_type).observe(time.time() - started)
+        more = bool(msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+        self.rounds.reply(msg.datapath.id, msg.xid, more)
+
     def _flow_stats_logger(self):
         while self.is_active:
             # Collect and order entries
             statentries = []
             for dpid, flowstats in self.stats.items():
                 for flow, avg_speed in flowstats.export_avg_speeds_bps('M').items():
-                    statentries.append((dpid, self.datapaths[dpid].cname,
-                                        flow.ipv4_dst, flow.udp_dst,
+                    statentries.append((flow, dpid, self.datapaths[dpid].cname,
+                                        flow.ipv4_dst, flow.udp_dst_spec,
                                         avg_speed,
                                         self.qos_manager.get_current_limit(flow) / 10 ** 6,
                                         self.qos_manager.get_initial_limit(flow) / 10 ** 6))
-            # Sort by flows first and then by dpid (=switch)
-            statentries = sorted(statentries, key=lambda entry: (entry[2:4], entry[0]))
+            # Sort by flows first and then by dpid (=switch), and drop the flow
+            statentries = [entry[1:] for entry in sorted(statentries, key=lambda entry: (
+                entry[0].ipv4_dst, entry[0].udp_dst, entry[1]))]
 
             # Print stat log
             header_fields = ('datapath', 'ipv4-dst', 'udp-dst', 'avg-speed (Mb/s)', 'current limit (Mb/s)',
@@ -168,7 +603,7 @@ class AdaptingMonitor13(app_manager.RyuApp):
                                  ('-' * 10, '-' * 10, '-' * 7, '-' * 16, '-' * 20, '-' * 20))
                 # Log statistics
                 for entry in statentries:
-                    self.logger.info('%10s %10s %7d %16.2f %20.2f %20.2f' % entry[1:])  # [1:] -> without dpid
+                    self.logger.info('%10s %10s %7s %16.2f %20.2f %20.2f' % entry[1:])  # [1:] -> without dpid
             elif self.__class__.STAT_LOG_FORMAT == "csv":
                 # self.logger.info(",".join(header_fields))
                 for entry in statentries:
@@ -179,14 +614,102 @@ class AdaptingMonitor13(app_manager.RyuApp):
 
             hub.sleep(1)
 
+    def _flow_stats_recorder(self):
+        """
+        Record the speed and the limits of every flow per second, like `_flow_stats_logger` but in binary.
+        """
+        recorder = Recorder(Recorder.DIRECTORY)
+        self.logger.info("Recording flow statistics to %s.", Recorder.DIRECTORY)
+        try:
+            while self.is_active:
+                timestamp = time.time()
+                current, initial = self.qos_manager.get_limits_arrays()
+                for dpid, flowstats in list(self.stats.items()):
+                    flows = flowstats.flows
+                    # Rows are appended to a FlowStatManager, so the translation is valid until it grows. Removed
+                    # slices move rows, which clears the cache.
+                    cached = self._record_rows.get(dpid)
+                    if cached is None or cached[0] != len(flows):
+                        recorder.set_datapath_name(dpid, self.datapaths[dpid].cname)
+                        cached = (len(flows), recorder.flow_indices(flows), self.qos_manager.limit_rows(flows))
+                        self._record_rows[dpid] = cached
+                    _, indices, rows = cached
+                    recorder.append(timestamp, dpid, indices, flowstats.export_avg_speeds_bps_array()[:len(indices)],
+                                    current[rows], initial[rows])
+                hub.sleep(1)
+        finally:
+            recorder.close()
+
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
-        body = ev.msg.body
-        flowstats = sorted([flow for flow in body if flow.priority == 1 and flow.table_id == 0],
-                           key=lambda flow: (flow.match['ipv4_dst'], flow.match['udp_dst']))
-        dpid = ev.msg.datapath.id
-        for stat in flowstats:
-            # WARNING: stat.byte_count is the number of bytes that MATCHED the rule, not the number of bytes
-            # that have finally been transmitted. This is not a problem for us, but it is important to know
-            flow = FlowId(stat.match['ipv4_dst'], stat.match['udp_dst'])
-            self.stats[dpid].put(flow, stat.byte_count)
+        started = self._start_of_reply(ev)
+        msg = ev.msg
+        dpid = msg.datapath.id
+        ingest = self.ingest.get(dpid)
+        if ingest is None:
+            return
+        # A flow covering several rules, e.g. a range of ports, may be spread over the parts of a multipart reply, so
+        # the byte counts are summed until the last part. The whole reply gets the time of its first part.
+        ingest.add(msg.xid, msg.body, getattr(ev, "queued_at", started), msg.msg_len)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            ingest.finish(msg.xid)
+            speeds_bps = self.stats[dpid].export_avg_speeds_bps_array()
+            self.max_speeds.update(dpid, zip(self.stats[dpid].flows, speeds_bps.tolist()))
+            self._update_poll_interval(dpid, speeds_bps)
+        self._end_of_reply(ev, started, "flow")
+
+    @set_ev_cls(ofp_event.EventOFPQueueStatsReply, MAIN_DISPATCHER)
+    def _queue_stats_reply_handler(self, ev):
+        started = self._start_of_reply(ev)
+        msg = ev.msg
+        dpid = msg.datapath.id
+        replies = self.queue_replies.get(dpid)
+        if replies is None:
+            return
+        queue_flows = {queue_id: flow for flow, queue_id in self.qos_manager.get_queue_ids().items()}
+        # A queue of a flow exists on several ports, which may be spread over the parts of a multipart reply. The
+        # traffic of the flow is the sum of them, so [tx_bytes, tx_errors] are summed per flow until the last part.
+        sums: Dict[FlowId, List[int]] = replies.part(msg.xid, getattr(ev, "queued_at", started), msg.msg_len).sums
+        for stat in msg.body:
+            flow = queue_flows.get(stat.queue_id)
+            if flow is None:  # E.g. queue 0 of the unclassified traffic
+                continue
+            totals = sums.get(flow)
+            if totals is None:
+                sums[flow] = [stat.tx_bytes, stat.tx_errors]  # tx_errors: packets dropped due to overrun
+            else:
+                totals[0] += stat.tx_bytes
+                totals[1] += stat.tx_errors
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            reply = replies.finish(msg.xid)
+            for flow, (tx_bytes, tx_errors) in reply.sums.items():
+                self._put_counter(self.stats[dpid], flow, tx_bytes, reply.timestamp)
+                self._put_counter(self.drop_stats[dpid], flow, tx_errors, reply.timestamp)
+                drop_rate = self.drop_stats[dpid].get_avg_speed(flow)
+                if drop_rate > 0:
+                    self.logger.debug("%016x: %s drops %.2f packets/s", dpid, flow, drop_rate)
+            speeds_bps = self.stats[dpid].export_avg_speeds_bps_array()
+            self.max_speeds.update(dpid, zip(self.stats[dpid].flows, speeds_bps.tolist()))
+            self._update_poll_interval(dpid, speeds_bps)
+        self._end_of_reply(ev, started, "queue")
+
+    def _put_counter(self, fsm: BaseFlowStatManager, flow: FlowId, val: int, timestamp: float):
+        """
+        Put a counter value into `fsm`, restarting the statistics of the flow if the counter has been reset.
+
+        Queue counters restart e.g. when the queues of a port are recreated, or a port disappears from the sum.
+        """
+        try:
+            fsm.put(flow, val, timestamp)
+        except ValueError:
+            self.logger.debug("Counter of %s has decreased, restarting its statistics.", flow)
+            fsm.reset(flow)
+            fsm.put(flow, val, timestamp)
+
+
+# The settings `AdaptingMonitor13.reload_config` applies at runtime, key: (class, attribute name)
+LIVE_SETTINGS = {(AdaptingMonitor13, "TIME_STEP"), (AdaptingMonitor13, "ROUND_TIMEOUT"), (QoSManager, "LIMIT_STEP"),
+                 (QoSManager, "DEFAULT_MAX_RATE"), (FlowStat, "WINDOW_SIZE"), (FlowStat, "TIME_CONSTANT"),
+                 (AdaptivePoller, "MIN_INTERVAL"), (AdaptivePoller, "MAX_INTERVAL"),
+                 (AdaptivePoller, "VARIATION_THRESHOLD"), (AdaptivePoller, "LIMIT_PROXIMITY"),
+                 (config_handler.ConfigWatcher, "INTERVAL"), (Topology, "REFRESH_INTERVAL")}
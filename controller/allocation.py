@@ -0,0 +1,107 @@
+from typing import Dict, Iterable
+
+import numpy as np
+
+from flow import FlowId
+
+
+class AllocationEngine:
+    """
+    Batch implementation of the queue limit adaptation algorithm of `QoSManager`.
+
+    The initial limits, current limits and queue ids of the flows are kept in parallel arrays, so a whole adaptation
+    round is a handful of array operations instead of a Python loop over the flows. The results are identical to
+    `benchmark.allocation.pre_adapt_scalar`, which is kept as the reference implementation.
+    """
+
+    def __init__(self, init_limits: Dict[FlowId, int], queue_ids: Dict[FlowId, int]):
+        """
+        Create the engine with every flow at its initial limit.
+
+        :param init_limits: The initial ("customer") rate limit of each flow in bits/s.
+        :param queue_ids: The queue id of each flow. Must have the same keys as `init_limits`.
+        """
+        self.flows = list(init_limits)  # Row number -> FlowId
+        self.index: Dict[FlowId, int] = {flow: row for row, flow in enumerate(self.flows)}
+        self.init_limits = np.array([init_limits[flow] for flow in self.flows], dtype=np.int64)
+        self.limits = self.init_limits.copy()
+        self.queue_ids = np.array([queue_ids[flow] for flow in self.flows], dtype=np.int64)
+
+    def rows(self, flows: Iterable[FlowId]) -> np.ndarray:
+        """
+        Translate flows to row numbers.
+
+        :raises KeyError: If a flow is not managed by the engine.
+        """
+        return np.fromiter((self.index[flow] for flow in flows), dtype=np.intp)
+
+    def add(self, flow: FlowId, init_limit: int, queue_id: int) -> None:
+        """
+        Add a flow at its initial limit in a new last row. The limits of the other flows are kept.
+        """
+        self.index[flow] = len(self.flows)
+        self.flows.append(flow)
+        self.init_limits = np.append(self.init_limits, np.int64(init_limit))
+        self.limits = np.append(self.limits, np.int64(init_limit))
+        self.queue_ids = np.append(self.queue_ids, np.int64(queue_id))
+
+    def remove(self, flow: FlowId) -> None:
+        """
+        Remove a flow. The rows after it move up by one, keeping their limits.
+
+        :raises KeyError: If the flow is not managed by the engine.
+        """
+        row = self.index.pop(flow)
+        del self.flows[row]
+        for moved in self.flows[row:]:
+            self.index[moved] -= 1
+        self.init_limits = np.delete(self.init_limits, row)
+        self.limits = np.delete(self.limits, row)
+        self.queue_ids = np.delete(self.queue_ids, row)
+
+    def set_init_limit(self, flow: FlowId, init_limit: int) -> None:
+        """
+        Change the initial limit of a flow and restart it from there. The limits of the other flows are kept.
+        """
+        row = self.index[flow]
+        self.init_limits[row] = init_limit
+        self.limits[row] = init_limit
+
+    def adapt_rows(self, rows: np.ndarray, loads: np.ndarray, limit_step: int) -> np.ndarray:
+        """
+        Run one adaptation round on the measured loads of the given rows and update `self.limits` in place.
+
+        :param rows: The row numbers of the measured flows. Must not contain duplicates.
+        :param loads: The measured load of each row in bits/s.
+        :param limit_step: See `QoSManager.LIMIT_STEP`.
+        :return: The row numbers whose limit has been updated.
+        """
+        init = self.init_limits[rows]
+        unexploited = loads < init
+        full = ~unexploited
+
+        # Unexploited flows get their limit reduced to the load rounded up to 10% of the initial limit, but not below
+        # the quarter of it. See `benchmark.allocation.pre_adapt_scalar` for the hysteresis conditions.
+        u_rows = rows[unexploited]
+        u_loads = loads[unexploited]
+        u_init = init[unexploited]
+        u_current = self.limits[u_rows]
+        bw_step = 0.1 * u_init
+        newlimit = np.maximum(np.ceil(u_loads / bw_step) * bw_step, u_init / 4)
+        u_update = (np.abs(u_loads - u_current) >= limit_step) & (np.abs(newlimit - u_current) > limit_step)
+        u_current[u_update] = np.trunc(newlimit[u_update]).astype(np.int64)
+        self.limits[u_rows] = u_current
+        overall_gain = int(np.sum(u_init - u_current))
+
+        # Full flows share the gain equally
+        f_rows = rows[full]
+        try:
+            gain_per_flow = overall_gain / len(f_rows)
+        except ZeroDivisionError:
+            gain_per_flow = 0
+        f_current = self.limits[f_rows]
+        newlimit = init[full] + gain_per_flow
+        f_update = np.abs(newlimit - f_current) > limit_step
+        self.limits[f_rows[f_update]] = np.trunc(newlimit[f_update]).astype(np.int64)
+
+        return np.concatenate((u_rows[u_update], f_rows[f_update]))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark of one queue limit adaptation round.
+
+Compares the scalar reference implementation `pre_adapt_scalar` with the batch `AllocationEngine` used by
+`QoSManager._pre_adapt`, and with the engine alone working on prebuilt arrays. Run it from the controller directory with
+`python -m benchmark.allocation`.
+"""
+import argparse
+import functools
+import random
+import time
+from math import ceil
+from typing import Dict
+
+import numpy as np
+
+from allocation import AllocationEngine
+from flow import FlowId
+from qos_manager import QoSManager
+
+
+def pre_adapt_scalar(manager: QoSManager, flowstats: Dict[FlowId, float]) -> bool:
+    """
+    Calculate and locally update the queue limits of `manager`, one flow at a time.
+
+    This is the reference implementation of the adaptation algorithm. `AllocationEngine` must stay identical to it.
+
+    :return: Whether queue update needs to be sent to the switches or not.
+    """
+    modified = False
+    unexploited_flows = [k for k, v in flowstats.items() if v < manager.get_initial_limit(k)]
+    full_flows = [k for k, v in flowstats.items() if v >= manager.get_initial_limit(k)]
+
+    overall_gain = 0  # b/s which is available extra after rate reduction
+
+    for flow in unexploited_flows:
+        load = flowstats[flow]
+        original_limit = manager.get_initial_limit(flow)
+        bw_step = 0.1 * original_limit  # The granularity in which adaptation happens
+        newlimit = max(ceil(load / bw_step) * bw_step, original_limit / 4)
+
+        # Update the flows bandwidth limit only if _both the load and the new limit_ are further away from the current
+        # limit than LIMIT_STEP. This dual condition is to avoid flapping of bandwidth settings when the load is around
+        # an adaptation point and updating limits on flows with little resource assigned.
+        if abs(load - manager.get_current_limit(flow)) >= QoSManager.LIMIT_STEP and \
+                manager._update_limit(flow, newlimit):  # This only runs if the first condition is true
+            modified = True
+        overall_gain += original_limit - manager.get_current_limit(flow)
+
+    try:
+        gain_per_flow = overall_gain / len(full_flows)
+    except ZeroDivisionError:
+        gain_per_flow = 0
+    for flow in full_flows:
+        if manager._update_limit(flow, manager.get_initial_limit(flow) + gain_per_flow):
+            modified = True
+    return modified
+
+
+def bench(flows: int, rounds: int, seed: int = 0) -> (float, float, float):
+    """
+    Run `rounds` adaptation rounds on `flows` flows with random loads with both implementations.
+
+    :return: The average time of a round in milliseconds for the scalar implementation, the batch implementation and
+    the engine alone.
+    """
+    rnd = random.Random(seed)
+    limits = {FlowId("10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255), 5000): rnd.choice([5, 15, 25]) * 10 ** 6
+              for i in range(flows)}
+    loads = [{flow: rnd.uniform(0, 1.5 * limit) for flow, limit in limits.items()} for _ in range(rounds)]
+
+    times = []
+    for adapt in (functools.partial(pre_adapt_scalar, QoSManager(limits)), QoSManager(limits)._pre_adapt):
+        start = time.perf_counter()
+        for flowstats in loads:
+            adapt(flowstats)
+        times.append((time.perf_counter() - start) * 1000 / rounds)
+
+    engine = AllocationEngine(limits, {flow: qnum for qnum, flow in enumerate(limits, start=1)})
+    arrays = [(engine.rows(flowstats), np.fromiter(flowstats.values(), dtype=np.float64)) for flowstats in loads]
+    start = time.perf_counter()
+    for rows, flow_loads in arrays:
+        engine.adapt_rows(rows, flow_loads, QoSManager.LIMIT_STEP)
+    times.append((time.perf_counter() - start) * 1000 / rounds)
+    return tuple(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flows", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    print('%8s %14s %14s %14s %8s' % ('flows', 'scalar (ms)', 'batch (ms)', 'engine (ms)', 'speedup'))
+    for flows in args.flows:
+        scalar_ms, batch_ms, engine_ms = bench(flows, args.rounds)
+        print('%8d %14.3f %14.3f %14.3f %8.1f' % (flows, scalar_ms, batch_ms, engine_ms, scalar_ms / batch_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the `FlowStat` window and the `FlowStatManager` store.
+
+Measures the cost of one `put` and one speed calculation per flow, as it happens in every monitoring round. Run it
+from the controller directory with `python -m benchmark.flowstat`.
+"""
+import argparse
+import time
+
+from flow import FlowId, FlowStat, FlowStatManager
+
+
+def bench(flows: int, window_size: int, rounds: int) -> (float, float):
+    """
+    Fill `flows` windows for `rounds` rounds and measure the average cost per flow.
+
+    :return: The average time in nanoseconds of a `put` and a `get_avg_speed` call.
+    """
+    stats = [FlowStat(window_size) for _ in range(flows)]
+    put_time = 0
+    get_time = 0
+    for r in range(rounds):
+        timestamp = float(r)
+        start = time.perf_counter_ns()
+        for i, stat in enumerate(stats):
+            stat.put(r * 1000 + i, timestamp)
+        put_time += time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        for stat in stats:
+            stat.get_avg_speed()
+        get_time += time.perf_counter_ns() - start
+    return put_time / (flows * rounds), get_time / (flows * rounds)
+
+
+def bench_manager(flows: int, window_size: int, rounds: int) -> (float, float):
+    """
+    Fill a `FlowStatManager` with `flows` flows for `rounds` rounds and measure the average cost per flow.
+
+    :return: The average time in nanoseconds of a `put` and of exporting the speed of one flow.
+    """
+    fm = FlowStatManager(window_size)
+    flow_ids = [FlowId("10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255), 5000) for i in range(flows)]
+    put_time = 0
+    get_time = 0
+    for r in range(rounds):
+        timestamp = float(r)
+        start = time.perf_counter_ns()
+        for i, flow in enumerate(flow_ids):
+            fm.put(flow, r * 1000 + i, timestamp)
+        put_time += time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        fm.export_avg_speeds_bps_array()
+        get_time += time.perf_counter_ns() - start
+    return put_time / (flows * rounds), get_time / (flows * rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--window-size", type=int, nargs="+", default=[5, 10, 100])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    print('%16s %8s %8s %12s %12s' % ('store', 'flows', 'window', 'put (ns)', 'get (ns)'))
+    for name, func in (('FlowStat', bench), ('FlowStatManager', bench_manager)):
+        for flows in args.flows:
+            for window_size in args.window_size:
+                put_ns, get_ns = func(flows, window_size, args.rounds)
+                print('%16s %8d %8d %12.1f %12.1f' % (name, flows, window_size, put_ns, get_ns))
+
+
+if __name__ == "__main__":
+    main()
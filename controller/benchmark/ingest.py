@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark of the flow stats reply handling.
+
+Flow stats replies are captured from a simulated switch (`datapath_standin.DatapathStandIn`) and parsed by Ryu once,
+then replayed through the per-entry path the monitor used before `ingest.FlowStatsIngest` and through the fast path
+itself. Every path is run at full speed to measure its capacity, then paced at `--rate` entries per second to measure
+the share of the time it keeps the hub busy. The counters restart when the replay wraps around, as after a rule has
+been reinstalled. Run it from the controller directory with `python -m benchmark.ingest`.
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from classifier import SliceClassifier
+from datapath_standin import DatapathStandIn, SyntheticTraffic
+from flow import FlowId, FlowStatManager
+from ingest import FlowStatsIngest
+from rule_installer import QOS_TABLE_ID, RULE_COOKIE, RULE_COOKIE_MASK, RULE_PRIORITY, RuleInstaller
+
+
+def capture(entries: int, replies: int) -> List[list]:
+    """
+    Capture consecutive flow stats replies of a switch with a rule per host.
+
+    :return: The parsed parts of every reply.
+    """
+    flows = [FlowId("10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255), 5000) for i in range(entries)]
+    buffers = []
+    dp = DatapathStandIn(1, 4, buffers.append, SyntheticTraffic({flow: 1000.0 for flow in flows}))
+    installer = RuleInstaller()
+    for queue_id, flow in enumerate(flows, start=1):
+        dp.send_msg(installer.flow_mod(dp, flow, queue_id))
+    captured = []
+    for _ in range(replies):
+        buffers.clear()
+        dp.send_msg(ofproto_v1_3_parser.OFPFlowStatsRequest(
+            dp, table_id=QOS_TABLE_ID, out_port=ofproto_v1_3.OFPP_ANY, out_group=ofproto_v1_3.OFPG_ANY,
+            cookie=RULE_COOKIE, cookie_mask=RULE_COOKIE_MASK))
+        captured.append([dp.parse(buf) for buf in buffers])
+        time.sleep(0.001)
+    return captured
+
+
+def per_entry_path(classifier: SliceClassifier) -> Callable[[list, float], None]:
+    """
+    The handling of a reply before the fast path: a FlowId lookup per entry, a sort and a `put` per flow.
+    """
+    fsm = FlowStatManager()
+    counters: Dict[int, Dict[FlowId, int]] = {}
+
+    def handle(parts: list, timestamp: float) -> None:
+        for msg in parts:
+            sums = counters.setdefault(msg.xid, {})
+            for stat in msg.body:
+                if stat.priority != RULE_PRIORITY or stat.table_id != QOS_TABLE_ID:
+                    continue
+                flow = classifier.classify(stat.match['ipv4_dst'], stat.match['udp_dst'])
+                if flow is not None:
+                    sums[flow] = sums.get(flow, 0) + stat.byte_count
+            if not msg.flags & ofproto_v1_3.OFPMPF_REPLY_MORE:
+                sums = counters.pop(msg.xid)
+                for flow in sorted(sums, key=lambda flow: (flow.ipv4_dst, flow.udp_dst)):
+                    try:
+                        fsm.put(flow, sums[flow], timestamp)
+                    except ValueError:
+                        fsm.reset(flow)
+                        fsm.put(flow, sums[flow], timestamp)
+    return handle
+
+
+def fast_path(classifier: SliceClassifier) -> Callable[[list, float], None]:
+    ingest = FlowStatsIngest(FlowStatManager(), classifier)
+
+    def handle(parts: list, timestamp: float) -> None:
+        for msg in parts:
+            ingest.add(msg.xid, msg.body, timestamp, msg.msg_len)
+            if not msg.flags & ofproto_v1_3.OFPMPF_REPLY_MORE:
+                ingest.finish(msg.xid)
+    return handle
+
+
+def capacity(handle: Callable[[list, float], None], captured: List[list], entries: int, rounds: int) -> float:
+    """
+    :return: The entries handled per second at full speed.
+    """
+    handle(captured[0], 0.0)  # Warm up the caches
+    start = time.perf_counter()
+    for r in range(rounds):
+        handle(captured[r % len(captured)], float(r + 1))
+    return entries * rounds / (time.perf_counter() - start)
+
+
+def paced(handle: Callable[[list, float], None], captured: List[list], entries: int, rate: float,
+          duration: float) -> (float, float):
+    """
+    Replay the replies at `rate` entries per second.
+
+    :return: The achieved rate in entries per second, and the share of the time spent handling the replies.
+    """
+    interval = entries / rate
+    busy = 0.0
+    count = 0
+    start = time.perf_counter()
+    next_reply = start
+    while time.perf_counter() - start < duration:
+        began = time.perf_counter()
+        handle(captured[count % len(captured)], time.time())
+        busy += time.perf_counter() - began
+        count += 1
+        next_reply += interval
+        time.sleep(max(0.0, next_reply - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    return count * entries / elapsed, busy / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000], help="Rules per reply")
+    parser.add_argument("--replies", type=int, default=5, help="Consecutive replies captured and replayed in turn")
+    parser.add_argument("--rounds", type=int, default=50, help="Replies handled to measure the capacity")
+    parser.add_argument("--rate", type=float, default=100000, help="Entries per second of the paced replay")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of the paced replay")
+    args = parser.parse_args()
+
+    print('%10s %8s %16s %16s %10s' % ('path', 'entries', 'capacity (e/s)', 'replayed (e/s)', 'busy (%)'))
+    for entries in args.entries:
+        captured = capture(entries, args.replies)
+        classifier = SliceClassifier(FlowId("10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255), 5000)
+                                     for i in range(entries))
+        for name, path in (('per-entry', per_entry_path), ('fast', fast_path)):
+            max_rate = capacity(path(classifier), captured, entries, args.rounds)
+            replayed, busy = paced(path(classifier), captured, entries, args.rate, args.duration)
+            print('%10s %8d %16.0f %16.0f %10.1f' % (name, entries, max_rate, replayed, busy * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+End-to-end scale benchmark of `AdaptingMonitor13` with `ThreadedQoSManager`.
+
+Every scenario runs the Ryu application in its own process against simulated OpenFlow 1.3 switches
+(`datapath_standin.DatapathStandIn`) and a local stand-in of the rest_qos API (`rest_standin.RestQoSStandIn`). The
+throughput and latency percentiles of stats handling, adaptation and queue pushes are taken from the metrics of the
+application and saved as JSON, so that runs can be compared. Run it from the controller directory with
+`python -m benchmark.scale`, and compare with an earlier run with `--compare`.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue as queue_module
+import random
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import yaml
+
+from rest_standin import RestQoSStandIn
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _flows(count: int) -> List[dict]:
+    return [{"ipv4_dst": "10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255), "udp_dst": 5000,
+             "base_ratelimit": random.Random(i).choice([5, 15, 25]) * 10 ** 6} for i in range(count)]
+
+
+def _histogram_summary(histogram, duration: float) -> Dict[str, float]:
+    count = sum(histogram.counts)
+    summary = {"count": count, "per_s": count / duration}
+    for q in QUANTILES:
+        summary["p%d_ms" % (q * 100)] = histogram.quantile(q) * 1000
+    return summary
+
+
+def run_scenario(switches: int, flows: int, args: argparse.Namespace, rest_url: str) -> dict:
+    """
+    Run one scenario in the current process, which must be a fresh one.
+
+    :return: The results of the scenario.
+    """
+    from ryu.lib import hub
+    hub.patch(thread=False)  # Like ryu-manager
+
+    from ryu.base import app_manager
+    from ryu.controller import ofp_event
+    from ryu.controller.handler import MAIN_DISPATCHER
+
+    import metrics
+    from adapting_monitor_13 import AdaptingMonitor13
+    from datapath_standin import DatapathStandIn, SyntheticTraffic
+    from flow import FlowId
+
+    workdir = tempfile.mkdtemp(prefix="scale-benchmark-")
+    flow_defs = _flows(flows)
+    config = {"flows": flow_defs, "controller_baseurl": rest_url, "ovsdb_addr": "tcp:127.0.0.1:6640",
+              "time_step": args.time_step, "stat_log_format": "binary",
+              "stat_record_dir": os.path.join(workdir, "stats"), "metrics_addr": ""}
+    config_path = os.path.join(workdir, "config.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    os.environ["CONFIG_FILE"] = config_path
+
+    app = AdaptingMonitor13()
+    app_manager.register_app(app)
+    app.start()
+
+    # Flows load between 20% and 150% of their limit, and a share of them changes its rate every second
+    rnd = random.Random(0)
+    limits = {FlowId(f["ipv4_dst"], f["udp_dst"]): f["base_ratelimit"] for f in flow_defs}
+    traffic = SyntheticTraffic({flow: rnd.uniform(0.2, 1.5) * limit / 8 for flow, limit in limits.items()})
+
+    def deliver_to(dp):
+        def deliver(buf):
+            hub.spawn_after(args.switch_latency, lambda: app._send_event(
+                ofp_event.ofp_msg_to_ev(dp.parse(buf)), MAIN_DISPATCHER))
+        return deliver
+
+    started = time.time()
+    datapaths = []
+    for dpid in range(1, switches + 1):
+        dp = DatapathStandIn(dpid, args.ports, None, traffic)
+        dp.deliver = deliver_to(dp)
+        datapaths.append(dp)
+        ev = ofp_event.EventOFPStateChange(dp)
+        ev.state = MAIN_DISPATCHER
+        app._send_event(ev, MAIN_DISPATCHER)
+    while len(app.dispatcher.futures) < switches:
+        hub.sleep(0.01)
+    app.dispatcher.wait_all()
+    configured = time.time() - started
+
+    metrics.REGISTRY.reset()
+    started = time.time()
+    flow_list = list(limits)
+    while time.time() - started < args.duration:
+        now = time.time()
+        for flow in rnd.sample(flow_list, int(len(flow_list) * args.churn)):
+            traffic.set_rate(flow, rnd.uniform(0.2, 1.5) * limits[flow] / 8, now)
+        hub.sleep(1)
+    duration = time.time() - started
+
+    requests = sum(dp.received.get("OFPFlowStatsRequest", 0) for dp in datapaths)
+    results = {
+        "switches": switches,
+        "flows": flows,
+        "configuration_s": configured,
+        "stats_requests_per_s": requests / duration,
+        "stats_handling": _histogram_summary(metrics.STATS_REPLY_PARSE_SECONDS.labels(type="flow"), duration),
+        "stats_queueing": _histogram_summary(metrics.STATS_REPLY_QUEUED_SECONDS, duration),
+        "adaptation": _histogram_summary(metrics.PRE_ADAPT_SECONDS, duration),
+        "queue_push": _histogram_summary(metrics.REST_REQUEST_SECONDS.labels(endpoint="POST /qos/queue"), duration),
+        "round_to_applied": _histogram_summary(metrics.ROUND_TO_APPLIED_SECONDS, duration),
+        "skipped_adaptations": metrics.SKIPPED_OPERATIONS.labels(operation="adapt_queues").value,
+    }
+    app.stop()
+    return results
+
+
+def _scenario_process(switches: int, flows: int, args: argparse.Namespace, rest_url: str, queue) -> None:
+    queue.put(run_scenario(switches, flows, args, rest_url))
+
+
+def _wait_for_result(process, queue) -> Optional[dict]:
+    """
+    Wait for the results of a scenario process.
+
+    :return: None if the process has exited without results, e.g. crashed.
+    """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except queue_module.Empty:
+            if not process.is_alive():
+                break
+    try:  # The results may have arrived while the process was exiting
+        return queue.get(timeout=1)
+    except queue_module.Empty:
+        return None
+
+
+def compare(old: dict, new: dict) -> None:
+    """
+    Print the relative change of the main figures of the scenarios present in both runs.
+    """
+    old_results = {(r["switches"], r["flows"]): r for r in old["results"]}
+    print('%8s %8s %22s %12s %12s %8s' % ('switches', 'flows', 'figure', 'old', 'new', 'change'))
+    for result in new["results"]:
+        key = (result["switches"], result["flows"])
+        if key not in old_results:
+            continue
+        for section in ("stats_handling", "adaptation", "queue_push", "round_to_applied"):
+            for figure in ("p50_ms", "p99_ms"):
+                before, after = old_results[key][section][figure], result[section][figure]
+                change = (after - before) / before * 100 if before else float("nan")
+                print('%8d %8d %22s %12.3f %12.3f %7.1f%%' % (
+                    key[0], key[1], "%s %s" % (section, figure), before, after, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--switches", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--flows", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--ports", type=int, default=4, help="Ports per switch")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to measure per scenario")
+    parser.add_argument("--time-step", type=int, default=2)
+    parser.add_argument("--churn", type=float, default=0.1, help="Share of flows changing rate every second")
+    parser.add_argument("--switch-latency", type=float, default=0.001, help="Seconds for a switch to answer")
+    parser.add_argument("--rest-delay", type=float, default=0.005, help="Seconds for rest_qos to answer")
+    parser.add_argument("--output", help="Where to save the results. Defaults to benchmark/results/scale-<time>.json")
+    parser.add_argument("--compare", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    rest = RestQoSStandIn(delay=args.rest_delay).start()
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    failures = []
+    print('%8s %8s %10s %12s %12s %12s %12s %12s' % ('switches', 'flows', 'config (s)', 'stats/s', 'stats p99',
+                                                     'adapt p99', 'push p99', 'e2e p99 (ms)'))
+    try:
+        for switches in args.switches:
+            for flows in args.flows:
+                queue = ctx.Queue()
+                process = ctx.Process(target=_scenario_process, args=(switches, flows, args, rest.url, queue))
+                process.start()
+                result = _wait_for_result(process, queue)
+                process.join()
+                if result is None:
+                    print('%8d %8d failed, the scenario process exited with code %s' % (switches, flows,
+                                                                                        process.exitcode))
+                    failures.append({"switches": switches, "flows": flows, "exitcode": process.exitcode})
+                    continue
+                results.append(result)
+                print('%8d %8d %10.2f %12.1f %12.3f %12.3f %12.3f %12.3f' % (
+                    switches, flows, result["configuration_s"], result["stats_handling"]["per_s"],
+                    result["stats_handling"]["p99_ms"], result["adaptation"]["p99_ms"],
+                    result["queue_push"]["p99_ms"], result["round_to_applied"]["p99_ms"]))
+    finally:
+        rest.stop()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    run = {"timestamp": time.time(), "commit": commit, "args": vars(args), "results": results, "failures": failures}
+    output = args.output or os.path.join(os.path.dirname(__file__), "results",
+                                         time.strftime("scale-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print("Results saved to %s" % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
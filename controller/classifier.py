@@ -0,0 +1,111 @@
+import bisect
+import socket
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from flow import FlowId
+
+CACHE_SIZE = 1 << 16  # Maximum number of cached lookups of `SliceClassifier.classify`
+
+
+def _address(address: str) -> int:
+    return struct.unpack("!I", socket.inet_aton(address))[0]
+
+
+class _Node:
+    __slots__ = ("children", "starts", "ends", "slices")
+
+    def __init__(self):
+        self.children: List[Optional[_Node]] = [None, None]
+        # The slices whose prefix ends at this node, sorted by their first port
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.slices: List[FlowId] = []
+
+    def find(self, port: int) -> Optional[FlowId]:
+        i = bisect.bisect_right(self.starts, port) - 1
+        if i >= 0 and port <= self.ends[i]:
+            return self.slices[i]
+        return None
+
+
+class SliceClassifier:
+    """
+    Map destination addresses and ports to the slices containing them.
+
+    The slices are stored in a binary trie of their prefixes, every node holding the port ranges of the slices of its
+    prefix in sorted order. A lookup walks at most 32 nodes and bisects the port ranges of the prefixes on the way. The
+    slices must not overlap, so an address and port belongs to at most one slice.
+    """
+
+    def __init__(self, slices: Iterable[FlowId]):
+        """
+        :raises ValueError: If two slices overlap.
+        """
+        self._root = _Node()
+        self._cache: Dict[Tuple[Union[str, tuple], int], Optional[FlowId]] = {}
+        # Shorter prefixes first, so overlaps only need to be checked against the nodes on the way
+        for flow in sorted(slices, key=lambda f: f.network()[1]):
+            self._insert(flow)
+
+    def _insert(self, flow: FlowId) -> None:
+        address, prefixlen = flow.network()
+        address = _address(address)
+        first, last = flow.ports()[0], flow.ports()[-1]
+        node = self._root
+        for depth in range(prefixlen + 1):
+            i = bisect.bisect_right(node.starts, last) - 1
+            if i >= 0 and node.ends[i] >= first:
+                raise ValueError("Slice {} overlaps {}".format(flow, node.slices[i]))
+            if depth == prefixlen:
+                break
+            bit = (address >> (31 - depth)) & 1
+            if node.children[bit] is None:
+                node.children[bit] = _Node()
+            node = node.children[bit]
+        i = bisect.bisect(node.starts, first)
+        node.starts.insert(i, first)
+        node.ends.insert(i, last)
+        node.slices.insert(i, flow)
+
+    def lookup(self, address: int, port: int, prefixlen: int = 32) -> Optional[FlowId]:
+        """
+        Find the slice of a destination.
+
+        :param address: The IPv4 address as an integer.
+        :param prefixlen: Only consider the slices with at most this prefix length, e.g. to classify a rule matching a
+        prefix rather than a host.
+        :return: The slice, or None if the destination is not in any slice.
+        """
+        node = self._root
+        for depth in range(prefixlen + 1):
+            flow = node.find(port) if node.starts else None
+            if flow is not None:
+                return flow
+            if depth == prefixlen:
+                break
+            node = node.children[(address >> (31 - depth)) & 1]
+            if node is None:
+                break
+        return None
+
+    def classify(self, ipv4_dst: Union[str, Tuple[str, str]], udp_dst: int) -> Optional[FlowId]:
+        """
+        Find the slice of the destination of an OpenFlow match, with a cache as the rules of the switches repeat.
+
+        :param ipv4_dst: The ipv4_dst field of the match: an address, or an (address, mask) pair.
+        """
+        key = (ipv4_dst, udp_dst)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if isinstance(ipv4_dst, tuple):
+            address, mask = ipv4_dst
+            flow = self.lookup(_address(address), udp_dst, bin(_address(mask)).count("1"))
+        else:
+            flow = self.lookup(_address(ipv4_dst), udp_dst)
+        if len(self._cache) >= CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = flow
+        return flow
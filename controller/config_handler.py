@@ -1,3 +1,8 @@
+import logging
+import os
+from copy import copy
+from typing import Any, Dict, Iterable, Optional, Tuple
+
 import yaml
 
 
@@ -34,3 +39,76 @@ class ConfigHandler:
                 break
         if len(missing) > 0:
             raise ConfigError("The following keys are missing from the config: {}".format(missing))
+
+
+def class_settings(classes: Iterable[type]) -> Dict[Tuple[type, str], Any]:
+    """
+    Take a copy of the settings of the classes, i.e. their public upper case attributes which `configure` sets.
+
+    :return: The value of every setting, key: (class, attribute name).
+    """
+    return {(cls, name): copy(value) for cls in classes for name, value in vars(cls).items()
+            if name.isupper() and not name.startswith("_") and not callable(value)}
+
+
+def restore_settings(settings: Dict[Tuple[type, str], Any]) -> None:
+    """
+    Set the class attributes back to the values taken by `class_settings`.
+    """
+    for (cls, name), value in settings.items():
+        setattr(cls, name, value)
+
+
+class ConfigWatcher:
+    """
+    Detect changes of the config file by polling its modification time, size and inode.
+
+    Replacing the file, as most editors do, is detected as well as writing it in place. A change is only reported once
+    the file has stayed the same for one check, so a file in the middle of being written is not read.
+    """
+
+    INTERVAL = 2.0  # Seconds between two checks of the config file, 0 disables the reload
+
+    @classmethod
+    def configure(cls, ch: ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "config_reload_interval" in ch.config:
+            cls.INTERVAL = float(ch.config["config_reload_interval"])
+            logger.info("config_reload_interval set to {}".format(cls.INTERVAL))
+        else:
+            logger.debug("config_reload_interval not set")
+
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self._stamp = self._read_stamp()
+        self._pending: Optional[Tuple[int, int, int]] = None  # The stamp of a change seen at the previous check
+
+    def _read_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.config_path)
+        except OSError:  # E.g. in the middle of being replaced
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def changed(self) -> bool:
+        """
+        :return: Whether the file has changed since it was last reported, or since the creation of the watcher, and
+        has not changed since the previous call.
+        """
+        stamp = self._read_stamp()
+        if stamp is None or stamp == self._stamp:
+            self._pending = None
+            return False
+        if stamp != self._pending:
+            self._pending = stamp
+            return False
+        self._stamp = stamp
+        self._pending = None
+        return True
@@ -0,0 +1,202 @@
+import ipaddress
+import struct
+import time
+from collections import namedtuple
+from typing import Callable, Dict, List, Tuple
+
+from ryu.ofproto import ofproto_parser, ofproto_v1_3, ofproto_v1_3_parser
+
+from flow import FlowId
+
+MAX_MESSAGE_SIZE = 0xffff  # OpenFlow messages have a 16 bit length
+_BYTE_COUNT_OFFSET = 40  # Offset of packet_count, then byte_count in ofp_flow_stats
+
+StandInPort = namedtuple("StandInPort", ("port_no", "name"))
+
+
+class SyntheticTraffic:
+    """
+    The traffic of the flows, with rates that can change over time. Can be shared by several switches.
+    """
+
+    def __init__(self, rates: Dict[FlowId, float] = None, default_rate: float = 0.0):
+        """
+        :param rates: The initial traffic of the flows in Bytes/s.
+        :param default_rate: The traffic of the flows without a rate in Bytes/s.
+        """
+        now = time.time()
+        self.default_rate = default_rate
+        self._rates: Dict[FlowId, Tuple[float, float, float]] = {}  # FlowId -> (rate, since, bytes until since)
+        for flow, rate in ({} if rates is None else rates).items():
+            self._rates[flow] = (rate, now, 0.0)
+
+    def set_rate(self, flow: FlowId, rate: float, now: float = None) -> None:
+        if now is None:
+            now = time.time()
+        self._rates[flow] = (rate, now, self.bytes(flow, now))
+
+    def bytes(self, flow: FlowId, now: float) -> float:
+        """
+        :return: The number of bytes the flow has sent until `now`.
+        """
+        rate, since, sent = self._rates.get(flow, (self.default_rate, 0.0, 0.0))
+        return sent + rate * (now - since)
+
+
+class _Rule:
+    """A flow table entry of the stand-in, with its ofp_flow_stats encoding without the counters."""
+
+    def __init__(self, mod: ofproto_v1_3_parser.OFPFlowMod, flow: FlowId, queue_id: int, traffic: SyntheticTraffic):
+        self.table_id = mod.table_id
+        self.priority = mod.priority
+        self.cookie = mod.cookie
+        self.flow = flow
+        self.queue_id = queue_id
+        self.installed = time.time()
+        self.offset = traffic.bytes(flow, self.installed)  # The traffic before the rule has been installed
+
+        buf = bytearray(ofproto_v1_3.OFP_FLOW_STATS_0_SIZE)
+        mod.match.serialize(buf, len(buf))
+        for instruction in mod.instructions:
+            instruction.serialize(buf, len(buf))
+        struct.pack_into(ofproto_v1_3.OFP_FLOW_STATS_0_PACK_STR, buf, 0, len(buf), mod.table_id, 0, 0,
+                         mod.priority, mod.idle_timeout, mod.hard_timeout, mod.flags, mod.cookie, 0, 0)
+        self.template = bytes(buf)
+
+
+class DatapathStandIn:
+    """
+    Simulated OpenFlow 1.3 switch, to benchmark the controller without Mininet.
+
+    It takes the place of `ryu.controller.controller.Datapath` for the applications: the messages sent to it are
+    serialized as for a real switch and answered with encoded replies. The counters of the rules installed by FlowMods
+    follow a `SyntheticTraffic`. The replies are passed to `deliver` as raw bytes, to be parsed with `parse` the same
+    way Ryu parses the messages of a real switch.
+    """
+
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, dpid: int, port_count: int, deliver: Callable[[bytes], None], traffic: SyntheticTraffic = None):
+        """
+        :param port_count: The number of ports besides the local port named after the switch.
+        :param deliver: Called with every reply of the switch.
+        :param traffic: The traffic of the flows. Defaults to no traffic.
+        """
+        self.id = dpid
+        self.xid = 0
+        name = "s%d" % dpid
+        self.ports = {ofproto_v1_3.OFPP_LOCAL: StandInPort(ofproto_v1_3.OFPP_LOCAL, name.encode())}
+        for port_no in range(1, port_count + 1):
+            self.ports[port_no] = StandInPort(port_no, ("%s-eth%d" % (name, port_no)).encode())
+        self.deliver = deliver
+        self.traffic = SyntheticTraffic() if traffic is None else traffic
+        self.rules: Dict[Tuple[int, int, FlowId], _Rule] = {}  # Key: table_id, priority, FlowId
+        self.received: Dict[str, int] = {}  # Number of messages received per message type
+
+    def set_xid(self, msg) -> int:
+        self.xid = (self.xid + 1) & ofproto_v1_3.MAX_XID
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg, close_socket=False) -> bool:
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        name = type(msg).__name__
+        self.received[name] = self.received.get(name, 0) + 1
+        if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod):
+            self._flow_mod(msg)
+        elif isinstance(msg, ofproto_v1_3_parser.OFPBarrierRequest):
+            self._reply(ofproto_v1_3.OFPT_BARRIER_REPLY, msg.xid, b"")
+        elif isinstance(msg, ofproto_v1_3_parser.OFPFlowStatsRequest):
+            self._flow_stats(msg)
+        elif isinstance(msg, ofproto_v1_3_parser.OFPQueueStatsRequest):
+            self._queue_stats(msg)
+        return True
+
+    def add_rule(self, mod: ofproto_v1_3_parser.OFPFlowMod) -> None:
+        """
+        Install a rule as if it had been sent by another application, e.g. rest_qos.
+        """
+        self._flow_mod(mod)
+
+    def _flow_mod(self, mod: ofproto_v1_3_parser.OFPFlowMod) -> None:
+        ipv4_dst = mod.match["ipv4_dst"]
+        if isinstance(ipv4_dst, tuple):  # A prefix, the traffic is the one of the prefix and the port
+            ipv4_dst = str(ipaddress.IPv4Network("%s/%s" % ipv4_dst))
+        flow = FlowId(ipv4_dst, mod.match["udp_dst"])
+        key = (mod.table_id, mod.priority, flow)
+        if mod.command in (ofproto_v1_3.OFPFC_DELETE, ofproto_v1_3.OFPFC_DELETE_STRICT):
+            self.rules.pop(key, None)
+            return
+        queue_id = 0
+        for instruction in mod.instructions:
+            for action in getattr(instruction, "actions", ()):
+                if isinstance(action, ofproto_v1_3_parser.OFPActionSetQueue):
+                    queue_id = action.queue_id
+        rule = self.rules.get(key)
+        new_rule = _Rule(mod, flow, queue_id, self.traffic)
+        if rule is not None and mod.command != ofproto_v1_3.OFPFC_ADD:  # A modification keeps the counters
+            new_rule.installed, new_rule.offset = rule.installed, rule.offset
+        self.rules[key] = new_rule
+
+    def byte_count(self, rule: _Rule, now: float) -> int:
+        return int(self.traffic.bytes(rule.flow, now) - rule.offset)
+
+    def _reply(self, msg_type: int, xid: int, body: bytes) -> None:
+        header = struct.pack(ofproto_v1_3.OFP_HEADER_PACK_STR, ofproto_v1_3.OFP_VERSION, msg_type,
+                             ofproto_v1_3.OFP_HEADER_SIZE + len(body), xid)
+        self.deliver(header + body)
+
+    def _multipart_reply(self, stats_type: int, xid: int, entries: List[bytes]) -> None:
+        """
+        Send the entries in as many multipart reply messages as needed.
+        """
+        limit = MAX_MESSAGE_SIZE - ofproto_v1_3.OFP_MULTIPART_REPLY_SIZE
+        parts: List[List[bytes]] = [[]]
+        size = 0
+        for entry in entries:
+            if size + len(entry) > limit:
+                parts.append([])
+                size = 0
+            parts[-1].append(entry)
+            size += len(entry)
+        for i, part in enumerate(parts):
+            flags = ofproto_v1_3.OFPMPF_REPLY_MORE if i < len(parts) - 1 else 0
+            self._reply(ofproto_v1_3.OFPT_MULTIPART_REPLY, xid,
+                        struct.pack(ofproto_v1_3.OFP_MULTIPART_REPLY_PACK_STR, stats_type, flags) + b"".join(part))
+
+    def _flow_stats(self, req: ofproto_v1_3_parser.OFPFlowStatsRequest) -> None:
+        now = time.time()
+        entries = []
+        for rule in self.rules.values():
+            if req.table_id not in (ofproto_v1_3.OFPTT_ALL, rule.table_id) or \
+                    (rule.cookie & req.cookie_mask) != (req.cookie & req.cookie_mask):
+                continue
+            entry = bytearray(rule.template)
+            byte_count = self.byte_count(rule, now)
+            struct.pack_into("!QQ", entry, _BYTE_COUNT_OFFSET - 8, byte_count // 1000, byte_count)
+            duration = now - rule.installed
+            struct.pack_into("!II", entry, 4, int(duration), int(duration % 1 * 10 ** 9))
+            entries.append(bytes(entry))
+        self._multipart_reply(ofproto_v1_3.OFPMP_FLOW, req.xid, entries)
+
+    def _queue_stats(self, req: ofproto_v1_3_parser.OFPQueueStatsRequest) -> None:
+        """
+        Report the traffic of every flow on the queue of its rule on the first port.
+        """
+        now = time.time()
+        tx_bytes: Dict[int, int] = {}
+        for rule in self.rules.values():
+            tx_bytes[rule.queue_id] = tx_bytes.get(rule.queue_id, 0) + self.byte_count(rule, now)
+        entries = [struct.pack(ofproto_v1_3.OFP_QUEUE_STATS_PACK_STR, 1, queue_id, count, count // 1000, 0, 0, 0)
+                   for queue_id, count in sorted(tx_bytes.items())]
+        self._multipart_reply(ofproto_v1_3.OFPMP_QUEUE, req.xid, entries)
+
+    def parse(self, buf: bytes):
+        """
+        Parse a reply of the switch into a Ryu message, like `ryu.controller.controller.Datapath` does.
+        """
+        version, msg_type, msg_len, xid = ofproto_parser.header(buf)
+        return ofproto_parser.msg(self, version, msg_type, msg_len, xid, buf[:msg_len])
@@ -0,0 +1,106 @@
+import logging
+from typing import Any, Callable, Dict
+
+import ryu.lib.hub
+
+import config_handler
+
+
+class Completion:
+    """Completion future of a task run by `DatapathDispatcher`."""
+
+    def __init__(self):
+        self._event = ryu.lib.hub.Event()
+        self.result: Any = None
+        self.exception: BaseException = None
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for the task to finish.
+
+        :param timeout: Seconds to wait at most. Waits forever if not set.
+        :return: Whether the task has finished.
+        """
+        return self._event.wait(timeout)
+
+    def set_result(self, result: Any) -> None:
+        self.result = result
+        self._event.set()
+
+    def set_exception(self, exception: BaseException) -> None:
+        self.exception = exception
+        self._event.set()
+
+
+class DatapathDispatcher:
+    """
+    Run per-datapath tasks concurrently on green threads, at most `CONCURRENCY` at a time.
+
+    This keeps the slow configuration of a switch (REST calls, waiting for barriers) out of the OpenFlow event handlers,
+    so many switches can be brought up in parallel.
+    """
+
+    CONCURRENCY = 10  # Maximum number of tasks running at the same time
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "datapath_concurrency" in ch.config:
+            cls.CONCURRENCY = int(ch.config["datapath_concurrency"])
+            logger.info("datapath_concurrency set to {}".format(cls.CONCURRENCY))
+        else:
+            logger.debug("datapath_concurrency not set")
+
+    def __init__(self, concurrency: int = None):
+        """
+        :param concurrency: Maximum number of tasks running at the same time. Defaults to `CONCURRENCY`.
+        """
+        self._sem = ryu.lib.hub.BoundedSemaphore(DatapathDispatcher.CONCURRENCY if concurrency is None else concurrency)
+        self.futures: Dict[int, Completion] = {}  # The completion of the last task submitted per datapath id
+
+        self.__logger = logging.getLogger("dispatcher")
+
+    def submit(self, dpid: int, func: Callable, *args, **kwargs) -> Completion:
+        """
+        Schedule `func(*args, **kwargs)` to run on its own green thread.
+
+        :param dpid: The datapath the task belongs to.
+        :return: The completion future of the task.
+        """
+        future = Completion()
+        self.futures[dpid] = future
+        ryu.lib.hub.spawn(self._run, dpid, future, func, args, kwargs)
+        return future
+
+    def _run(self, dpid: int, future: Completion, func: Callable, args, kwargs) -> None:
+        with self._sem:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                self.__logger.error("Task %s on %016x has failed: %s", func.__name__, dpid, e)
+                future.set_exception(e)
+
+    def forget(self, dpid: int) -> None:
+        """
+        Drop the completion future of a datapath, e.g. when it disconnects. A running task is not interrupted.
+        """
+        self.futures.pop(dpid, None)
+
+    def wait_all(self, timeout: float = None) -> bool:
+        """
+        Wait for the last task of every datapath to finish.
+
+        :param timeout: Seconds to wait at most for each task. Waits forever if not set.
+        :return: Whether every task has finished.
+        """
+        return all([future.wait(timeout) for future in list(self.futures.values())])
@@ -1,41 +1,85 @@
+import abc
+import ipaddress
 import logging
+import math
 import time
 
+from array import array
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
 
 import config_handler
 
 
 @dataclass(frozen=True)
 class FlowId:
-    ipv4_dst: str
-    udp_dst: int
+    ipv4_dst: str  # A host address, or a prefix in CIDR notation for a slice of hosts
+    udp_dst: int  # A port, or the first port of a range
+    udp_dst_max: Optional[int] = None  # The last port of a range, None for a single port
 
     @classmethod
     def from_dict(cls, d: Dict[str, int]):
         """
         Create a FlowId object out of a dictionary, using the properly named fields.
 
-        In case the dictionary does not have the appropriate fields, a TypeError
-        exception is raised.
+        `ipv4_dst` may be a prefix, e.g. "10.1.0.0/16", and `udp_dst` a range of ports, e.g. "5000-5099". In case the
+        dictionary does not have the appropriate fields, a TypeError exception is raised.
 
         :param d: The dictionary to parse.
+        :raises ValueError: If the prefix or the port range is invalid.
         """
         try:
-            return FlowId(d["ipv4_dst"], d["udp_dst"])
+            ipv4_dst, udp_dst = d["ipv4_dst"], d["udp_dst"]
         except KeyError as ex:
             raise TypeError("The given dict is not a proper FlowId, {} is missing.".format(ex)) from ex
+        udp_dst_max = d.get("udp_dst_max")
+        if isinstance(udp_dst, str) and "-" in udp_dst:
+            udp_dst, udp_dst_max = udp_dst.split("-", 1)
+        udp_dst = int(udp_dst)
+        if udp_dst_max is not None:
+            udp_dst_max = int(udp_dst_max)
+            if udp_dst_max < udp_dst:
+                raise ValueError("Invalid port range {}-{}".format(udp_dst, udp_dst_max))
+            if udp_dst_max == udp_dst:
+                udp_dst_max = None
+        if "/" in ipv4_dst:
+            network = ipaddress.IPv4Network(ipv4_dst)
+            ipv4_dst = str(network.network_address) if network.prefixlen == 32 else str(network)
+        return FlowId(ipv4_dst, udp_dst, udp_dst_max)
+
+    def to_dict(self) -> Dict[str, int]:
+        """
+        The inverse of `from_dict`.
+        """
+        d = {"ipv4_dst": self.ipv4_dst, "udp_dst": self.udp_dst}
+        if self.udp_dst_max is not None:
+            d["udp_dst_max"] = self.udp_dst_max
+        return d
+
+    @property
+    def udp_dst_spec(self) -> str:
+        """
+        The port or the range of ports as written in the config, e.g. "5001" or "5000-5099".
+        """
+        return str(self.udp_dst) if self.udp_dst_max is None else "{}-{}".format(self.udp_dst, self.udp_dst_max)
 
+    def ports(self) -> range:
+        return range(self.udp_dst, (self.udp_dst if self.udp_dst_max is None else self.udp_dst_max) + 1)
 
-@dataclass
-class FlowStatEntry:
-    value: int
-    timestamp: float
+    def network(self) -> Tuple[str, int]:
+        """
+        :return: The address and the prefix length of `ipv4_dst`. A host address has a prefix length of 32.
+        """
+        address, _, prefixlen = self.ipv4_dst.partition("/")
+        return address, int(prefixlen) if prefixlen else 32
 
 
 class FlowStat:
     WINDOW_SIZE = 10  # The number of data stored for statistical calculations
+    ESTIMATOR = "window"  # How speeds are estimated, see `ESTIMATORS`
+    TIME_CONSTANT = 10.0  # Seconds for the weight of a measurement to decay by e in the ewma and peak estimators
     SCALING_PREFIXES = {'K': 1 / 1000, 'M': 1 / 1000000, 'G': 1 / 1000000000, None: 1}
 
     @classmethod
@@ -54,12 +98,77 @@ class FlowStat:
         else:
             logger.debug("flowstat_window_size not set")
 
-    def __init__(self):
-        self.data: List[FlowStatEntry] = []
+        if "flowstat_estimator" in ch.config:
+            if ch.config["flowstat_estimator"] not in ESTIMATORS:
+                raise config_handler.ConfigError("config: flowstat_estimator must be one of {}".format(
+                    ", ".join(ESTIMATORS)))
+            cls.ESTIMATOR = ch.config["flowstat_estimator"]
+            logger.info("flowstat_estimator set to {}".format(cls.ESTIMATOR))
+        else:
+            logger.debug("flowstat_estimator not set")
+
+        if "flowstat_time_constant" in ch.config:
+            cls.TIME_CONSTANT = float(ch.config["flowstat_time_constant"])
+            if cls.TIME_CONSTANT <= 0:
+                raise config_handler.ConfigError("config: flowstat_time_constant must be positive")
+            logger.info("flowstat_time_constant set to {}".format(cls.TIME_CONSTANT))
+        else:
+            logger.debug("flowstat_time_constant not set")
+
+    def __init__(self, window_size: int = None):
+        """
+        Create an empty statistics window.
+
+        The samples are stored in a preallocated circular buffer, so putting a new sample neither allocates nor copies.
+
+        :param window_size: The number of samples to keep. If not set, the window follows `FlowStat.WINDOW_SIZE`.
+        """
+        self._follow_config = window_size is None  # Whether the capacity tracks `FlowStat.WINDOW_SIZE`
+        self._capacity = FlowStat.WINDOW_SIZE if window_size is None else int(window_size)
+        if self._capacity < 1:
+            raise ValueError("Window size must be at least 1. Got {}".format(self._capacity))
+        self._values = array('Q', [0]) * self._capacity
+        self._timestamps = array('d', [0.0]) * self._capacity
+        self._head = 0  # Index of the oldest sample
+        self._len = 0  # Number of valid samples
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def window_size(self) -> int:
+        return self._capacity
+
+    def resize(self, window_size: int) -> None:
+        """
+        Change the capacity of the window keeping the most recent samples.
+
+        After an explicit resize the window no longer follows `FlowStat.WINDOW_SIZE`.
+
+        :param window_size: The new number of samples to keep.
+        """
+        self._follow_config = False
+        self._resize(window_size)
+
+    def _resize(self, window_size: int) -> None:
+        window_size = int(window_size)
+        if window_size < 1:
+            raise ValueError("Window size must be at least 1. Got {}".format(window_size))
+        keep = min(self._len, window_size)
+        values = array('Q', [0]) * window_size
+        timestamps = array('d', [0.0]) * window_size
+        for i in range(keep):
+            src = (self._head + self._len - keep + i) % self._capacity
+            values[i] = self._values[src]
+            timestamps[i] = self._timestamps[src]
+        self._values, self._timestamps = values, timestamps
+        self._capacity, self._head, self._len = window_size, 0, keep
 
     def put(self, val: int, timestamp: float = None):
         """
-        Put data in the list for calculating statistics.
+        Put data in the window for calculating statistics.
+
+        If the window follows the configuration and `FlowStat.WINDOW_SIZE` has changed, it is resized first.
 
         :param val: Must be a positive integer and greater than or equal to the last value.
         :raises ValueError: If `val` is semantically incorrect.
@@ -69,17 +178,26 @@ class FlowStat:
 
         if val < 0:
             raise ValueError("Values in need to be positive. Got {}".format(val))
-        try:
-            if val < self.data[-1].value:
-                raise ValueError("Data must show monotonic increase. Passed data is smaller than last one. []".format(
-                    [self.data[-1].value, val])
+        if self._len > 0:
+            last = self._values[(self._head + self._len - 1) % self._capacity]
+            if val < last:
+                raise ValueError("Data must show monotonic increase. Passed data is smaller than last one. {}".format(
+                    [last, val])
                 )
-        except IndexError:
-            pass
-        if len(self.data) < FlowStat.WINDOW_SIZE:
-            self.data.append(FlowStatEntry(val, timestamp))
+        if self._follow_config and self._capacity != FlowStat.WINDOW_SIZE:
+            self._resize(FlowStat.WINDOW_SIZE)
+
+        if self._len < self._capacity:
+            idx = (self._head + self._len) % self._capacity
+            self._len += 1
         else:
-            self.data = self.data[1:] + [FlowStatEntry(val, timestamp)]
+            idx = self._head
+            self._head = (self._head + 1) % self._capacity
+        self._values[idx] = val
+        self._timestamps[idx] = timestamp
+
+    def _last_index(self) -> int:
+        return (self._head + self._len - 1) % self._capacity
 
     def get_avg(self, prefix: str = None) -> float:
         """
@@ -87,15 +205,15 @@ class FlowStat:
 
         :param prefix: A prefix to scale the result with. See possible values in `FlowStat.SCALING_PREFIXES`.
         """
-        if len(self.data) == 0:
+        if self._len == 0:
             return 0
-        elif len(self.data) == 1:
+        elif self._len == 1:
             # This number will not necessarily make sense, but at least it may prevent the QoS manager from decreasing
             # the limits for all flows at the first measurement
-            return self.data[0].value
+            return self._values[self._head]
         else:
-            return (self.data[-1].value - self.data[0].value) * FlowStat.SCALING_PREFIXES[prefix] / \
-                    float(len(self.data) - 1)
+            return (self._values[self._last_index()] - self._values[self._head]) * \
+                FlowStat.SCALING_PREFIXES[prefix] / float(self._len - 1)
 
     def get_avg_speed(self, prefix: str = None) -> float:
         """
@@ -103,12 +221,13 @@ class FlowStat:
 
         :param prefix: See `FlowStat.get_avg` parameter documentation.
         """
-        if len(self.data) <= 1:
+        if self._len <= 1:
             return 0
         else:
+            last = self._last_index()
             try:
-                return (self.data[-1].value - self.data[0].value) * FlowStat.SCALING_PREFIXES[prefix] / \
-                        (self.data[-1].timestamp - self.data[0].timestamp)
+                return (self._values[last] - self._values[self._head]) * FlowStat.SCALING_PREFIXES[prefix] / \
+                    (self._timestamps[last] - self._timestamps[self._head])
             except ZeroDivisionError:
                 return 0
 
@@ -120,10 +239,65 @@ class FlowStat:
         """
         return self.get_avg_speed(prefix) * 8
 
+    def get_speed_variance(self, prefix: str = None) -> float:
+        """
+        Get the variance of the throughput measured between consecutive samples in the window, in **(Bytes/s)^2**.
+
+        At least two intervals are needed, with fewer samples the variance is 0.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+        speeds = []
+        for i in range(self._len - 1):
+            a = (self._head + i) % self._capacity
+            b = (a + 1) % self._capacity
+            dt = self._timestamps[b] - self._timestamps[a]
+            if dt > 0:
+                speeds.append((self._values[b] - self._values[a]) * FlowStat.SCALING_PREFIXES[prefix] / dt)
+        if len(speeds) < 2:
+            return 0
+        mean = sum(speeds) / len(speeds)
+        return sum((speed - mean) ** 2 for speed in speeds) / len(speeds)
+
+
+class BaseFlowStatManager(abc.ABC):
+    """
+    The statistics of the flows of one datapath, one row per flow.
+
+    Every estimator keeps its own state per row and implements `_put_row`, `reset` and `remove`. The lookups and the
+    exports derived from the speed of every flow are shared.
+    """
 
-class FlowStatManager:
     def __init__(self):
-        self.stats: Dict[FlowId, FlowStat] = {}
+        self.flows: List[FlowId] = []  # Row number -> FlowId
+        self.index: Dict[FlowId, int] = {}  # FlowId -> row number
+        # The per-row state is kept in lists, as indexing them is much cheaper than indexing numpy arrays.
+        self._last: List[int] = []  # The newest value per row, for the monotonicity check
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def __contains__(self, flow: FlowId) -> bool:
+        return flow in self.index
+
+    def _add_row(self, flow: FlowId) -> int:
+        """
+        Add a row for a flow. The estimators extend it with their own state of the new row.
+        """
+        row = len(self.flows)
+        self._last.append(0)
+        self.flows.append(flow)
+        self.index[flow] = row
+        return row
+
+    def row(self, flow: FlowId) -> int:
+        """
+        Get the row of a flow for `put_rows`, adding the flow if it is not managed yet.
+
+        The row of a flow only changes when another flow is removed, see `remove`.
+        """
+        row = self.index.get(flow)
+        return self._add_row(flow) if row is None else row
 
     def put(self, flow: FlowId, val: int, timestamp: float = None) -> None:
         """
@@ -131,36 +305,90 @@ class FlowStatManager:
 
         :param flow: The identifier of the Flow.
         :param val: The measurement value.
+        :raises ValueError: If `val` is semantically incorrect. See `FlowStat.put`.
         """
-        try:
-            self.stats[flow].put(val, timestamp)
-        except KeyError:
-            self.stats[flow] = FlowStat()
-            self.stats[flow].put(val, timestamp)
+        if timestamp is None:
+            timestamp = time.time()
+        row = self.row(flow)
+        if val < 0:
+            raise ValueError("Values in need to be positive. Got {}".format(val))
+        if not self._put_row(row, val, timestamp):
+            raise ValueError("Data must show monotonic increase. Passed data is smaller than last one. {}".format(
+                [self._last[row], val])
+            )
 
-    def get_avg(self, flow: FlowId, prefix: str = None) -> float:
+    def put_rows(self, rows: Iterable[int], values: Iterable[int], timestamp: float) -> List[int]:
         """
-        Get the result of `FlowStat.get_avg` for the given flow.
+        Add a record with the same timestamp to each of the given rows, without the flow lookups of `put`.
 
-        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :param rows: The rows, see `row`. Must not contain duplicates.
+        :param values: The non-negative measurement value of each row.
+        :return: The rows whose value is smaller than their newest one. They are left unchanged, see `put`.
         """
-        return self.stats[flow].get_avg(prefix)  # Let the KeyError exception arise if any
+        put_row = self._put_row
+        return [row for row, val in zip(rows, values) if not put_row(row, val, timestamp)]
 
+    @abc.abstractmethod
+    def _put_row(self, row: int, val: int, timestamp: float) -> bool:
+        """
+        :return: False if `val` is smaller than the newest value of the row, which is then left unchanged.
+        """
+
+    @abc.abstractmethod
+    def reset(self, flow: FlowId) -> None:
+        """
+        Drop the samples of a flow, e.g. when its counter has been reset on the switch.
+        """
+
+    @abc.abstractmethod
+    def remove(self, flow: FlowId) -> None:
+        """
+        Forget a flow, e.g. when its slice has been removed. The last row takes its place, so the row of another flow
+        may change.
+        """
+
+    @abc.abstractmethod
     def get_avg_speed(self, flow: FlowId, prefix: str = None) -> float:
         """
-        Get the result of `FlowStat.get_avg_speed` for the given flow.
+        Get the average throughput of the given flow in **Bytes/s**.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+
+    @abc.abstractmethod
+    def export_speed_variances_array(self, prefix: str = None) -> np.ndarray:
+        """
+        Export the speed variance of every flow in **(Bytes/s)^2** in a single array.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :return: An array where the i-th element belongs to the flow `self.flows[i]`.
+        """
+
+    @abc.abstractmethod
+    def export_avg_speeds_array(self, prefix: str = None) -> np.ndarray:
+        """
+        Export the average speed of every flow in **Bytes/s** in a single array.
 
         :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :return: An array where the i-th element belongs to the flow `self.flows[i]`.
         """
-        return self.stats[flow].get_avg_speed(prefix)
 
     def get_avg_speed_bps(self, flow: FlowId, prefix: str = None) -> float:
         """
-        Get the result of `FlowStat.get_avg_bps` for the given flow.
+        Get the average throughput of the given flow in **bits/s**. See `get_avg_speed`.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+        return self.get_avg_speed(flow, prefix) * 8
+
+    def export_avg_speeds_bps_array(self, prefix: str = None) -> np.ndarray:
+        """
+        Export the average speed of every flow in **bits/s** in a single array.
 
         :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :return: An array where the i-th element belongs to the flow `self.flows[i]`.
         """
-        return self.stats[flow].get_avg_speed_bps(prefix)
+        return self.export_avg_speeds_array(prefix) * 8
 
     def export_avg_speeds(self, prefix: str = None) -> Dict[FlowId, float]:
         """
@@ -169,7 +397,7 @@ class FlowStatManager:
         :param prefix: See `FlowStat.get_avg` parameter documentation.
         :return: A Dict of {FlowId, avg_speed}.
         """
-        return {k: v.get_avg_speed(prefix) for (k, v) in self.stats.items()}
+        return dict(zip(self.flows, self.export_avg_speeds_array(prefix).tolist()))
 
     def export_avg_speeds_bps(self, prefix: str = None) -> Dict[FlowId, float]:
         """
@@ -178,4 +406,415 @@ class FlowStatManager:
         :param prefix: See `FlowStat.get_avg` parameter documentation.
         :return: A Dict of {FlowId, avg_speed_bps}.
         """
-        return {k: v.get_avg_speed_bps(prefix) for (k, v) in self.stats.items()}
+        return dict(zip(self.flows, self.export_avg_speeds_bps_array(prefix).tolist()))
+
+
+class FlowStatManager(BaseFlowStatManager):
+    INITIAL_CAPACITY = 16  # The number of flows space is allocated for at first
+
+    def __init__(self, window_size: int = None):
+        """
+        Create a columnar statistics store for the flows of one datapath.
+
+        Every flow is a row in a 2-D counter array and a 2-D timestamp array, both used as circular buffers with the
+        same semantics as `FlowStat`. This lets the exports calculate the speed of every flow in one array operation.
+
+        :param window_size: The number of samples to keep per flow. If not set, it follows `FlowStat.WINDOW_SIZE`.
+        """
+        super().__init__()
+        self._follow_config = window_size is None
+        self._window = FlowStat.WINDOW_SIZE if window_size is None else int(window_size)
+        if self._window < 1:
+            raise ValueError("Window size must be at least 1. Got {}".format(self._window))
+        self._values = np.zeros((self.INITIAL_CAPACITY, self._window), dtype=np.uint64)
+        self._timestamps = np.zeros((self.INITIAL_CAPACITY, self._window), dtype=np.float64)
+        self._head: List[int] = []  # Column of the oldest sample per row
+        self._len: List[int] = []  # Number of valid samples per row
+
+    @property
+    def window_size(self) -> int:
+        return self._window
+
+    def _add_row(self, flow: FlowId) -> int:
+        if len(self.flows) == self._values.shape[0]:
+            self._values = np.concatenate((self._values, np.zeros_like(self._values)))
+            self._timestamps = np.concatenate((self._timestamps, np.zeros_like(self._timestamps)))
+        self._head.append(0)
+        self._len.append(0)
+        return super()._add_row(flow)
+
+    def resize(self, window_size: int) -> None:
+        """
+        Resize the window of every managed flow, keeping their most recent samples.
+
+        After an explicit resize the windows no longer follow `FlowStat.WINDOW_SIZE`.
+
+        :param window_size: The new number of samples to keep.
+        """
+        self._follow_config = False
+        self._resize(window_size)
+
+    def _resize(self, window_size: int) -> None:
+        window_size = int(window_size)
+        if window_size < 1:
+            raise ValueError("Window size must be at least 1. Got {}".format(window_size))
+        old_values, old_timestamps = self._values, self._timestamps
+        head = np.array(self._head, dtype=np.intp)
+        length = np.array(self._len, dtype=np.intp)
+        keep = np.minimum(length, window_size)
+        # Column of the i-th kept sample in the old buffer, for every row
+        src = (head + length - keep)[:, None] + np.arange(window_size)[None, :]
+        src %= self._window
+        rows = np.arange(len(self.flows))[:, None]
+        valid = np.arange(window_size)[None, :] < keep[:, None]
+        capacity = self._values.shape[0]
+        self._values = np.zeros((capacity, window_size), dtype=np.uint64)
+        self._timestamps = np.zeros((capacity, window_size), dtype=np.float64)
+        self._values[:len(self.flows)] = np.where(valid, old_values[rows, src], 0)
+        self._timestamps[:len(self.flows)] = np.where(valid, old_timestamps[rows, src], 0.0)
+        self._head = [0] * len(self.flows)
+        self._len = keep.tolist()
+        self._window = window_size
+
+    def _put_row(self, row: int, val: int, timestamp: float) -> bool:
+        if self._follow_config and self._window != FlowStat.WINDOW_SIZE:
+            self._resize(FlowStat.WINDOW_SIZE)
+        head = self._head[row]
+        length = self._len[row]
+        if length > 0 and val < self._last[row]:
+            return False
+
+        if length < self._window:
+            col = (head + length) % self._window
+            self._len[row] = length + 1
+        else:
+            col = head
+            self._head[row] = (head + 1) % self._window
+        self._values[row, col] = val
+        self._timestamps[row, col] = timestamp
+        self._last[row] = val
+        return True
+
+    def put_rows(self, rows: Iterable[int], values: Iterable[int], timestamp: float) -> List[int]:
+        """
+        Add a record with the same timestamp to each of the given rows, without the flow lookups of `put`.
+
+        The bookkeeping is done per row, then the samples are written into the window arrays in one operation.
+        """
+        if self._follow_config and self._window != FlowStat.WINDOW_SIZE:
+            self._resize(FlowStat.WINDOW_SIZE)
+        window = self._window
+        heads, lens, lasts = self._head, self._len, self._last
+        written_rows: List[int] = []
+        cols: List[int] = []
+        written: List[int] = []
+        rejected: List[int] = []
+        for row, val in zip(rows, values):
+            length = lens[row]
+            if length > 0 and val < lasts[row]:
+                rejected.append(row)
+                continue
+            head = heads[row]
+            if length < window:
+                cols.append((head + length) % window)
+                lens[row] = length + 1
+            else:
+                cols.append(head)
+                heads[row] = (head + 1) % window
+            lasts[row] = val
+            written_rows.append(row)
+            written.append(val)
+        self._values[written_rows, cols] = written
+        self._timestamps[written_rows, cols] = timestamp
+        return rejected
+
+    def reset(self, flow: FlowId) -> None:
+        row = self.index[flow]
+        self._head[row] = 0
+        self._len[row] = 0
+        self._last[row] = 0
+
+    def remove(self, flow: FlowId) -> None:
+        row = self.index.pop(flow)
+        last = len(self.flows) - 1
+        if row != last:
+            moved = self.flows[last]
+            self.flows[row] = moved
+            self.index[moved] = row
+            self._values[row] = self._values[last]
+            self._timestamps[row] = self._timestamps[last]
+            for state in (self._head, self._len, self._last):
+                state[row] = state[last]
+        for state in (self.flows, self._head, self._len, self._last):
+            state.pop()
+
+    def get_avg(self, flow: FlowId, prefix: str = None) -> float:
+        """
+        Get the average number of bytes per measurement of the given flow. See `FlowStat.get_avg`.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+        row = self.index[flow]  # Let the KeyError exception arise if any
+        head = self._head[row]
+        length = self._len[row]
+        if length == 0:
+            return 0
+        elif length == 1:
+            return self._last[row]
+        else:
+            last = (head + length - 1) % self._window
+            return (int(self._values[row, last]) - int(self._values[row, head])) * \
+                FlowStat.SCALING_PREFIXES[prefix] / float(length - 1)
+
+    def get_avg_speed(self, flow: FlowId, prefix: str = None) -> float:
+        """
+        Get the average throughput of the given flow in **Bytes/s**. See `FlowStat.get_avg_speed`.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+        return float(self._speeds(prefix, np.array([self.index[flow]]))[0])
+
+    def _speeds(self, prefix: str = None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Calculate the average speed in Bytes/s of the given rows with the same arithmetic as `FlowStat.get_avg_speed`.
+
+        :param rows: The rows to calculate the speed for. Defaults to every managed flow.
+        """
+        if rows is None:
+            rows = np.arange(len(self.flows))
+        head = np.array(self._head, dtype=np.intp)[rows]
+        length = np.array(self._len, dtype=np.intp)[rows]
+        last = (head + length - 1) % self._window
+        dv = (self._values[rows, last] - self._values[rows, head]).astype(np.float64) * \
+            FlowStat.SCALING_PREFIXES[prefix]
+        dt = self._timestamps[rows, last] - self._timestamps[rows, head]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = dv / dt
+        speeds[(length <= 1) | (dt == 0)] = 0
+        return speeds
+
+    def export_speed_variances_array(self, prefix: str = None) -> np.ndarray:
+        """
+        See `FlowStat.get_speed_variance` for the arithmetic.
+        """
+        rows = len(self.flows)
+        head = np.array(self._head, dtype=np.intp)
+        length = np.array(self._len, dtype=np.intp)
+        # Reorder the circular buffers so that the samples of every row run from the oldest to the newest
+        order = (head[:, None] + np.arange(self._window)) % self._window
+        values = np.take_along_axis(self._values[:rows], order, axis=1).astype(np.float64)
+        timestamps = np.take_along_axis(self._timestamps[:rows], order, axis=1)
+        dt = np.diff(timestamps, axis=1)
+        valid = (np.arange(self._window - 1) < (length - 1)[:, None]) & (dt > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = np.where(valid, np.diff(values, axis=1) * FlowStat.SCALING_PREFIXES[prefix] / dt, 0)
+            count = valid.sum(axis=1)
+            mean = speeds.sum(axis=1) / count
+            variances = np.where(valid, (speeds - mean[:, None]) ** 2, 0).sum(axis=1) / count
+        variances[count < 2] = 0
+        return variances
+
+    def export_avg_speeds_array(self, prefix: str = None) -> np.ndarray:
+        return self._speeds(prefix)
+
+
+class EwmaFlowStatManager(BaseFlowStatManager):
+    """
+    Statistics of the flows of one datapath as exponentially weighted moving averages of their speed.
+
+    No samples are kept: every flow only has its newest counter value and timestamp and the estimates of its speed and
+    speed variance, so the memory does not depend on the smoothing. The weight of a new measurement is
+    1 - exp(-dt / time constant) where dt is the time since the previous one, so the smoothing follows wall time
+    rather than the number of measurements. It can be used in place of `FlowStatManager`, without the window.
+    """
+
+    def __init__(self, time_constant: float = None):
+        """
+        Create an empty statistics store.
+
+        :param time_constant: Seconds for the weight of a measurement to decay by e. If not set, it follows
+        `FlowStat.TIME_CONSTANT`.
+        """
+        if time_constant is not None and time_constant <= 0:
+            raise ValueError("Time constant must be positive. Got {}".format(time_constant))
+        super().__init__()
+        self._time_constant = time_constant
+        self._count: List[int] = []  # Number of values put since the last reset per row
+        self._last_timestamp: List[float] = []  # The timestamp of the newest value per row
+        self._speed: List[float] = []  # The speed estimate per row in Bytes/s
+        self._variance: List[float] = []  # The speed variance estimate per row in (Bytes/s)^2
+
+    @property
+    def time_constant(self) -> float:
+        return FlowStat.TIME_CONSTANT if self._time_constant is None else self._time_constant
+
+    def _add_row(self, flow: FlowId) -> int:
+        self._count.append(0)
+        for state in (self._last_timestamp, self._speed, self._variance):
+            state.append(0.0)
+        return super()._add_row(flow)
+
+    def _put_row(self, row: int, val: int, timestamp: float) -> bool:
+        """
+        Update the estimates of a row. The first interval after a reset sets the speed estimate instead of being
+        weighted into it.
+        """
+        count = self._count[row]
+        if count > 0:
+            if val < self._last[row]:
+                return False
+            dt = timestamp - self._last_timestamp[row]
+            if dt > 0:
+                speed = (val - self._last[row]) / dt
+                if count == 1:
+                    self._speed[row] = speed
+                else:
+                    self._smooth(row, speed, 1 - math.exp(-dt / self.time_constant))
+        self._count[row] = count + 1
+        self._last[row] = val
+        self._last_timestamp[row] = timestamp
+        return True
+
+    def _smooth(self, row: int, speed: float, alpha: float) -> None:
+        """
+        Weight the speed of the newest interval into the estimates of a row.
+
+        :param alpha: The weight of the newest interval.
+        """
+        diff = speed - self._speed[row]
+        self._speed[row] += alpha * diff
+        self._variance[row] = (1 - alpha) * (self._variance[row] + alpha * diff * diff)
+
+    def reset(self, flow: FlowId) -> None:
+        row = self.index[flow]
+        self._count[row] = 0
+        self._last[row] = 0
+        self._speed[row] = 0.0
+        self._variance[row] = 0.0
+
+    def remove(self, flow: FlowId) -> None:
+        row = self.index.pop(flow)
+        last = len(self.flows) - 1
+        states = (self.flows, self._count, self._last, self._last_timestamp, self._speed, self._variance)
+        if row != last:
+            self.index[self.flows[last]] = row
+            for state in states:
+                state[row] = state[last]
+        for state in states:
+            state.pop()
+
+    def get_avg_speed(self, flow: FlowId, prefix: str = None) -> float:
+        """
+        Get the estimated throughput of the given flow in **Bytes/s**.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        """
+        return self._speed[self.index[flow]] * FlowStat.SCALING_PREFIXES[prefix]
+
+    def export_speed_variances_array(self, prefix: str = None) -> np.ndarray:
+        """
+        Export the estimated speed variance of every flow in **(Bytes/s)^2** in a single array.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :return: An array where the i-th element belongs to the flow `self.flows[i]`.
+        """
+        return np.array(self._variance, dtype=np.float64) * FlowStat.SCALING_PREFIXES[prefix] ** 2
+
+    def export_avg_speeds_array(self, prefix: str = None) -> np.ndarray:
+        """
+        Export the estimated speed of every flow in **Bytes/s** in a single array.
+
+        :param prefix: See `FlowStat.get_avg` parameter documentation.
+        :return: An array where the i-th element belongs to the flow `self.flows[i]`.
+        """
+        return np.array(self._speed, dtype=np.float64) * FlowStat.SCALING_PREFIXES[prefix]
+
+
+class PeakHoldFlowStatManager(EwmaFlowStatManager):
+    """
+    Like `EwmaFlowStatManager`, but the speed estimate follows increases at once and only decays slowly.
+
+    A flow ramping up is seen at its new speed in the next measurement, so its limit is not lowered meanwhile.
+    """
+
+    def _smooth(self, row: int, speed: float, alpha: float) -> None:
+        super()._smooth(row, speed, alpha)
+        if speed > self._speed[row]:
+            self._speed[row] = speed
+
+
+ESTIMATORS = {"window": FlowStatManager, "ewma": EwmaFlowStatManager, "peak": PeakHoldFlowStatManager}
+
+
+def new_flow_stat_manager() -> BaseFlowStatManager:
+    """
+    Create the statistics store of a datapath with the estimator set by `FlowStat.ESTIMATOR`.
+    """
+    return ESTIMATORS[FlowStat.ESTIMATOR]()
+
+
+class FlowMaxIndex:
+    """
+    The maximum speed of every flow across the datapaths, maintained incrementally as the datapaths report.
+
+    Reading the global view costs O(flows), independent of the number of datapaths.
+    """
+
+    def __init__(self):
+        self._speeds: Dict[FlowId, Dict[int, float]] = {}  # FlowId -> {dpid: speed}
+        self._max: Dict[FlowId, Tuple[float, int]] = {}  # FlowId -> (max speed, dpid it was measured on)
+        self._flows_of: Dict[int, Set[FlowId]] = {}  # dpid -> FlowIds it has reported
+
+    def __len__(self) -> int:
+        return len(self._max)
+
+    def update(self, dpid: int, speeds: Iterable[Tuple[FlowId, float]]) -> None:
+        """
+        Record the speeds of flows measured on a datapath.
+
+        :param speeds: (FlowId, speed) pairs, e.g. the items of `FlowStatManager.export_avg_speeds_bps`.
+        """
+        flows_of = self._flows_of.setdefault(dpid, set())
+        for flow, speed in speeds:
+            per_dp = self._speeds.setdefault(flow, {})
+            per_dp[dpid] = speed
+            flows_of.add(flow)
+            current = self._max.get(flow)
+            if current is None or speed >= current[0]:
+                self._max[flow] = (speed, dpid)
+            elif current[1] == dpid:  # The maximum has decreased
+                self._recompute(flow, per_dp)
+
+    def remove_datapath(self, dpid: int) -> None:
+        """
+        Forget every speed measured on a datapath.
+        """
+        for flow in self._flows_of.pop(dpid, ()):
+            per_dp = self._speeds[flow]
+            del per_dp[dpid]
+            if not per_dp:
+                del self._speeds[flow]
+                del self._max[flow]
+            elif self._max[flow][1] == dpid:
+                self._recompute(flow, per_dp)
+
+    def remove_flow(self, flow: FlowId) -> None:
+        """
+        Forget every speed measured of a flow, e.g. when its slice has been removed.
+        """
+        for dpid in self._speeds.pop(flow, {}):
+            self._flows_of[dpid].discard(flow)
+        self._max.pop(flow, None)
+
+    def _recompute(self, flow: FlowId, per_dp: Dict[int, float]) -> None:
+        dpid = max(per_dp, key=per_dp.__getitem__)
+        self._max[flow] = (per_dp[dpid], dpid)
+
+    def get(self, flow: FlowId) -> float:
+        return self._max[flow][0]
+
+    def export(self) -> Dict[FlowId, float]:
+        """
+        :return: A Dict of {FlowId, max speed across datapaths}.
+        """
+        return {flow: speed for flow, (speed, _) in self._max.items()}
@@ -1,10 +1,11 @@
-import requests
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import DEAD_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 
+from rest_client import RestClient
+
 
 class FlowCleaner13(app_manager.RyuApp):
     """
@@ -16,8 +17,9 @@ class FlowCleaner13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def stop(self):
+        rest = RestClient.shared()
         for dpid in self.__datapaths:
-            r = requests.delete("http://localhost:8080/stats/flowentry/clear/%d" % dpid)
+            r = rest.delete("http://localhost:8080/stats/flowentry/clear/%d" % dpid, "DELETE /stats/flowentry/clear")
             if r.status_code >= 200 and r.status_code < 300:
                 self.logger.info("Deleted all flow entries from %016x" % dpid)
             else:
@@ -0,0 +1,182 @@
+import logging
+from typing import Dict, Iterable, Optional
+
+from classifier import SliceClassifier
+from flow import BaseFlowStatManager
+from metrics import STATS_REPLY_BYTES, STATS_REPLY_PARTS
+from rule_installer import QOS_TABLE_ID, RULE_PRIORITY
+
+
+class PartialReply:
+    """The parts of a multipart reply received so far, reduced to the sums the handler keeps."""
+    __slots__ = ("timestamp", "parts", "size", "sums")
+
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp  # Of the first part, the snapshot time of the whole reply
+        self.parts = 0
+        self.size = 0  # Bytes of the parts, headers included
+        self.sums: dict = {}
+
+
+class MultipartReplies:
+    """
+    Reassemble the multipart stats replies of a datapath as a stream.
+
+    A part is folded into the sums of its reply as soon as it arrives, so only the sums of a reply in progress are
+    kept, never its parts. The whole reply gets the timestamp of its first part, as the switch takes the statistics of
+    every part at once when the request arrives. The number of parts and bytes of the complete replies are exported as
+    metrics.
+    """
+
+    def __init__(self, reply_type: str):
+        """
+        :param reply_type: The label of the replies in the metrics.
+        """
+        self._replies: Dict[int, PartialReply] = {}  # Key: xid
+        self._parts_metric = STATS_REPLY_PARTS.labels(type=reply_type)
+        self._bytes_metric = STATS_REPLY_BYTES.labels(type=reply_type)
+
+    def __len__(self) -> int:
+        return len(self._replies)
+
+    def part(self, xid: int, timestamp: float, size: int = 0) -> PartialReply:
+        """
+        Register a part of a reply.
+
+        :param timestamp: The time the part has arrived. Only that of the first part is kept.
+        :param size: The length of the part in bytes.
+        :return: The reply in progress, to add the part to its sums.
+        """
+        reply = self._replies.get(xid)
+        if reply is None:
+            reply = self._replies[xid] = PartialReply(timestamp)
+        reply.parts += 1
+        reply.size += size
+        return reply
+
+    def finish(self, xid: int) -> Optional[PartialReply]:
+        """
+        Take a complete reply after its last part, and record its parts and bytes.
+
+        :return: The reply, None if no part of it has been registered or it has been discarded.
+        """
+        reply = self._replies.pop(xid, None)
+        if reply is not None:
+            self._parts_metric.observe(reply.parts)
+            self._bytes_metric.observe(reply.size)
+        return reply
+
+    def discard(self, xid: int) -> None:
+        self._replies.pop(xid, None)
+
+    def expire(self, before: float) -> int:
+        """
+        Forget the replies that have started before a time, as the rest of them will not arrive.
+
+        :return: The number of replies forgotten.
+        """
+        expired = [xid for xid, reply in self._replies.items() if reply.timestamp < before]
+        for xid in expired:
+            del self._replies[xid]
+        return len(expired)
+
+    def clear(self) -> None:
+        self._replies.clear()
+
+
+class FlowStatsIngest:
+    """
+    Fast path from the entries of the flow stats replies of a datapath to its statistics store.
+
+    The rules of a switch are the same in every reply, so the match of a rule is classified once and the row of its
+    slice in the store is cached under the match fields. Handling an entry is then one hash of its match fields and
+    one addition. The byte counts of the rules of a slice are summed per row as the parts of the reply arrive, and
+    written into the store at once after the last part, with the timestamp of the first one.
+    """
+
+    def __init__(self, fsm: BaseFlowStatManager, classifier: SliceClassifier):
+        """
+        :param fsm: The statistics store of the datapath.
+        :param classifier: Maps the matches of the rules to the slices.
+        """
+        self.fsm = fsm
+        self.classifier = classifier
+        self._rows: Dict[tuple, int] = {}  # The match fields of a rule -> row of its slice in `fsm`, -1 if none
+        self.replies = MultipartReplies("flow")  # The sums are the byte counts per row
+
+        self.__logger = logging.getLogger("ingest")
+
+    def reset(self, classifier: SliceClassifier) -> None:
+        """
+        Forget the cached rows and the replies in progress, e.g. when the slices have changed.
+
+        :param classifier: The classifier of the new slices.
+        """
+        self.classifier = classifier
+        self._rows.clear()
+        self.replies.clear()
+
+    def _classify(self, key: tuple) -> int:
+        fields = dict(key)
+        if fields.get("ipv4_dst") is None or fields.get("udp_dst") is None:
+            row = -1
+        else:
+            flow = self.classifier.classify(fields["ipv4_dst"], fields["udp_dst"])
+            row = -1 if flow is None else self.fsm.row(flow)
+        self._rows[key] = row
+        return row
+
+    def add(self, xid: int, body: Iterable, timestamp: float, size: int = 0) -> int:
+        """
+        Sum the byte counts of the classification rules in a part of a flow stats reply.
+
+        :param xid: The xid of the reply.
+        :param body: The OFPFlowStats entries of the part.
+        :param timestamp: The time the part has arrived. That of the first part is the time of the whole reply.
+        :param size: The length of the part in bytes, for the metrics.
+        :return: The number of entries in the part.
+        """
+        sums = self.replies.part(xid, timestamp, size).sums
+        rows = self._rows
+        count = 0
+        for stat in body:
+            count += 1
+            if stat.priority != RULE_PRIORITY or stat.table_id != QOS_TABLE_ID:
+                continue
+            # WARNING: stat.byte_count is the number of bytes that MATCHED the rule, not the number of bytes
+            # that have finally been transmitted. This is not a problem for us, but it is important to know
+            key = tuple(stat.match.items())
+            row = rows.get(key)
+            if row is None:
+                row = self._classify(key)
+            if row >= 0:
+                sums[row] = sums.get(row, 0) + stat.byte_count
+        return count
+
+    def finish(self, xid: int) -> int:
+        """
+        Write the sums of a complete reply into the store.
+
+        The statistics of a slice are restarted if its sum has decreased, e.g. because a rule has been reinstalled.
+
+        :param xid: The xid of the reply.
+        :return: The number of slices written.
+        """
+        reply = self.replies.finish(xid)
+        if reply is None or not reply.sums:
+            return 0
+        sums = reply.sums
+        timestamp = reply.timestamp
+        rejected = self.fsm.put_rows(sums.keys(), sums.values(), timestamp)
+        for row in rejected:
+            self.__logger.debug("Counter of %s has decreased, restarting its statistics.", self.fsm.flows[row])
+            self.fsm.reset(self.fsm.flows[row])
+        if rejected:
+            self.fsm.put_rows(rejected, [sums[row] for row in rejected], timestamp)
+        return len(sums)
+
+    def discard(self, xid: int) -> None:
+        """
+        Forget a reply in progress, e.g. when the rest of it will not arrive.
+        """
+        self.replies.discard(xid)
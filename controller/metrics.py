@@ -0,0 +1,320 @@
+import abc
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import ryu.lib.hub
+
+import config_handler
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape(str(value))) for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else "%d" % value
+
+
+class _Metric(abc.ABC):
+    TYPE: str
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: 'Registry' = None):
+        """
+        :param labelnames: The names of the labels. A metric with labels is only reported through `labels`.
+        :param registry: The registry to report the metric in. Defaults to `REGISTRY`.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values, **kwvalues) -> '_Metric':
+        """
+        Get the child of the metric with the given label values, creating it at the first use.
+        """
+        if kwvalues:
+            values = tuple(kwvalues[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError("{} needs the labels {}. Got {}".format(self.name, self.labelnames, values))
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self) -> '_Metric':
+        child = object.__new__(type(self))
+        child.name = self.name
+        child.labelnames = ()
+        self._setup_child(child)
+        child._init_value()
+        return child
+
+    def _setup_child(self, child: '_Metric') -> None:
+        pass
+
+    @abc.abstractmethod
+    def _init_value(self) -> None:
+        """
+        Set the value of this metric without labels to the one of no observation.
+        """
+
+    def reset(self) -> None:
+        """
+        Drop every observation, e.g. between benchmark phases.
+        """
+        self._children.clear()
+        self._init_value()
+
+    @abc.abstractmethod
+    def _samples(self) -> List[Tuple[str, List[Tuple[str, str]], float]]:
+        """
+        :return: (suffix, labels, value) triples of this metric without labels.
+        """
+
+    def render(self) -> List[str]:
+        lines = ["# HELP %s %s" % (self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE %s %s" % (self.name, self.TYPE)]
+        if self.labelnames:
+            children = sorted(self._children.items())
+        else:
+            children = [((), self)]
+        for values, child in children:
+            for suffix, labels, value in child._samples():
+                lines.append("%s%s%s %s" % (self.name, suffix,
+                                            _format_labels(list(zip(self.labelnames, values)) + labels),
+                                            _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only increases."""
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_value()
+
+    def _init_value(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased. Got {}".format(amount))
+        self.value += amount
+
+    def _samples(self):
+        return [("_total", [], self.value)]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+    TYPE = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_value()
+
+    def _init_value(self) -> None:
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def _samples(self):
+        return [("", [], self.value)]
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, e.g. durations, in cumulative buckets."""
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: 'Registry' = None):
+        """
+        :param buckets: The upper bounds of the buckets, in increasing order. +Inf is added.
+        """
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+        self._init_value()
+
+    def _setup_child(self, child: 'Histogram') -> None:
+        child.buckets = self.buckets
+
+    def _init_value(self) -> None:
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile from the buckets by linear interpolation, like `histogram_quantile` of Prometheus.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimate, or NaN if nothing has been observed. Values in the +Inf bucket are estimated as the
+        highest finite bound.
+        """
+        total = sum(self.counts)
+        if total == 0:
+            return float("nan")
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if self.buckets[i] == float("inf"):
+                    return self.buckets[i - 1] if i > 0 else float("nan")
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        """
+        Observe the duration of the block in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(("_bucket", [("le", _format_value(bound))], cumulative))
+        samples.append(("_count", [], cumulative))
+        samples.append(("_sum", [], self.sum))
+        return samples
+
+
+class Registry:
+    """A set of metrics reported together."""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError("Metric {} is already registered.".format(metric.name))
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        Add a function called before every report, e.g. to update gauges.
+        """
+        self._collectors.append(collector)
+
+    def reset(self) -> None:
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def render(self) -> str:
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Metrics of the control loop
+STATS_REPLY_PARSE_SECONDS = Histogram("qos_stats_reply_parse_seconds", "Time spent handling a stats reply.",
+                                      ("type",))
+STATS_REPLY_QUEUED_SECONDS = Histogram("qos_stats_reply_queued_seconds",
+                                       "Time a stats reply waited in the event queue before being handled.")
+STATS_REPLY_PARTS = Histogram("qos_stats_reply_parts", "Number of parts of the multipart stats replies.", ("type",),
+                              buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+STATS_REPLY_BYTES = Histogram("qos_stats_reply_bytes", "Size of the multipart stats replies, all parts together.",
+                              ("type",), buckets=tuple(4 ** i * 1024 for i in range(8)))
+PRE_ADAPT_SECONDS = Histogram("qos_pre_adapt_seconds", "Time spent calculating the new queue limits.")
+REST_REQUEST_SECONDS = Histogram("qos_rest_request_seconds", "Round-trip time of the REST requests.",
+                                 ("endpoint",))
+ROUND_TO_APPLIED_SECONDS = Histogram("qos_round_to_applied_seconds",
+                                     "Time from sending the stats requests of a round to the queues being applied.",
+                                     buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+SKIPPED_OPERATIONS = Counter("qos_skipped_operations", "Operations skipped because another one held the semaphore.",
+                             ("operation",))
+FLOWS = Gauge("qos_flows", "Number of flows with measured speed.")
+DATAPATHS = Gauge("qos_datapaths", "Number of connected datapaths.")
+QUEUE_DROPS = Gauge("qos_queue_drops_per_second",
+                    "Packets dropped by the queues of the slices per second on every datapath together, in queue "
+                    "measurement mode.")
+CONFIG_RELOADS = Counter("qos_config_reloads", "Reloads of the config file after it has changed.", ("result",))
+
+
+class MetricsServer:
+    """
+    Serve the metrics of a registry over HTTP, on a green thread of the Ryu hub.
+    """
+
+    ADDR = "127.0.0.1:9108"  # host:port to listen on, empty disables the endpoint
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "metrics_addr" in ch.config:
+            cls.ADDR = ch.config["metrics_addr"] or ""  # An empty value is read as None
+            logger.info("metrics_addr set to {}".format(cls.ADDR))
+        else:
+            logger.debug("metrics_addr not set")
+
+    def __init__(self, registry: Registry = None):
+        self.registry = REGISTRY if registry is None else registry
+
+    def app(self, environ, start_response):
+        """
+        The WSGI application reporting the metrics at any path.
+        """
+        body = self.registry.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                                  ("Content-Length", str(len(body)))])
+        return [body]
+
+    def serve(self, addr: str) -> None:
+        """
+        Serve the metrics until the green thread is killed.
+
+        :param addr: host:port to listen on.
+        """
+        host, port = addr.rsplit(":", 1)
+        ryu.lib.hub.WSGIServer((host, int(port)), self.app).serve_forever()
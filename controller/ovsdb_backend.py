@@ -0,0 +1,229 @@
+import json
+import logging
+import socket
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+DATABASE = "Open_vSwitch"
+
+
+class OvsdbError(Exception):
+    pass
+
+
+class OvsdbConnection:
+    """A persistent OVSDB JSON-RPC (RFC 7047) session."""
+
+    TIMEOUT = 5  # Seconds to wait for connecting and for a reply
+
+    def __init__(self, addr: str):
+        """
+        :param addr: The address of the OVSDB server in the format Open vSwitch uses, e.g. "tcp:192.0.2.20:6632" or
+        "unix:/var/run/openvswitch/db.sock".
+        """
+        self.addr = addr
+        self._sock: Optional[socket.socket] = None
+        self._buffer = ""
+        self._decoder = json.JSONDecoder()
+        self._next_id = 0
+
+    def connect(self) -> None:
+        kind, _, rest = self.addr.partition(":")
+        if kind == "tcp":
+            host, _, port = rest.rpartition(":")
+            self._sock = socket.create_connection((host, int(port)), timeout=OvsdbConnection.TIMEOUT)
+        elif kind == "unix":
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(OvsdbConnection.TIMEOUT)
+            self._sock.connect(rest)
+        else:
+            raise ValueError("Unsupported OVSDB address: {}".format(self.addr))
+        self._buffer = ""
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, msg: dict) -> None:
+        self._sock.sendall(json.dumps(msg).encode())
+
+    def _receive(self) -> dict:
+        while True:
+            stripped = self._buffer.lstrip()
+            if stripped:
+                try:
+                    msg, end = self._decoder.raw_decode(stripped)
+                    self._buffer = stripped[end:]
+                    return msg
+                except ValueError:
+                    pass  # Incomplete message
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("OVSDB server closed the connection")
+            self._buffer += chunk.decode()
+
+    def call(self, method: str, params: list):
+        """
+        Call a JSON-RPC method and wait for its result, connecting first if needed.
+
+        Echo requests of the server arriving in the meantime are answered.
+
+        :raises OvsdbError: If the server replies with an error.
+        :raises OSError: On connection problems. The connection is closed and reopened at the next call.
+        """
+        if self._sock is None:
+            self.connect()
+        self._next_id += 1
+        call_id = self._next_id
+        try:
+            self._send({"method": method, "params": params, "id": call_id})
+            while True:
+                msg = self._receive()
+                if msg.get("method") == "echo":
+                    self._send({"result": msg.get("params", []), "error": None, "id": msg.get("id")})
+                elif msg.get("id") == call_id:
+                    break
+        except OSError:
+            self.close()
+            raise
+        if msg.get("error") is not None:
+            raise OvsdbError(msg["error"])
+        return msg["result"]
+
+    def transact(self, *ops: dict) -> list:
+        """
+        Run the operations in a single transaction.
+
+        :return: The results of the operations.
+        :raises OvsdbError: If the transaction or any of its operations has failed.
+        """
+        results = self.call("transact", [DATABASE] + list(ops))
+        for op, result in zip(ops, results):
+            if result is not None and "error" in result:
+                raise OvsdbError("{} failed: {}".format(op["op"], result))
+        if len(results) > len(ops):  # E.g. a commit failure
+            raise OvsdbError(results[-1])
+        return results
+
+
+def ovsdb_map(d: Dict) -> list:
+    return ["map", [[k, v] for k, v in d.items()]]
+
+
+def ovsdb_rate_config(rate: int) -> list:
+    # Negative rates mean no limit, like DEFAULT_MAX_RATE
+    return ovsdb_map({"max-rate": str(rate)} if rate >= 0 else {})
+
+
+def ovsdb_rate_mutations(rate: int) -> list:
+    """Get the mutations of `other_config` that replace only its max-rate, keeping e.g. min-rate and burst."""
+    mutations = [["other_config", "delete", ["set", ["max-rate"]]]]
+    if rate >= 0:  # Negative rates mean no limit, like DEFAULT_MAX_RATE
+        mutations.append(["other_config", "insert", ovsdb_map({"max-rate": str(rate)})])
+    return mutations
+
+
+def ovsdb_set_items(value) -> list:
+    """Get the elements of an OVSDB set, which is serialised as a single atom when it has exactly one element."""
+    if isinstance(value, list) and value and value[0] == "set":
+        return value[1]
+    return [value]
+
+
+class OvsdbQoSBackend:
+    """
+    Program queue limits directly in the Queue table of the OVSDB server instead of through rest_qos.
+
+    The rows of the queues are looked up once and cached, so an adaptation round only costs a single transaction that
+    updates the `other_config:max-rate` of the changed queues in place. Ports without the necessary QoS and Queue rows
+    get them created in the same transaction.
+    """
+
+    def __init__(self, addr: str, parent_max_rate: int = -1):
+        """
+        :param addr: See `OvsdbConnection`.
+        :param parent_max_rate: The max-rate of the QoS rows created, i.e. the rate of the whole interface.
+        """
+        self.conn = OvsdbConnection(addr)
+        self.parent_max_rate = parent_max_rate
+        self._queues: Dict[str, Dict[int, str]] = {}  # Cache: port name -> {queue id: Queue row uuid}
+        self._ports: Dict[str, str] = {}  # Cache: port name -> Port row uuid
+        self._lock = threading.Lock()  # The connection is shared by every caller
+
+        self.__logger = logging.getLogger("ovsdb_backend")
+
+    def _lookup(self) -> None:
+        ports, qoses = self.conn.transact(
+            {"op": "select", "table": "Port", "where": [], "columns": ["_uuid", "name", "qos"]},
+            {"op": "select", "table": "QoS", "where": [], "columns": ["_uuid", "queues"]})
+        qos_queues = {row["_uuid"][1]: {int(qid): uuid[1] for qid, uuid in row["queues"][1]}
+                      for row in qoses["rows"]}
+        self._ports = {row["name"]: row["_uuid"][1] for row in ports["rows"]}
+        self._queues = {}
+        for row in ports["rows"]:
+            qos = [item[1] for item in ovsdb_set_items(row["qos"]) if isinstance(item, list) and item[0] == "uuid"]
+            self._queues[row["name"]] = qos_queues.get(qos[0], {}) if qos else {}
+
+    def invalidate(self) -> None:
+        """Drop the cached rows, e.g. when something else may have changed the QoS settings."""
+        self._ports = {}
+        self._queues = {}
+
+    def set_queues(self, diffs: Dict[Tuple[int, str], Dict[int, int]], queue_limits: List[int]) -> Set[Tuple[int, str]]:
+        """
+        Update the queues of the given ports in one transaction.
+
+        :param diffs: The queues to update per (dpid, port name), as {queue_id: max_rate}.
+        :param queue_limits: The max_rate of every queue, used for ports whose QoS settings have to be created.
+        :return: The (dpid, port name) pairs successfully updated.
+        """
+        with self._lock:
+            return self._set_queues(diffs, queue_limits)
+
+    def _set_queues(self, diffs: Dict[Tuple[int, str], Dict[int, int]],
+                    queue_limits: List[int]) -> Set[Tuple[int, str]]:
+        try:
+            if any(port not in self._ports for _, port in diffs):
+                self._lookup()
+            ops = []
+            updated: Dict[str, int] = {}  # Queue uuid -> max_rate, shared rows are updated once
+            applied = set()
+            for (dpid, port), diff in diffs.items():
+                if port not in self._ports:
+                    self.__logger.error("Port %s of %016x is not in the OVSDB.", port, dpid)
+                    continue
+                queues = self._queues[port]
+                if all(qid in queues for qid in range(len(queue_limits))):
+                    for qid, rate in diff.items():
+                        updated[queues[qid]] = rate
+                else:
+                    ops.extend(self._create_ops(port, queue_limits))
+                applied.add((dpid, port))
+            ops.extend({"op": "mutate", "table": "Queue", "where": [["_uuid", "==", ["uuid", uuid]]],
+                        "mutations": ovsdb_rate_mutations(rate)} for uuid, rate in updated.items())
+            if ops:
+                self.conn.transact(*ops)
+            if len(ops) > len(updated):  # Rows have been created, their uuids are looked up at the next call
+                self.invalidate()
+            self.__logger.info("Updated %d queues on %d ports in one transaction.", len(updated), len(applied))
+            return applied
+        except (OSError, ValueError, OvsdbError) as err:
+            self.__logger.error("Queue setting through OVSDB has failed. {}".format(err))
+            self.invalidate()
+            return set()
+
+    def _create_ops(self, port: str, queue_limits: List[int]) -> List[dict]:
+        name = port.replace("-", "_").replace(".", "_")
+        ops = [{"op": "insert", "table": "Queue", "uuid-name": "queue_{}_{}".format(name, qid),
+                "row": {"other_config": ovsdb_rate_config(rate)}} for qid, rate in enumerate(queue_limits)]
+        ops.append({"op": "insert", "table": "QoS", "uuid-name": "qos_{}".format(name),
+                    "row": {"type": "linux-htb", "other_config": ovsdb_rate_config(self.parent_max_rate),
+                            "queues": ovsdb_map({qid: ["named-uuid", "queue_{}_{}".format(name, qid)]
+                                                 for qid in range(len(queue_limits))})}})
+        ops.append({"op": "update", "table": "Port", "where": [["_uuid", "==", ["uuid", self._ports[port]]]],
+                    "row": {"qos": ["named-uuid", "qos_{}".format(name)]}})
+        return ops
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,191 @@
+import json
+import socketserver
+import threading
+import uuid
+from copy import deepcopy
+from typing import Dict
+
+from ovsdb_backend import DATABASE
+
+EMPTY_SET = ["set", []]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk.decode()
+            while True:
+                buffer = buffer.lstrip()
+                try:
+                    msg, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break  # Incomplete message
+                buffer = buffer[end:]
+                reply = self.server.standin.handle_message(msg)
+                if reply is not None:
+                    self.request.sendall(json.dumps(reply).encode())
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class OvsdbStandIn:
+    """
+    In-process stand-in for an OVSDB server, to test and benchmark `OvsdbQoSBackend` offline.
+
+    It speaks the JSON-RPC protocol of OVSDB over TCP and keeps an in-memory database with the tables related to QoS.
+    Only the `select`, `insert`, `update` and `delete` operations with `==` and `!=` conditions are supported, there is
+    no schema checking nor garbage collection. Every transaction is atomic.
+    """
+
+    TABLES = ("Bridge", "Port", "Interface", "QoS", "Queue")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param port: The TCP port to listen on. Defaults to a free port.
+        """
+        self.tables: Dict[str, Dict[str, dict]] = {table: {} for table in OvsdbStandIn.TABLES}  # Table -> uuid -> row
+        self.transactions = 0  # The number of transactions received
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def addr(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "tcp:{}:{}".format(host, port)
+
+    def start(self) -> 'OvsdbStandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_port(self, name: str) -> str:
+        """
+        Add a Port row without QoS settings.
+
+        :return: The uuid of the row.
+        """
+        row_uuid = str(uuid.uuid4())
+        self.tables["Port"][row_uuid] = {"name": name, "qos": EMPTY_SET}
+        return row_uuid
+
+    def port_queue_rates(self, name: str) -> Dict[int, str]:
+        """
+        Get the max-rate of every queue of a port, as the tc settings would be derived from them.
+
+        :return: A Dict of {queue_id, max-rate}. A queue without max-rate has None.
+        """
+        port = next(row for row in self.tables["Port"].values() if row["name"] == name)
+        if port["qos"] == EMPTY_SET:
+            return {}
+        qos = self.tables["QoS"][port["qos"][1]]
+        return {qid: dict(self.tables["Queue"][queue[1]]["other_config"][1]).get("max-rate")
+                for qid, queue in qos["queues"][1]}
+
+    def handle_message(self, msg: dict):
+        method = msg.get("method")
+        if method is None:
+            return None  # Reply to an echo of ours, we do not send any
+        if method == "echo":
+            result, error = msg.get("params", []), None
+        elif method == "list_dbs":
+            result, error = [DATABASE], None
+        elif method == "transact":
+            result, error = self.transact(msg["params"][1:]), None
+        else:
+            result, error = None, "unknown method"
+        return {"id": msg.get("id"), "result": result, "error": error}
+
+    def transact(self, ops: list) -> list:
+        with self._lock:
+            self.transactions += 1
+            backup = deepcopy(self.tables)
+            named = {op["uuid-name"]: str(uuid.uuid4()) for op in ops if op.get("op") == "insert" and "uuid-name" in op}
+            results = []
+            for op in ops:
+                try:
+                    results.append(self._execute(self._resolve(op, named), named))
+                except (KeyError, ValueError, TypeError) as e:
+                    results.append({"error": "constraint violation", "details": str(e)})
+                    self.tables = backup
+                    break
+            return results
+
+    def _resolve(self, value, named: Dict[str, str]):
+        if isinstance(value, list):
+            if len(value) == 2 and value[0] == "named-uuid":
+                return ["uuid", named[value[1]]]
+            return [self._resolve(v, named) for v in value]
+        if isinstance(value, dict):
+            return {k: self._resolve(v, named) for k, v in value.items()}
+        return value
+
+    def _matches(self, row_uuid: str, row: dict, where: list) -> bool:
+        for column, function, value in where:
+            actual = ["uuid", row_uuid] if column == "_uuid" else row.get(column, EMPTY_SET)
+            if function == "==" and actual != value or function == "!=" and actual == value:
+                return False
+            if function not in ("==", "!="):
+                raise ValueError("unsupported function {}".format(function))
+        return True
+
+    @staticmethod
+    def _mutate_map(column: list, mutator: str, value: list) -> list:
+        """
+        Apply a mutation to a map column. Only the "insert" and "delete" mutators of maps are supported.
+        """
+        pairs = dict(column[1])
+        if mutator == "insert":  # Only the keys not in the map yet are inserted
+            for key, item in value[1]:
+                pairs.setdefault(key, item)
+        elif mutator == "delete":  # Either a set of keys, or a map whose pairs are deleted if they match
+            if value[0] == "map":
+                pairs = {key: item for key, item in pairs.items() if [key, item] not in value[1]}
+            else:
+                keys = value[1] if value[0] == "set" else [value]
+                pairs = {key: item for key, item in pairs.items() if key not in keys}
+        else:
+            raise ValueError("unsupported mutator {}".format(mutator))
+        return ["map", [[key, item] for key, item in pairs.items()]]
+
+    def _execute(self, op: dict, named: Dict[str, str]) -> dict:
+        table = self.tables[op["table"]]
+        if op["op"] == "insert":
+            row_uuid = named.get(op.get("uuid-name")) or str(uuid.uuid4())
+            table[row_uuid] = dict(op.get("row", {}))
+            return {"uuid": ["uuid", row_uuid]}
+        selected = [(u, row) for u, row in table.items() if self._matches(u, row, op.get("where", []))]
+        if op["op"] == "select":
+            rows = []
+            for row_uuid, row in selected:
+                full = dict(row, _uuid=["uuid", row_uuid])
+                columns = op.get("columns", list(full))
+                rows.append({column: full.get(column, EMPTY_SET) for column in columns})
+            return {"rows": rows}
+        elif op["op"] == "update":
+            for _, row in selected:
+                row.update(op["row"])
+            return {"count": len(selected)}
+        elif op["op"] == "mutate":
+            for _, row in selected:
+                for column, mutator, value in op["mutations"]:
+                    row[column] = self._mutate_map(row.get(column, ["map", []]), mutator, value)
+            return {"count": len(selected)}
+        elif op["op"] == "delete":
+            for row_uuid, _ in selected:
+                del table[row_uuid]
+            return {"count": len(selected)}
+        raise ValueError("unsupported operation {}".format(op["op"]))
@@ -0,0 +1,172 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import config_handler
+
+
+class AdaptivePoller:
+    """
+    Schedule the stats requests of every datapath on its own interval.
+
+    The interval of a datapath drops to the minimum when one of its flows is changing or is close to its limit, and
+    otherwise doubles per poll up to the maximum. As one stats request returns every flow of a switch, the interval of
+    a switch is set by its most urgent flow.
+
+    Every datapath is polled at its own phase of the minimum interval, so the requests, and the replies, are spread
+    evenly over the period instead of arriving at the controller in one burst.
+    """
+
+    PHASE_STEP = (5 ** 0.5 - 1) / 2  # Golden ratio, consecutive datapath ids get evenly spread phases
+
+    MIN_INTERVAL: Optional[float] = None  # Seconds between the polls of a busy datapath, the time step if None
+    MAX_INTERVAL: Optional[float] = None  # Seconds between the polls of a stable datapath, the time step if None
+    VARIATION_THRESHOLD = 0.1  # Coefficient of variation of the speed over which a flow is considered changing
+    LIMIT_PROXIMITY = 0.9  # Ratio of its limit over which a flow is considered close to it
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "poll_interval_min" in ch.config:
+            cls.MIN_INTERVAL = float(ch.config["poll_interval_min"])
+            logger.info("poll_interval_min set to {}".format(cls.MIN_INTERVAL))
+        else:
+            logger.debug("poll_interval_min not set")
+
+        if "poll_interval_max" in ch.config:
+            cls.MAX_INTERVAL = float(ch.config["poll_interval_max"])
+            logger.info("poll_interval_max set to {}".format(cls.MAX_INTERVAL))
+        else:
+            logger.debug("poll_interval_max not set")
+
+        if "poll_variation_threshold" in ch.config:
+            cls.VARIATION_THRESHOLD = float(ch.config["poll_variation_threshold"])
+            logger.info("poll_variation_threshold set to {}".format(cls.VARIATION_THRESHOLD))
+        else:
+            logger.debug("poll_variation_threshold not set")
+
+        if "poll_limit_proximity" in ch.config:
+            cls.LIMIT_PROXIMITY = float(ch.config["poll_limit_proximity"])
+            logger.info("poll_limit_proximity set to {}".format(cls.LIMIT_PROXIMITY))
+        else:
+            logger.debug("poll_limit_proximity not set")
+
+    def __init__(self, time_step: float, min_interval: float = None, max_interval: float = None):
+        """
+        :param time_step: The interval used where the minimum or the maximum is not configured.
+        :param min_interval: Defaults to `MIN_INTERVAL`.
+        :param max_interval: Defaults to `MAX_INTERVAL`.
+        """
+        self.min_interval, self.max_interval = self._intervals(time_step, min_interval, max_interval)
+        self.intervals: Dict[int, float] = {}  # Key: datapath id
+        self._last_poll: Dict[int, float] = {}
+        self._next_poll: Dict[int, float] = {}
+
+    @staticmethod
+    def _intervals(time_step: float, min_interval: Optional[float],
+                   max_interval: Optional[float]) -> Tuple[float, float]:
+        if min_interval is None:
+            min_interval = AdaptivePoller.MIN_INTERVAL if AdaptivePoller.MIN_INTERVAL is not None else time_step
+        if max_interval is None:
+            max_interval = AdaptivePoller.MAX_INTERVAL if AdaptivePoller.MAX_INTERVAL is not None else time_step
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Poll intervals must satisfy 0 < min <= max. Got {}, {}".format(
+                min_interval, max_interval))
+        return min_interval, max_interval
+
+    def set_intervals(self, time_step: float, now: float, min_interval: float = None, max_interval: float = None):
+        """
+        Change the intervals, e.g. after the config has been reloaded. Every datapath starts again from its phase after
+        `now` at the minimum interval.
+
+        :param time_step: See `__init__`.
+        """
+        self.min_interval, self.max_interval = self._intervals(time_step, min_interval, max_interval)
+        for dpid in list(self.intervals):
+            self.add_datapath(dpid, now)
+
+    def phase(self, dpid: int) -> float:
+        """
+        :return: The offset of the polls of a datapath within the minimum interval, in seconds.
+        """
+        return (dpid * AdaptivePoller.PHASE_STEP) % 1 * self.min_interval
+
+    def add_datapath(self, dpid: int, now: float) -> None:
+        """
+        Start polling a datapath, first at its phase after `now` and then at the minimum interval until it is found
+        stable.
+        """
+        first = now - now % self.min_interval + self.phase(dpid)
+        if first < now:
+            first += self.min_interval
+        self.intervals[dpid] = self.min_interval
+        self._last_poll[dpid] = first
+        self._next_poll[dpid] = first
+
+    def remove_datapath(self, dpid: int) -> None:
+        self.intervals.pop(dpid, None)
+        self._last_poll.pop(dpid, None)
+        self._next_poll.pop(dpid, None)
+
+    def due(self, now: float) -> List[int]:
+        """
+        :return: The datapaths that need to be polled until `now`, in the order of their scheduled polls.
+        """
+        return sorted((dpid for dpid, next_poll in self._next_poll.items() if next_poll <= now),
+                      key=self._next_poll.__getitem__)
+
+    def scheduled(self, dpid: int) -> float:
+        """
+        :return: The time of the next poll of a datapath.
+        """
+        return self._next_poll[dpid]
+
+    def next_poll(self) -> Optional[float]:
+        """
+        :return: The time of the next poll of any datapath, or None if there are no datapaths.
+        """
+        return min(self._next_poll.values(), default=None)
+
+    def polled(self, dpid: int, now: float) -> None:
+        """
+        Register that a datapath has been polled at `now`.
+        """
+        self._last_poll[dpid] = now
+        self._next_poll[dpid] = now + self.intervals[dpid]
+
+    def update(self, dpid: int, urgent: bool) -> None:
+        """
+        Tighten or relax the interval of a datapath after its stats have arrived.
+
+        :param urgent: Whether any flow of the datapath needs close monitoring. See `is_urgent`.
+        """
+        if dpid not in self.intervals:
+            return
+        if urgent:
+            self.intervals[dpid] = self.min_interval
+        else:
+            self.intervals[dpid] = min(self.intervals[dpid] * 2, self.max_interval)
+        self._next_poll[dpid] = self._last_poll[dpid] + self.intervals[dpid]
+
+    @classmethod
+    def is_urgent(cls, speeds: np.ndarray, variances: np.ndarray, limits: Iterable[float]) -> bool:
+        """
+        Tell whether any flow is changing or close to its limit.
+
+        :param speeds: The average speed of the flows.
+        :param variances: The speed variance of the flows, in the square of the unit of `speeds`.
+        :param limits: The current limit of the flows, in the unit of `speeds`. A negative limit means no limit.
+        """
+        limits = np.fromiter(limits, dtype=np.float64, count=len(speeds))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            changing = np.sqrt(variances) > cls.VARIATION_THRESHOLD * speeds
+        close = (limits >= 0) & (speeds >= cls.LIMIT_PROXIMITY * limits)
+        return bool(np.any(changing | close))
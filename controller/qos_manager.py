@@ -1,14 +1,19 @@
+import functools
 import json
 import logging
 from copy import deepcopy
-from math import ceil
-from typing import Tuple, Type
+from typing import Iterable, List, Optional, Set, Tuple, Type, Union
 from dataclasses import dataclass
 
+import numpy as np
 import requests
 import ryu.lib.hub
 
+from allocation import AllocationEngine
 from flow import *
+from metrics import PRE_ADAPT_SECONDS, SKIPPED_OPERATIONS
+from ovsdb_backend import OvsdbQoSBackend
+from rest_client import RestClient
 
 
 @dataclass
@@ -24,6 +29,8 @@ class QoSManager:
     DEFAULT_MAX_RATE = -1  # Max rate to be set on a queue if not told otherwise.
     OVSDB_ADDR: str  # Address of the OVS database
     CONTROLLER_BASEURL: str  # Base URL where the controller can be reached.
+    QUEUE_BACKEND = "rest"  # How queues are programmed: "rest" through rest_qos, or "ovsdb" directly
+    QUEUE_PLACEMENT = "all"  # Where queues are set: on "all" ports, or only on the "egress" ports of the slices
 
     @classmethod
     def configure(cls, ch: config_handler.ConfigHandler) -> None:
@@ -57,6 +64,22 @@ class QoSManager:
         else:
             logger.debug("interface_max_rate not set")
 
+        if "queue_backend" in ch.config:
+            if ch.config["queue_backend"] not in ("rest", "ovsdb"):
+                raise config_handler.ConfigError("config: queue_backend must be either rest or ovsdb")
+            cls.QUEUE_BACKEND = ch.config["queue_backend"]
+            logger.info("queue_backend set to {}".format(cls.QUEUE_BACKEND))
+        else:
+            logger.debug("queue_backend not set")
+
+        if "queue_placement" in ch.config:
+            if ch.config["queue_placement"] not in ("all", "egress"):
+                raise config_handler.ConfigError("config: queue_placement must be either all or egress")
+            cls.QUEUE_PLACEMENT = ch.config["queue_placement"]
+            logger.info("queue_placement set to {}".format(cls.QUEUE_PLACEMENT))
+        else:
+            logger.debug("queue_placement not set")
+
     def __init__(self, flows_with_init_limits: Dict[FlowId, int]):
         self.flows_limits: Dict[FlowId, FlowLimitEntry] = {}  # This will hold the actual values updated
 
@@ -66,8 +89,79 @@ class QoSManager:
             self.flows_limits[k] = FlowLimitEntry(flows_with_init_limits[k], qnum)
         self.FLOWS_INIT_LIMITS: Dict[FlowId, FlowLimitEntry] = \
             deepcopy(self.flows_limits)  # This does not change, it contains the values of the ideal, "customer" case
+        self._engine = AllocationEngine({k: v.limit for k, v in self.FLOWS_INIT_LIMITS.items()},
+                                        {k: v.queue_id for k, v in self.FLOWS_INIT_LIMITS.items()})
+
+        self.datapath_ports: Dict[int, List[str]] = {}  # Ports of the registered datapaths
+        # Ports of the registered datapaths queues are placed on (see `place_queues`), every port if missing
+        self.queue_ports: Dict[int, Set[str]] = {}
+        # Last successfully applied queue limits (see `get_queue_limits`), key: (dpid, port name)
+        self.applied_queues: Dict[Tuple[int, str], Tuple[int, ...]] = {}
 
         self.__logger = logging.getLogger("qos_manager")
+        self._rest = RestClient.shared()
+        self._ovsdb = OvsdbQoSBackend(QoSManager.OVSDB_ADDR, QoSManager.DEFAULT_MAX_RATE) \
+            if QoSManager.QUEUE_BACKEND == "ovsdb" else None
+
+    def apply_settings(self) -> None:
+        """
+        Take the changed class settings into use after the config has been reloaded.
+
+        The queues are not pushed here: a changed `DEFAULT_MAX_RATE` makes them stale, so the next `set_queues` does.
+        """
+        if self._ovsdb is not None:
+            self._ovsdb.parent_max_rate = QoSManager.DEFAULT_MAX_RATE
+
+    def _free_queue_id(self) -> int:
+        """
+        Get the lowest queue id not used by any flow, so the ids of removed flows are recycled.
+        """
+        used = {entry.queue_id for entry in self.flows_limits.values()}
+        return next(qid for qid in range(1, len(used) + 2) if qid not in used)
+
+    def add_flow(self, flow: FlowId, init_limit: int) -> int:
+        """
+        Start managing a new flow at its initial limit. The limits of the other flows are kept.
+
+        The queues and rules of the flow still have to be pushed to the switches, see `set_queues`.
+
+        :param init_limit: The initial ("customer") rate limit of the flow in bits/s.
+        :return: The queue id allocated to the flow.
+        :raises ValueError: If the flow is already managed.
+        """
+        if flow in self.flows_limits:
+            raise ValueError("Flow {} already exists".format(flow))
+        queue_id = self._free_queue_id()
+        self.flows_limits[flow] = FlowLimitEntry(int(init_limit), queue_id)
+        self.FLOWS_INIT_LIMITS[flow] = FlowLimitEntry(int(init_limit), queue_id)
+        self._engine.add(flow, int(init_limit), queue_id)
+        self.__logger.info("Flow '%s' added with limit %dbps on queue %d", flow, init_limit, queue_id)
+        return queue_id
+
+    def remove_flow(self, flow: FlowId) -> int:
+        """
+        Stop managing a flow. Its queue id is free to be allocated again.
+
+        :return: The queue id the flow had.
+        :raises KeyError: If the flow is not managed.
+        """
+        queue_id = self.flows_limits.pop(flow).queue_id
+        del self.FLOWS_INIT_LIMITS[flow]
+        self._engine.remove(flow)
+        self.__logger.info("Flow '%s' removed from queue %d", flow, queue_id)
+        return queue_id
+
+    def resize_flow(self, flow: FlowId, init_limit: int) -> None:
+        """
+        Change the initial limit of a flow. Its current limit restarts from the new initial limit.
+
+        :raises KeyError: If the flow is not managed.
+        """
+        queue_id = self.flows_limits[flow].queue_id
+        self.flows_limits[flow] = FlowLimitEntry(int(init_limit), queue_id)
+        self.FLOWS_INIT_LIMITS[flow] = FlowLimitEntry(int(init_limit), queue_id)
+        self._engine.set_init_limit(flow, int(init_limit))
+        self.__logger.info("Flow '%s' resized to %dbps", flow, init_limit)
 
     def set_ovsdb_addr(self, dpid: int):
         """
@@ -76,44 +170,180 @@ class QoSManager:
         This MUST be called once before sending configuration commands.
         :param dpid: datapath id to set OVSDB address for.
         """
-        r = requests.put("%s/v1.0/conf/switches/%016x/ovsdb_addr" % (QoSManager.CONTROLLER_BASEURL, dpid),
-                         data='"{}"'.format(QoSManager.OVSDB_ADDR),
-                         headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        r = self._rest.put("%s/v1.0/conf/switches/%016x/ovsdb_addr" % (QoSManager.CONTROLLER_BASEURL, dpid),
+                           "PUT /v1.0/conf/switches/ovsdb_addr",
+                           data='"{}"'.format(QoSManager.OVSDB_ADDR),
+                           headers={'Content-Type': 'application/x-www-form-urlencoded'})
         self.log_http_response(r)
 
+    def register_datapath(self, dpid: int, ports: List[str]) -> None:
+        """
+        Register the ports of a datapath so that the queues applied to them can be tracked.
+
+        :param ports: The names of the ports queues are set on.
+        """
+        self.datapath_ports[dpid] = list(ports)  # Every port is placed until `place_queues`
+
+    def unregister_datapath(self, dpid: int) -> None:
+        """
+        Forget a datapath and the queues applied to it.
+        """
+        for port in self.datapath_ports.pop(dpid, []):
+            self.applied_queues.pop((dpid, port), None)
+        self.queue_ports.pop(dpid, None)
+
+    def place_queues(self, dpid: int, ports: Iterable[str]) -> bool:
+        """
+        Set the ports of a registered datapath queues are placed on, e.g. the ports the traffic of the slices leaves
+        it through. The other ports are no longer updated, but their queues are not deleted.
+
+        The queue of a slice is identified by its position on a port, so a port gets the queues of every slice or none.
+
+        :param ports: The names of the ports. The ports not registered are ignored.
+        :return: Whether the placement has changed. The newly placed ports are stale until `set_queues`.
+        """
+        if dpid not in self.datapath_ports:
+            return False
+        placed = set(ports).intersection(self.datapath_ports[dpid])
+        if self.queue_ports.get(dpid) == placed:
+            return False
+        self.queue_ports[dpid] = placed
+        return True
+
+    def placed_ports(self, dpid: int) -> List[str]:
+        """
+        Get the ports of a registered datapath queues are placed on.
+        """
+        ports = self.datapath_ports.get(dpid, [])
+        placed = self.queue_ports.get(dpid)
+        return ports if placed is None else [port for port in ports if port in placed]
+
+    def get_queue_limits(self) -> List[int]:
+        """
+        Get the max_rate of every queue that should be set on the switches.
+
+        :return: A list where the i-th element is the max_rate of queue i. Queue 0 is for non-matching traffic.
+        """
+        limits = [QoSManager.DEFAULT_MAX_RATE] * (max([e.queue_id for e in self.flows_limits.values()], default=0) + 1)
+        for entry in self.flows_limits.values():
+            limits[entry.queue_id] = entry.limit
+        return limits
+
+    def stale_ports(self, dpid: int, queue_limits: List[int] = None) -> List[str]:
+        """
+        Get the ports of a registered datapath queues are placed on whose last applied queues differ from
+        `queue_limits`.
+
+        :param queue_limits: See `get_queue_limits`. Defaults to the current limits.
+        """
+        if queue_limits is None:
+            queue_limits = self.get_queue_limits()
+        queue_limits = tuple(queue_limits)
+        return [port for port in self.placed_ports(dpid) if self.applied_queues.get((dpid, port)) != queue_limits]
+
+    def has_stale_queues(self) -> bool:
+        """
+        Check whether any registered port is missing the current queue limits, e.g. after a failed update.
+        """
+        queue_limits = self.get_queue_limits()
+        return any(self.stale_ports(dpid, queue_limits) for dpid in self.datapath_ports)
+
+    def queue_diff(self, dpid: int, port: str, queue_limits: List[int] = None) -> Dict[int, int]:
+        """
+        Get the queues of a port whose max_rate differs from the last applied one.
+
+        :param queue_limits: See `get_queue_limits`. Defaults to the current limits.
+        :return: A Dict of {queue_id, max_rate} for the queues to be updated.
+        """
+        if queue_limits is None:
+            queue_limits = self.get_queue_limits()
+        applied = self.applied_queues.get((dpid, port), ())
+        return {qid: limit for qid, limit in enumerate(queue_limits) if qid >= len(applied) or applied[qid] != limit}
+
     def set_queues(self, dpid: int = "all"):
         """
         Set queues on switches so that limits can be set on them.
 
+        Only the placed ports of registered datapaths whose queues differ from the last successfully applied ones are
+        updated. With the rest backend, if every port of a datapath is stale, a single request updates them all. With
+        the ovsdb backend, the changed queues of every stale port are updated in a single transaction.
+
         :param dpid: Optional numeric parameter to specify on which switch the queues should be set. Defaults to 'all'.
         """
+        queue_limits = self.get_queue_limits()
+        dpids = list(self.datapath_ports) if dpid == "all" else [dpid]
+        if not any(d in self.datapath_ports for d in dpids):
+            if self._ovsdb is not None:
+                self.__logger.warning("Cannot set queues on %s, its ports are unknown." % dpid)
+                return
+            # Nothing to track, e.g. the datapath has not been registered, so simply push everything
+            self._post_queues(dpid, None, queue_limits)
+            return
+
+        stale = {d: self.stale_ports(d, queue_limits) for d in dpids}
+        stale = {d: ports for d, ports in stale.items() if ports}
+        if not stale:
+            self.__logger.debug("Queues are up to date on %s." % dpid)
+            return
+
+        if self._ovsdb is not None:
+            diffs = {(d, port): self.queue_diff(d, port, queue_limits) for d, ports in stale.items() for port in ports}
+            for key in self._ovsdb.set_queues(diffs, queue_limits):
+                self.applied_queues[key] = tuple(queue_limits)
+            return
+
+        targets: List[Tuple[Union[int, str], Optional[str], List[Tuple[int, str]]]] = []  # (dpid, port, covered)
+        all_stale = {d: len(ports) == len(self.datapath_ports[d]) for d, ports in stale.items()}
+        if dpid == "all" and len(stale) == len(self.datapath_ports) and all(all_stale.values()):
+            targets.append(("all", None, [(d, port) for d, ports in stale.items() for port in ports]))
+        else:
+            for d, ports in stale.items():
+                if all_stale[d]:
+                    targets.append((d, None, [(d, port) for port in ports]))
+                else:
+                    targets.extend((d, port, [(d, port)]) for port in ports)
+
+        for target, port_name, covered in targets:
+            if self._post_queues(target, port_name, queue_limits):
+                for key in covered:
+                    self.applied_queues[key] = tuple(queue_limits)
+
+    def _post_queues(self, dpid: Union[int, str], port_name: Optional[str], queue_limits: List[int]) -> bool:
+        """
+        Send the queue settings to rest_qos.
+
+        :param port_name: The port to set queues on. If None, all ports of the switch are set.
+        :return: Whether the setting has succeeded.
+        """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        queue_limits = [QoSManager.DEFAULT_MAX_RATE] + [self.get_current_limit(k) for k in self.flows_limits]
+        body = {"type": "linux-htb", "max_rate": str(QoSManager.DEFAULT_MAX_RATE),
+                "queues": [{"max_rate": str(limit)} for limit in queue_limits]}
+        if port_name is not None:
+            # From doc: port_name is optional argument. If does not pass the port_name argument, all ports are target
+            # for configuration.
+            body["port_name"] = port_name
+        where = dpid if port_name is None else "%s:%s" % (dpid, port_name)
         try:
-            r = requests.post("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid),
-                              headers={'Content-Type': 'application/json'},
-                              data=json.dumps({
-                                  # From doc: port_name is optional argument. If does not pass the port_name argument,
-                                  # all ports are target for configuration.
-                                  "type": "linux-htb", "max_rate": str(QoSManager.DEFAULT_MAX_RATE),
-                                  "queues":
-                                      [{"max_rate": str(limit)} for limit in queue_limits]
-                              }))
+            r = self._rest.post("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "POST /qos/queue",
+                                headers={'Content-Type': 'application/json'},
+                                data=json.dumps(body))
             self.log_http_response(r)
             r2 = r
             if self.is_http_response_ok(r) is False and r.text.find("ovs_bridge") != -1:
                 delay = 0.1
                 self.__logger.error("Queue setting failed on %s probably due to early trial. Retrying once in %.2fs."
-                                    % (dpid, delay))
+                                    % (where, delay))
                 ryu.lib.hub.sleep(delay)
-                r2 = requests.Session().send(r.request)
+                r2 = self._rest.send(r.request, "POST /qos/queue")
                 self.log_http_response(r2)
 
             if self.is_http_response_ok(r) or self.is_http_response_ok(r2):
-                self.__logger.info("Queue setting has completed on %s successfully." % dpid)
-        except requests.exceptions.ConnectionError as err:
+                self.__logger.info("Queue setting has completed on %s successfully." % where)
+                return True
+        except requests.exceptions.RequestException as err:
             self.__logger.error("Queue setting has failed. {}".format(err))
+        return False
 
     def get_queues(self, dpid: int = "all"):
         """
@@ -128,7 +358,7 @@ class QoSManager:
         """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        r = requests.get("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid))
+        r = self._rest.get("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "GET /qos/queue")
         self.log_http_response(r)
 
     def delete_queues(self, dpid: int = "all"):
@@ -140,72 +370,64 @@ class QoSManager:
         """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        r = requests.delete("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid))
+        r = self._rest.delete("%s/qos/queue/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "DELETE /qos/queue")
         self.log_http_response(r)
 
-    def _pre_adapt(self, flowstats: Dict[FlowId, float]) -> bool:
+    def _pre_adapt(self, flowstats: Dict[FlowId, float]) -> Set[int]:
         """
         Calculate and locally update queue limits before sending updates to the switch.
 
-        :return: Whether queue update needs to be sent to the switches or not.
-        """
-        modified = False
-        unexploited_flows = [k for k, v in flowstats.items() if v < self.get_initial_limit(k)]
-        full_flows = [k for k, v in flowstats.items() if v >= self.get_initial_limit(k)]
-        self.__logger.debug("unexploited:\t%s" % unexploited_flows)
-        self.__logger.debug("full:\t%s" % full_flows)
-
-        overall_gain = 0  # b/s which is available extra after rate reduction
+        The calculation is done by the batch `AllocationEngine` and gives the same result as the scalar reference
+        implementation `benchmark.allocation.pre_adapt_scalar`.
 
-        for flow in unexploited_flows:
-            load = flowstats[flow]
-            original_limit = self.get_initial_limit(flow)
-            bw_step = 0.1 * original_limit  # The granularity in which adaptation happens
-            newlimit = max(ceil(load / bw_step) * bw_step, original_limit / 4)
-
-            # Update the flows bandwidth limit only if _both the load and the new limit_ are further away from the
-            # current limit than LIMIT_STEP. This dual condition is to avoid flapping of bandwidth settings when the
-            # load is around an adaptation point and updating limits on flows with little resource assigned.
-            if abs(load - self.get_current_limit(flow)) >= QoSManager.LIMIT_STEP and \
-                    self._update_limit(flow,
-                                       newlimit):  # This only runs if the first condition is true -> should be okay
-                modified = True
-            overall_gain += original_limit - self.get_current_limit(flow)
+        :return: The ids of the queues whose limit has changed. It is empty if no update needs to be sent.
+        """
+        rows = self._engine.rows(flowstats)
+        loads = np.fromiter(flowstats.values(), dtype=np.float64, count=len(rows))
+        changed = self._engine.adapt_rows(rows, loads, QoSManager.LIMIT_STEP)
+        for row in changed.tolist():
+            flow = self._engine.flows[row]
+            newlimit = int(self._engine.limits[row])
+            self.flows_limits[flow] = FlowLimitEntry(newlimit, self.flows_limits[flow].queue_id)
+            self.__logger.info("Flow limit for flow '%s' updated to %dbps", flow, newlimit)
+        return set(self._engine.queue_ids[changed].tolist())
+
+    def adapt_queues(self, flowstats: Dict[FlowId, float]) -> bool:
+        """
+        Adapt the queue limits to the measured loads and push them if needed.
 
-        try:
-            gain_per_flow = overall_gain / len(full_flows)
-        except ZeroDivisionError:
-            gain_per_flow = 0
-        for flow in full_flows:
-            if self._update_limit(flow, self.get_initial_limit(flow) + gain_per_flow):
-                modified = True
-        return modified
-
-    def adapt_queues(self, flowstats: Dict[FlowId, float]):
-        modified = self._pre_adapt(flowstats)
-        if modified:
+        :return: Whether queue settings have been pushed.
+        """
+        with PRE_ADAPT_SECONDS.time():
+            modified = self._pre_adapt(flowstats)
+        if modified or self.has_stale_queues():
             self.set_queues()
+            return True
+        return False
 
-    def set_rules(self, dpid: int = "all"):
+    def set_rules(self, dpid: int = "all", flows: List[FlowId] = None):
         """
         Set rules for differentiated flows in switches.
 
         :param dpid: Optional numeric parameter to specify on which switch the rules should be set. Defaults to 'all'.
+        :param flows: The flows to set the rules of. Defaults to every flow.
         """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        for k in self.flows_limits:
-            r = requests.post("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid),
-                              headers={'Content-Type': 'application/json'},
-                              data=json.dumps({
-                                  "match": {
-                                      "nw_dst": k.ipv4_dst,
-                                      "nw_proto": "UDP",
-                                      "tp_dst": k.udp_dst,
-                                  },
-                                  "actions": {"queue": self.flows_limits[k].queue_id}
-                              }))
-            self.log_http_response(r)
+        for k in (self.flows_limits if flows is None else flows):
+            # rest_qos takes prefixes in CIDR notation, but a range of ports takes one rule per port
+            for port in k.ports():
+                r = self._rest.post("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "POST /qos/rules",
+                                    headers={'Content-Type': 'application/json'},
+                                    data=json.dumps({
+                                        "match": {
+                                            "nw_dst": k.ipv4_dst,
+                                            "nw_proto": "UDP",
+                                            "tp_dst": port,
+                                        },
+                                        "actions": {"queue": self.flows_limits[k].queue_id}
+                                    }))
+                self.log_http_response(r)
 
     def get_rules(self, dpid: int = "all"):
         """
@@ -220,7 +442,7 @@ class QoSManager:
         """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        r = requests.get("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid))
+        r = self._rest.get("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "GET /qos/rules")
         self.log_http_response(r)
 
     def delete_rules(self, dpid: int = "all"):
@@ -232,9 +454,9 @@ class QoSManager:
         """
         if type(dpid) == int:
             dpid = "%016x" % dpid
-        r = requests.delete("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid),
-                            headers={'Content-Type': 'application/json'},
-                            data=json.dumps({"qos_id": "all"}))
+        r = self._rest.delete("%s/qos/rules/%s" % (QoSManager.CONTROLLER_BASEURL, dpid), "DELETE /qos/rules",
+                              headers={'Content-Type': 'application/json'},
+                              data=json.dumps({"qos_id": "all"}))
         self.log_http_response(r)
 
     def get_current_limit(self, flow: FlowId) -> int:
@@ -245,6 +467,14 @@ class QoSManager:
         """
         return self.flows_limits[flow].limit
 
+    def get_queue_ids(self) -> Dict[FlowId, int]:
+        """
+        Get the queue assigned to each flow.
+
+        :return: A Dict of {FlowId, queue_id}.
+        """
+        return {flow: entry.queue_id for flow, entry in self.flows_limits.items()}
+
     def get_initial_limit(self, flow: FlowId) -> int:
         """
         Get initial limit for a specific flow.
@@ -253,6 +483,22 @@ class QoSManager:
         """
         return self.FLOWS_INIT_LIMITS[flow].limit
 
+    def limit_rows(self, flows: List[FlowId]) -> np.ndarray:
+        """
+        Translate flows to their position in the arrays of `get_limits_arrays`.
+
+        :raises KeyError: If a flow is not managed.
+        """
+        return self._engine.rows(flows)
+
+    def get_limits_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the current and the initial limit of every flow in bits/s, without copying. See `limit_rows`.
+
+        :return: Two arrays: the current limits and the initial limits.
+        """
+        return self._engine.limits, self._engine.init_limits
+
     def _update_limit(self, flow: FlowId, newlimit, force: bool = False) -> bool:
         """
         Update the limit of a queue related to `flow`.
@@ -266,6 +512,7 @@ class QoSManager:
         """
         if abs(newlimit - self.get_current_limit(flow)) > QoSManager.LIMIT_STEP or force:
             self.flows_limits[flow] = FlowLimitEntry(int(newlimit), self.flows_limits[flow].queue_id)
+            self._engine.limits[self._engine.index[flow]] = int(newlimit)
             self.__logger.info("Flow limit for flow '{}' updated to {}bps".format(flow, newlimit))
             return True
         else:
@@ -288,7 +535,14 @@ class QoSManager:
 
 
 class ThreadedQoSManager(QoSManager):
-    """Does the same thing as QoSManager, but wraps its functions to be thread safe."""
+    """
+    Does the same thing as QoSManager, but wraps its functions to be thread safe.
+
+    Operations on a specific datapath are serialised by a semaphore of that datapath, so different datapaths can be
+    configured concurrently. Operations on "all" datapaths use a common semaphore. Besides, those on the queues take the
+    semaphore of every registered datapath, as they read and write the applied queues of the same ports as the
+    operations on a single datapath.
+    """
 
     def __init__(self, flows_with_init_limits: Dict[FlowId, int],
                  sem_cls: Type[ryu.lib.hub.Semaphore] = ryu.lib.hub.BoundedSemaphore,
@@ -303,28 +557,67 @@ class ThreadedQoSManager(QoSManager):
         super().__init__(flows_with_init_limits)
         self.__logger = logging.getLogger("threaded_qos_manager")
 
+        self._sem_cls = sem_cls
         self._resource_set_sem = sem_cls(1)
+        self._datapath_sems: Dict[int, ryu.lib.hub.Semaphore] = {}
         self._adapt_sem = sem_cls(1)
         self._sem_blocking = blocking
 
-    def thread_safe_resource(func):
+    def _resource_sem(self, dpid) -> ryu.lib.hub.Semaphore:
+        if type(dpid) != int:
+            return self._resource_set_sem
+        if dpid not in self._datapath_sems:
+            self._datapath_sems[dpid] = self._sem_cls(1)
+        return self._datapath_sems[dpid]
+
+    def _acquire(self, dpid, exclusive: bool, blocking: bool) -> Optional[List[ryu.lib.hub.Semaphore]]:
+        """
+        Acquire the semaphores of an operation.
+
+        :param exclusive: Whether an operation on "all" datapaths also excludes the operations on every single one.
+        :return: The acquired semaphores, None if one of them could not be acquired and none is held.
+        """
+        sems = [self._resource_sem(dpid)]
+        if exclusive and type(dpid) != int:
+            # In the order of the datapath ids, so two operations on "all" can not wait for each other
+            sems.extend(self._resource_sem(d) for d in sorted(set(self._datapath_sems) | set(self.datapath_ports)))
+        acquired = []
+        for sem in sems:
+            if sem.acquire(blocking) is False:
+                for held in reversed(acquired):
+                    held.release()
+                return None
+            acquired.append(sem)
+        return acquired
+
+    def thread_safe_resource(func, exclusive: bool = True):
         def wrapper(self, *args, blocking: bool = None):
             if blocking is None:
                 blocking = self._sem_blocking
-            sem_acquired = self._resource_set_sem.acquire(blocking)
+            sems = self._acquire(args[0] if args else "all", exclusive, blocking)
             self.__logger.debug("thread_safe_resource called with blocking = %s" % blocking)
-            self.__logger.debug("_resource_set_sem.acquire = %s" % sem_acquired)
-            if sem_acquired is False:
+            self.__logger.debug("semaphores acquired = %s" % (sems is not None))
+            if sems is None:
                 self.__logger.debug("Skipping %s due to other pending operation." % func.__name__)
+                SKIPPED_OPERATIONS.labels(operation=func.__name__).inc()
                 return
 
-            ret = func(self, *args)
-
-            self._resource_set_sem.release(blocking)
-            return ret
+            try:
+                return func(self, *args)
+            finally:
+                for sem in reversed(sems):
+                    sem.release()
         return wrapper
 
-    @thread_safe_resource
+    # Like `thread_safe_resource`, but an operation on "all" datapaths runs next to those on single datapaths, for the
+    # operations that do not read or write any tracked state
+    thread_safe_fanout = functools.partial(thread_safe_resource, exclusive=False)
+
+    def unregister_datapath(self, dpid: int) -> None:
+        super().unregister_datapath(dpid)
+        self._datapath_sems.pop(dpid, None)
+
+    @thread_safe_fanout
     def set_ovsdb_addr(self, dpid: int):
         return super().set_ovsdb_addr(dpid)
 
@@ -340,24 +633,34 @@ class ThreadedQoSManager(QoSManager):
     def delete_queues(self, dpid: int = "all"):
         return super().delete_queues(dpid)
 
-    def adapt_queues(self, flowstats: Dict[FlowId, float], blocking: bool = None):
+    def adapt_queues(self, flowstats: Dict[FlowId, float], blocking: bool = None) -> Optional[bool]:
+        """
+        See `QoSManager.adapt_queues`.
+
+        :return: None if the adaptation has been skipped, otherwise whether queue settings have been pushed.
+        """
         if blocking is None:
             blocking = self._sem_blocking
         sem_acquired = self._adapt_sem.acquire(blocking)
         self.__logger.debug("_adapt_sem.acquire = %s" % sem_acquired)
         if sem_acquired is False:
             self.__logger.debug("Skipping queue adaptation due to other pending operation.")
-            return
-
-        modified = self._pre_adapt(flowstats)
-        if modified:
-            self.set_queues(blocking=True)
+            SKIPPED_OPERATIONS.labels(operation="adapt_queues").inc()
+            return None
 
-        self._adapt_sem.release(blocking)
+        try:
+            with PRE_ADAPT_SECONDS.time():
+                modified = self._pre_adapt(flowstats)
+            if modified or self.has_stale_queues():
+                self.set_queues(blocking=True)
+                return True
+            return False
+        finally:
+            self._adapt_sem.release(blocking)
 
-    @thread_safe_resource
-    def set_rules(self, dpid: int = "all"):
-        return super().set_rules(dpid)
+    @thread_safe_fanout
+    def set_rules(self, dpid: int = "all", flows: List[FlowId] = None):
+        return super().set_rules(dpid, flows)
 
     @thread_safe_resource
     def get_rules(self, dpid: int = "all"):
@@ -0,0 +1,284 @@
+"""
+Append-only binary recorder of the flow statistics, and the tools to read it back.
+
+The records are fixed size and are written to memory mapped segment files that are rotated when full. Each segment
+starts with a header holding a magic string and the number of valid records, so a segment can be read while it is
+being written. The flows and the datapath names are stored once in a JSON sidecar file next to the segments.
+
+Convert a recording to the log formats of `AdaptingMonitor13`:
+
+    python recorder.py experiment-logs/stats --format csv > experiments.log.csv
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import Dict, Iterator, List, TextIO, Tuple
+
+import numpy as np
+
+import config_handler
+from flow import FlowId
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),  # Seconds since the epoch
+    ("dpid", "<u8"),
+    ("flow", "<u4"),  # Index into the flow table of the sidecar file
+    ("speed", "<f8"),  # Average speed in bits/s
+    ("limit", "<i8"),  # Current limit in bits/s
+    ("init_limit", "<i8"),  # Initial limit in bits/s
+])
+MAGIC = b"QOSREC01"
+HEADER_SIZE = 16  # Magic, then the number of valid records as a little-endian uint64
+SIDECAR = "flows.json"
+
+
+def _segment_name(number: int) -> str:
+    return "segment-%08d.bin" % number
+
+
+def _segments(directory: str) -> List[str]:
+    """
+    :return: The paths of the segments in `directory`, oldest first.
+    """
+    names = sorted(name for name in os.listdir(directory) if name.startswith("segment-") and name.endswith(".bin"))
+    return [os.path.join(directory, name) for name in names]
+
+
+class Recorder:
+    """
+    Write flow statistics to rotated, memory mapped segment files.
+
+    Appending a block of records is a single array copy into the mapped file, with no formatting or system call.
+    """
+
+    DIRECTORY = "experiment-logs/stats"  # Where the controller records to
+    SEGMENT_RECORDS = 1 << 16  # Number of records per segment file
+    MAX_SEGMENTS = 64  # Number of segment files kept, the oldest ones are deleted. 0 keeps every segment.
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "stat_record_dir" in ch.config:
+            cls.DIRECTORY = ch.config["stat_record_dir"]
+            logger.info("stat_record_dir set to {}".format(cls.DIRECTORY))
+        else:
+            logger.debug("stat_record_dir not set")
+
+        if "stat_record_segment_records" in ch.config:
+            cls.SEGMENT_RECORDS = int(ch.config["stat_record_segment_records"])
+            logger.info("stat_record_segment_records set to {}".format(cls.SEGMENT_RECORDS))
+        else:
+            logger.debug("stat_record_segment_records not set")
+
+        if "stat_record_max_segments" in ch.config:
+            cls.MAX_SEGMENTS = int(ch.config["stat_record_max_segments"])
+            logger.info("stat_record_max_segments set to {}".format(cls.MAX_SEGMENTS))
+        else:
+            logger.debug("stat_record_max_segments not set")
+
+    def __init__(self, directory: str, segment_records: int = None, max_segments: int = None):
+        """
+        Open a recording in `directory`, continuing it if it already exists.
+
+        :param segment_records: Defaults to `SEGMENT_RECORDS`.
+        :param max_segments: Defaults to `MAX_SEGMENTS`.
+        """
+        self.directory = directory
+        self.segment_records = Recorder.SEGMENT_RECORDS if segment_records is None else segment_records
+        self.max_segments = Recorder.MAX_SEGMENTS if max_segments is None else max_segments
+        os.makedirs(directory, exist_ok=True)
+
+        self.flows: List[FlowId] = []  # Flow table, index -> FlowId
+        self.flow_index: Dict[FlowId, int] = {}
+        self.datapath_names: Dict[int, str] = {}
+        sidecar = os.path.join(directory, SIDECAR)
+        if os.path.exists(sidecar):
+            self.flows, self.datapath_names = read_sidecar(directory)
+            self.flow_index = {flow: i for i, flow in enumerate(self.flows)}
+
+        segments = _segments(directory)
+        self._number = int(os.path.basename(segments[-1])[8:16]) if segments else 0
+        self._map: np.memmap = None
+        self._count: np.ndarray = None  # View of the record count in the header
+        self._records: np.ndarray = None
+        self._open_segment(self._number, exists=bool(segments))
+
+    def _open_segment(self, number: int, exists: bool = False) -> None:
+        path = os.path.join(self.directory, _segment_name(number))
+        size = HEADER_SIZE + self.segment_records * RECORD_DTYPE.itemsize
+        if exists:
+            self._map = np.memmap(path, dtype=np.uint8, mode="r+")
+            if bytes(self._map[:len(MAGIC)]) != MAGIC or self._map.size != size:
+                # Written by another version or with another segment size, leave it alone
+                self._map = None
+                self._open_segment(number + 1)
+                return
+        else:
+            self._map = np.memmap(path, dtype=np.uint8, mode="w+", shape=(size,))
+            self._map[:len(MAGIC)] = np.frombuffer(MAGIC, dtype=np.uint8)
+        self._number = number
+        self._count = self._map[len(MAGIC):HEADER_SIZE].view("<u8")
+        self._records = self._map[HEADER_SIZE:].view(RECORD_DTYPE)
+
+    def _rotate(self) -> None:
+        self._map.flush()
+        self._open_segment(self._number + 1)
+        if self.max_segments > 0:
+            for path in _segments(self.directory)[:-self.max_segments]:
+                os.remove(path)
+
+    def _write_sidecar(self) -> None:
+        sidecar = os.path.join(self.directory, SIDECAR)
+        with open(sidecar + ".tmp", "w") as f:
+            json.dump({
+                "flows": [flow.to_dict() for flow in self.flows],
+                "datapaths": {str(dpid): name for dpid, name in self.datapath_names.items()},
+            }, f)
+        os.replace(sidecar + ".tmp", sidecar)
+
+    def flow_indices(self, flows: List[FlowId]) -> np.ndarray:
+        """
+        Translate flows to their index in the flow table, adding the unknown ones.
+        """
+        added = False
+        for flow in flows:
+            if flow not in self.flow_index:
+                self.flow_index[flow] = len(self.flows)
+                self.flows.append(flow)
+                added = True
+        if added:
+            self._write_sidecar()
+        return np.fromiter((self.flow_index[flow] for flow in flows), dtype=np.uint32, count=len(flows))
+
+    def set_datapath_name(self, dpid: int, name: str) -> None:
+        if self.datapath_names.get(dpid) != name:
+            self.datapath_names[dpid] = name
+            self._write_sidecar()
+
+    def append(self, timestamp: float, dpid: int, flows: np.ndarray, speeds: np.ndarray, limits: np.ndarray,
+               init_limits: np.ndarray) -> None:
+        """
+        Append the statistics of the flows of a datapath.
+
+        :param flows: The flow table indices of the flows, see `flow_indices`.
+        :param speeds: The average speed of each flow in bits/s.
+        :param limits: The current limit of each flow in bits/s.
+        :param init_limits: The initial limit of each flow in bits/s.
+        """
+        start = 0
+        while start < len(flows):
+            count = int(self._count[0])
+            if count == self.segment_records:
+                self._rotate()
+                count = 0
+            end = min(len(flows), start + self.segment_records - count)
+            block = self._records[count:count + end - start]
+            block["timestamp"] = timestamp
+            block["dpid"] = dpid
+            block["flow"] = flows[start:end]
+            block["speed"] = speeds[start:end]
+            block["limit"] = limits[start:end]
+            block["init_limit"] = init_limits[start:end]
+            # Publish the records only after they have been written
+            self._count[0] = count + end - start
+            start = end
+
+    def flush(self) -> None:
+        self._map.flush()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.flush()
+            self._map = self._count = self._records = None
+
+
+def read_sidecar(directory: str) -> Tuple[List[FlowId], Dict[int, str]]:
+    """
+    :return: The flow table and the datapath names of a recording.
+    """
+    with open(os.path.join(directory, SIDECAR)) as f:
+        sidecar = json.load(f)
+    return [FlowId.from_dict(flow) for flow in sidecar["flows"]], \
+        {int(dpid): name for dpid, name in sidecar["datapaths"].items()}
+
+
+def read_segments(directory: str) -> Iterator[np.ndarray]:
+    """
+    Read a recording segment by segment, oldest first.
+
+    :return: Structured arrays of `RECORD_DTYPE`, one per segment.
+    """
+    for path in _segments(directory):
+        data = np.fromfile(path, dtype=np.uint8)
+        if data.size < HEADER_SIZE or bytes(data[:len(MAGIC)]) != MAGIC:
+            continue
+        count = int(data[len(MAGIC):HEADER_SIZE].view("<u8")[0])
+        yield data[HEADER_SIZE:].view(RECORD_DTYPE)[:count]
+
+
+def read(directory: str) -> np.ndarray:
+    """
+    Read a whole recording into one structured array of `RECORD_DTYPE`.
+    """
+    segments = list(read_segments(directory))
+    return np.concatenate(segments) if segments else np.empty(0, dtype=RECORD_DTYPE)
+
+
+def convert(directory: str, fmt: str, out: TextIO) -> None:
+    """
+    Convert a recording to the stat log of `AdaptingMonitor13` in the given format, one segment at a time.
+
+    Every line is prefixed as the record handler of `logger.conf` does, so the result can replace the log file.
+
+    :param fmt: "csv" or "human".
+    """
+    if fmt not in ("csv", "human"):
+        raise ValueError("Invalid format: %s" % fmt)
+    flows, names = read_sidecar(directory)
+    # Sort keys of the flows in the order of the log: by destination address and port
+    flow_order = np.empty(len(flows), dtype=np.int64)
+    flow_order[sorted(range(len(flows)), key=lambda i: (flows[i].ipv4_dst, flows[i].udp_dst))] = np.arange(len(flows))
+    header_fields = ('datapath', 'ipv4-dst', 'udp-dst', 'avg-speed (Mb/s)', 'current limit (Mb/s)',
+                     'initial limit (Mb/s)')
+
+    def line(timestamp: float, message: str) -> None:
+        out.write("%d,INFO,adapting_monitor,%s\n" % (timestamp, message))
+
+    for records in read_segments(directory):
+        # A snapshot may span two segments, which only splits its human header in two
+        for timestamp in np.unique(records["timestamp"]):
+            snapshot = records[records["timestamp"] == timestamp]
+            snapshot = snapshot[np.lexsort((snapshot["dpid"], flow_order[snapshot["flow"]]))]
+            if fmt == "human":
+                line(timestamp, "")
+                line(timestamp, '%10s %10s %7s %16s %20s %20s' % header_fields)
+                line(timestamp, '%s %s %s %s %s %s' % ('-' * 10, '-' * 10, '-' * 7, '-' * 16, '-' * 20, '-' * 20))
+            for record in snapshot.tolist():
+                flow = flows[record[2]]
+                entry = (names.get(record[1], "%016x" % record[1]), flow.ipv4_dst, flow.udp_dst_spec,
+                         record[3] / 10 ** 6, record[4] / 10 ** 6, record[5] / 10 ** 6)
+                if fmt == "human":
+                    line(timestamp, '%10s %10s %7s %16.2f %20.2f %20.2f' % entry)
+                else:
+                    line(timestamp, ",".join(str(field) for field in entry))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Convert a binary stat recording to the stat log formats.")
+    parser.add_argument("directory", help="The directory of the recording")
+    parser.add_argument("--format", choices=("csv", "human"), default="csv")
+    args = parser.parse_args(argv)
+    convert(args.directory, args.format, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
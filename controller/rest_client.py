@@ -0,0 +1,141 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config_handler
+from metrics import REST_REQUEST_SECONDS
+
+
+@dataclass
+class EndpointLatency:
+    count: int = 0  # Number of completed requests
+    errors: int = 0  # Number of requests that raised an exception
+    total_time: float = 0.0  # Sum of the request durations in seconds
+    max_time: float = 0.0  # Longest request duration in seconds
+
+    def record(self, duration: float, error: bool = False) -> None:
+        self.count += 1
+        self.errors += int(error)
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    def avg_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+
+class RestClient:
+    """
+    HTTP client with a shared keep-alive connection pool for the REST APIs of the controller.
+
+    Connection errors are retried for every method with exponential backoff, while read errors are only retried for
+    idempotent methods, so a timed out POST is never sent twice. The latency of the requests is counted per endpoint.
+    """
+
+    POOL_SIZE = 10  # Maximum number of kept-alive connections per host
+    TIMEOUT = 5.0  # Seconds to wait for connecting and for the response, each
+    RETRIES = 3  # Maximum number of retries of a request
+    BACKOFF_FACTOR = 0.1  # Retry n waits BACKOFF_FACTOR * 2^(n-1) seconds
+    __shared: 'RestClient' = None
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        for key, attr, conv in (("rest_pool_size", "POOL_SIZE", int), ("rest_timeout", "TIMEOUT", float),
+                                ("rest_retries", "RETRIES", int), ("rest_backoff_factor", "BACKOFF_FACTOR", float)):
+            if key in ch.config:
+                setattr(cls, attr, conv(ch.config[key]))
+                logger.info("{} set to {}".format(key, getattr(cls, attr)))
+            else:
+                logger.debug("{} not set".format(key))
+
+    @classmethod
+    def shared(cls) -> 'RestClient':
+        """
+        Get the client shared by the whole controller, creating it with the configured values at the first call.
+        """
+        if cls.__shared is None:
+            cls.__shared = cls()
+        return cls.__shared
+
+    def __init__(self, pool_size: int = None, timeout: float = None, retries: int = None,
+                 backoff_factor: float = None):
+        """
+        Create a client with its own connection pool. Parameters not set default to the configured class values.
+        """
+        self.timeout = RestClient.TIMEOUT if timeout is None else timeout
+        pool_size = RestClient.POOL_SIZE if pool_size is None else pool_size
+        retry = Retry(total=RestClient.RETRIES if retries is None else retries,
+                      backoff_factor=RestClient.BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latencies: Dict[str, EndpointLatency] = {}  # Key: endpoint label
+
+        self.__logger = logging.getLogger("rest_client")
+
+    def _timed(self, endpoint: str, func, *args, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        error = True
+        try:
+            r = func(*args, **kwargs)
+            error = False
+            return r
+        finally:
+            duration = time.perf_counter() - start
+            self.latencies.setdefault(endpoint, EndpointLatency()).record(duration, error)
+            REST_REQUEST_SECONDS.labels(endpoint=endpoint).observe(duration)
+            self.__logger.debug("%s took %.3fs", endpoint, duration)
+
+    def request(self, method: str, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        """
+        Send a request through the connection pool.
+
+        :param method: The HTTP method.
+        :param url: The URL to send the request to.
+        :param endpoint: Label to count the latency under. Defaults to "`method` `url`", so it should be set for URLs
+        with variable parts, like datapath ids.
+        :param kwargs: Passed to `requests.Session.request`. `timeout` defaults to the one of the client.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if endpoint is None:
+            endpoint = "{} {}".format(method.upper(), url)
+        return self._timed(endpoint, self.session.request, method, url, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, endpoint: str = None) -> requests.Response:
+        """
+        Send an already prepared request, e.g. to repeat one, through the connection pool.
+
+        :param endpoint: See `RestClient.request`.
+        """
+        if endpoint is None:
+            endpoint = "{} {}".format(request.method, request.url)
+        return self._timed(endpoint, self.session.send, request, timeout=self.timeout)
+
+    def get(self, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def put(self, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        return self.request("PUT", url, endpoint, **kwargs)
+
+    def delete(self, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, endpoint, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
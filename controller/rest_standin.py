@@ -0,0 +1,107 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+_QOS_PATH = re.compile(r"^/qos/(queue|rules)/(\w+)$")
+_OVSDB_ADDR_PATH = re.compile(r"^/v1\.0/conf/switches/(\w+)/ovsdb_addr$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as Ryu's WSGI server
+
+    def _reply(self, status: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else ""
+        status, reply = self.server.standin.handle(self.command, self.path, body)
+        self._reply(status, reply)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RestQoSStandIn:
+    """
+    In-process stand-in for the rest_qos and rest_conf_switch APIs of Ryu, to benchmark `QoSManager` offline.
+
+    It accepts the requests `QoSManager` sends, answers like rest_qos does on success and remembers the last queue
+    settings per switch and port. Nothing is applied to switches.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0):
+        """
+        :param port: The TCP port to listen on. Defaults to a free port.
+        :param delay: Seconds to wait before answering, to emulate the time rest_qos takes to reach the OVSDB.
+        """
+        self.delay = delay
+        self.requests: Dict[str, int] = {}  # Number of requests per "METHOD /endpoint"
+        self.queues: Dict[Tuple[str, str], List[str]] = {}  # Key: (switch id, port name or "all"), the max_rates
+        self.ovsdb_addrs: Dict[str, str] = {}  # Key: switch id
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self) -> 'RestQoSStandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method: str, path: str, body: str) -> Tuple[int, object]:
+        """
+        Handle one request.
+
+        :return: The status code and the JSON body of the reply.
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        match = _OVSDB_ADDR_PATH.match(path)
+        if match:
+            with self._lock:
+                self._count(method, "/v1.0/conf/switches/ovsdb_addr")
+                if method == "PUT":
+                    self.ovsdb_addrs[match.group(1)] = json.loads(body)
+            return 201, None
+
+        match = _QOS_PATH.match(path)
+        if match is None:
+            return 404, {"error": "unknown path %s" % path}
+        resource, switch_id = match.groups()
+        with self._lock:
+            self._count(method, "/qos/" + resource)
+            if resource == "queue" and method == "POST":
+                settings = json.loads(body)
+                self.queues[(switch_id, settings.get("port_name", "all"))] = \
+                    [queue["max_rate"] for queue in settings["queues"]]
+        return 200, [{"switch_id": switch_id, "command_result": {"result": "success", "details": "%s %s" % (
+            method, resource)}}]
+
+    def _count(self, method: str, endpoint: str) -> None:
+        key = "{} {}".format(method, endpoint)
+        self.requests[key] = self.requests.get(key, 0) + 1
@@ -0,0 +1,80 @@
+import itertools
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import ryu.lib.hub
+
+
+class StatsRound:
+    """One round of statistics requests sent to a set of datapaths."""
+
+    def __init__(self, round_id: int, dpids: Iterable[int]):
+        self.round_id = round_id
+        self.started = time.time()
+        self.pending: Set[int] = set(dpids)  # Datapaths that have not answered yet
+        self.answered: Set[int] = set()
+        self.done = ryu.lib.hub.Event()  # Set when every datapath has answered
+        if not self.pending:
+            self.done.set()
+
+    def complete(self) -> bool:
+        return not self.pending
+
+    def _finish(self, dpid: int, answered: bool) -> None:
+        if dpid in self.pending:
+            self.pending.discard(dpid)
+            if answered:
+                self.answered.add(dpid)
+            if not self.pending:
+                self.done.set()
+
+
+class RoundTracker:
+    """
+    Tag the statistics requests with rounds and track which datapaths have answered in the current round.
+
+    Replies to requests of earlier rounds are recognised, so a late reply can not complete a newer round.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.current: Optional[StatsRound] = None
+        self._requests: Dict[Tuple[int, int], StatsRound] = {}  # Key: (dpid, xid) of the requests of the round
+
+    def start(self, dpids: Iterable[int]) -> StatsRound:
+        """
+        Start a new round. The requests of the previous round are forgotten.
+
+        :param dpids: The datapaths that are expected to answer.
+        """
+        self.current = StatsRound(next(self._ids), dpids)
+        self._requests = {}
+        return self.current
+
+    def register_request(self, dpid: int, xid: int) -> None:
+        """
+        Register a request sent in the current round.
+        """
+        self._requests[(dpid, xid)] = self.current
+
+    def reply(self, dpid: int, xid: int, more: bool = False) -> bool:
+        """
+        Register a reply.
+
+        :param more: Whether more parts of the reply are to come. The datapath has answered at the last part.
+        :return: Whether the reply belongs to a request of the current round.
+        """
+        stats_round = self._requests.get((dpid, xid))
+        if stats_round is None or stats_round is not self.current:
+            return False
+        if not more:
+            del self._requests[(dpid, xid)]
+            stats_round._finish(dpid, True)
+        return True
+
+    def remove_datapath(self, dpid: int) -> None:
+        """
+        Stop waiting for a datapath, e.g. because it has disconnected.
+        """
+        if self.current is not None:
+            self.current._finish(dpid, False)
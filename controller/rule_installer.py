@@ -0,0 +1,170 @@
+import ipaddress
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+import ryu.lib.hub
+
+from flow import FlowId
+
+QOS_TABLE_ID = 0  # The table the classification rules are installed in, the same as rest_qos uses
+RULE_PRIORITY = 1  # The priority of the classification rules, the same as rest_qos uses by default
+# The classification rules carry RULE_COOKIE | queue_id as cookie. The tag is in the lower 32 bits because rest_qos
+# interprets those as the id of the rule, so the rules can still be listed and deleted through its REST API.
+RULE_COOKIE = 0x5a1c0000
+RULE_COOKIE_MASK = 0xffff0000
+
+
+@dataclass
+class _Batch:
+    dpid: int
+    flows: Dict[int, FlowId] = field(default_factory=dict)  # Key: xid of the FlowMod
+    failures: Dict[FlowId, str] = field(default_factory=dict)
+    done: ryu.lib.hub.Event = field(default_factory=ryu.lib.hub.Event)
+
+
+class RuleInstaller:
+    """
+    Install the classification rules of a datapath directly over its OpenFlow connection in one batch.
+
+    All the FlowMods are sent back-to-back followed by a barrier, so bringing up a switch costs a single round trip
+    regardless of the number of flows. Failures are collected per rule from the error messages the switch sends before
+    the barrier reply.
+
+    The owner application must forward `ofp_event.EventOFPErrorMsg` and `ofp_event.EventOFPBarrierReply` messages to
+    `error_handler` and `barrier_reply_handler`. As the replies arrive through the event loop of the owner application,
+    `install` must not be called from an event handler, but from a separate green thread.
+    """
+
+    BARRIER_TIMEOUT = 5  # Seconds to wait for the barrier reply
+
+    def __init__(self):
+        self._flowmods: Dict[Tuple[int, int], _Batch] = {}  # Key: (dpid, xid) of the FlowMods in progress
+        self._barriers: Dict[Tuple[int, int], _Batch] = {}  # Key: (dpid, xid) of the barriers in progress
+
+        self.__logger = logging.getLogger("rule_installer")
+
+    @staticmethod
+    def cookie(queue_id: int) -> int:
+        return RULE_COOKIE | queue_id
+
+    def flow_mods(self, datapath, flow: FlowId, queue_id: int, command: int = None) -> list:
+        """
+        Build the FlowMods that classify `flow` into the queue `queue_id`.
+
+        A prefix is matched with a mask, but OpenFlow 1.3 cannot mask udp_dst, so a range of ports takes one rule per
+        port.
+
+        :param command: The FlowMod command. Defaults to OFPFC_ADD.
+        """
+        return [self.flow_mod(datapath, flow, queue_id, command, port) for port in flow.ports()]
+
+    def flow_mod(self, datapath, flow: FlowId, queue_id: int, command: int = None, udp_dst: int = None):
+        """
+        Build the FlowMod that classifies `flow` into the queue `queue_id` and passes it to the next table.
+
+        :param command: The FlowMod command. Defaults to OFPFC_ADD.
+        :param udp_dst: The port to match. Defaults to the first port of `flow`.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if command is None:
+            command = ofproto.OFPFC_ADD
+        address, prefixlen = flow.network()
+        ipv4_dst = address if prefixlen == 32 else (address, str(ipaddress.IPv4Network(flow.ipv4_dst).netmask))
+        match = parser.OFPMatch(eth_type=0x0800, ipv4_dst=ipv4_dst, ip_proto=17,
+                                udp_dst=flow.udp_dst if udp_dst is None else udp_dst)
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, [parser.OFPActionSetQueue(queue_id)]),
+                parser.OFPInstructionGotoTable(QOS_TABLE_ID + 1)]
+        return parser.OFPFlowMod(datapath=datapath, cookie=self.cookie(queue_id), table_id=QOS_TABLE_ID,
+                                 command=command, priority=RULE_PRIORITY, match=match, instructions=inst,
+                                 out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY)
+
+    def install(self, datapath, rules: Dict[FlowId, int]) -> Dict[FlowId, str]:
+        """
+        Install the classification rules on the datapath and wait for the switch to process them.
+
+        :param rules: The queue id of each flow.
+        :return: The reason of failure for each flow whose rules could not all be installed. Empty on success.
+        """
+        failures = self._send_batch(datapath, rules, datapath.ofproto.OFPFC_ADD)
+        for flow, reason in failures.items():
+            self.__logger.error("Failed to install rule of %s on %016x: %s", flow, datapath.id, reason)
+        self.__logger.info("Installed %d of %d rules on %016x.", len(rules) - len(failures), len(rules), datapath.id)
+        return failures
+
+    def remove(self, datapath, rules: Dict[FlowId, int]) -> Dict[FlowId, str]:
+        """
+        Remove the classification rules of the flows from the datapath and wait for the switch to process it.
+
+        Only the rules matching exactly the ones `install` creates are deleted, so the other slices are not affected.
+
+        :param rules: The queue id of each flow.
+        :return: The reason of failure for each flow whose rules could not all be removed. Empty on success.
+        """
+        failures = self._send_batch(datapath, rules, datapath.ofproto.OFPFC_DELETE_STRICT)
+        for flow, reason in failures.items():
+            self.__logger.error("Failed to remove rule of %s from %016x: %s", flow, datapath.id, reason)
+        self.__logger.info("Removed %d of %d rules from %016x.", len(rules) - len(failures), len(rules), datapath.id)
+        return failures
+
+    def _send_batch(self, datapath, rules: Dict[FlowId, int], command: int) -> Dict[FlowId, str]:
+        """
+        Send the FlowMods of the flows with `command` followed by a barrier, and wait for the barrier reply.
+
+        :return: The reason of failure for each flow whose FlowMods have not all succeeded.
+        """
+        batch = _Batch(datapath.id)
+        msgs = []
+        for flow, queue_id in rules.items():
+            for mod in self.flow_mods(datapath, flow, queue_id, command):
+                datapath.set_xid(mod)
+                batch.flows[mod.xid] = flow
+                self._flowmods[(datapath.id, mod.xid)] = batch
+                msgs.append(mod)
+        barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+        datapath.set_xid(barrier)
+        self._barriers[(datapath.id, barrier.xid)] = batch
+        msgs.append(barrier)
+
+        try:
+            # Datapath.send_msg returns False if the message could not be queued for sending
+            sent = all([datapath.send_msg(msg) is not False for msg in msgs])
+            if not sent:
+                reason = "datapath disconnected"
+            elif not batch.done.wait(RuleInstaller.BARRIER_TIMEOUT):
+                reason = "no barrier reply in {}s".format(RuleInstaller.BARRIER_TIMEOUT)
+            else:
+                reason = None
+            if reason is not None:
+                for flow in batch.flows.values():
+                    batch.failures.setdefault(flow, reason)
+        finally:
+            for xid in batch.flows:
+                self._flowmods.pop((datapath.id, xid), None)
+            self._barriers.pop((datapath.id, barrier.xid), None)
+        return batch.failures
+
+    def error_handler(self, msg) -> bool:
+        """
+        Record the failure of a rule, if `msg` is an error message belonging to a FlowMod in progress.
+
+        :return: Whether the message belonged to a FlowMod sent by the installer.
+        """
+        batch = self._flowmods.get((msg.datapath.id, msg.xid))
+        if batch is None:
+            return False
+        batch.failures[batch.flows[msg.xid]] = "OFPErrorMsg type=0x{:02x} code=0x{:02x}".format(msg.type, msg.code)
+        return True
+
+    def barrier_reply_handler(self, msg) -> bool:
+        """
+        Finish the batch the barrier reply `msg` belongs to.
+
+        :return: Whether the message belonged to a barrier sent by the installer.
+        """
+        batch = self._barriers.get((msg.datapath.id, msg.xid))
+        if batch is None:
+            return False
+        batch.done.set()
+        return True
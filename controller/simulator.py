@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Offline simulator of the queue limit adaptation, replaying recorded traffic traces faster than real time.
+
+A trace is the rate of every flow over time. It is read from the stat log of `AdaptingMonitor13`
+(`experiments.log.csv`, already measured speeds) or from the iperf client CSV of `mininet/experiments` (offered rates,
+measured by the simulator the same way the controller measures the switch counters). Every `time_step` the measured
+speeds are passed to `QoSManager._pre_adapt`, and the simulator reports the limit timeline, the number of queue
+updates and the SLA violations: the time a flow is limited below its load while staying within its initial limit.
+
+Replay one trace with the values of a config file:
+
+    python simulator.py configs/hysteresis.yml experiment-logs/experiments.log.csv
+
+Sweep parameter combinations in a process pool:
+
+    python simulator.py configs/default.yml ue1.csv ue2.csv ue3.csv --set limit_step=1000000,2000000,3000000 \\
+        --set time_step=1,2,5 --set flowstat_window_size=3,5,10
+"""
+import argparse
+import csv
+import itertools
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, TextIO, Tuple
+
+import numpy as np
+import yaml
+
+import config_handler
+from classifier import SliceClassifier
+from flow import FlowId, FlowStat, new_flow_stat_manager
+from qos_manager import QoSManager
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+MAX_IPERF_INTERVAL = 1.5  # Longer iperf report intervals are the summaries of a whole run
+
+
+@dataclass
+class Trace:
+    flows: List[FlowId]
+    times: np.ndarray  # Seconds, increasing. The rates of sample i last until sample i + 1, the last one for 1 second.
+    rates: np.ndarray  # bits/s, shape (len(times), len(flows))
+    measured: bool  # Whether the rates are speeds measured by the controller rather than offered rates
+
+    @classmethod
+    def from_samples(cls, samples: List[Tuple[float, FlowId, float]], measured: bool) -> 'Trace':
+        """
+        Build a trace from (timestamp, flow, rate in bits/s) samples.
+
+        A flow keeps its last rate until its next sample, and sends nothing before its first and after its last sample.
+        """
+        if not samples:
+            raise ValueError("The trace has no samples.")
+        flows = sorted({flow for _, flow, _ in samples}, key=lambda f: (f.ipv4_dst, f.udp_dst))
+        column = {flow: i for i, flow in enumerate(flows)}
+        times = np.unique(np.fromiter((sample[0] for sample in samples), dtype=np.float64, count=len(samples)))
+        rates = np.full((len(times), len(flows)), np.nan)
+        for timestamp, flow, rate in samples:
+            rates[np.searchsorted(times, timestamp), column[flow]] = rate
+        for col in range(len(flows)):
+            known = np.flatnonzero(~np.isnan(rates[:, col]))
+            first, last = known[0], known[-1]
+            # Forward fill between the first and the last sample
+            fill = np.maximum.accumulate(np.where(np.isnan(rates[first:last + 1, col]), 0,
+                                                  np.arange(first, last + 1)))
+            rates[first:last + 1, col] = rates[fill, col]
+        np.nan_to_num(rates, copy=False, nan=0.0)
+        return cls(flows, times - times[0], rates, measured)
+
+    def durations(self) -> np.ndarray:
+        """
+        :return: How long each sample lasts in seconds.
+        """
+        return np.diff(self.times, append=self.times[-1] + 1)
+
+
+def read_stat_log(f: TextIO) -> List[Tuple[float, FlowId, float]]:
+    """
+    Read the samples of a csv stat log of `AdaptingMonitor13`, taking the highest speed of a flow across datapaths.
+    """
+    speeds: Dict[Tuple[float, FlowId], float] = {}
+    for row in csv.reader(f):
+        if len(row) != 9 or row[2] != "adapting_monitor":
+            continue
+        try:
+            key = (float(row[0]), FlowId.from_dict({"ipv4_dst": row[4], "udp_dst": row[5]}))
+            speed = float(row[6]) * 10 ** 6
+        except ValueError:
+            continue
+        speeds[key] = max(speed, speeds.get(key, 0.0))
+    return [(timestamp, flow, speed) for (timestamp, flow), speed in speeds.items()]
+
+
+def read_iperf_csv(f: TextIO) -> List[Tuple[float, FlowId, float]]:
+    """
+    Read the samples of the iperf client output of `mininet/experiments/common.sh`.
+
+    The lines are: Unix time stamp, local IP, local port, remote IP, remote port, report interval, bandwidth (bps).
+    The flow is identified by the remote (server) end. Other lines, e.g. titles, are skipped.
+    """
+    samples = []
+    for row in csv.reader(f):
+        if len(row) != 7:
+            continue
+        try:
+            start, end = (float(t) for t in row[5].split("-"))
+            if end - start > MAX_IPERF_INTERVAL:
+                continue
+            samples.append((float(row[0]), FlowId(row[3], int(row[4])), float(row[6])))
+        except ValueError:
+            continue
+    return samples
+
+
+def read_trace(paths: List[str], fmt: str = "auto") -> Trace:
+    """
+    Read and merge trace files.
+
+    :param fmt: "log" for stat logs, "iperf" for iperf client output, or "auto" to decide per file.
+    """
+    samples = []
+    measured = set()
+    for path in paths:
+        with open(path) as f:
+            file_fmt = fmt
+            if file_fmt == "auto":
+                first = next((row for row in csv.reader(f) if len(row) > 2), [])
+                file_fmt = "log" if first[1:2] and first[1] in LOG_LEVELS else "iperf"
+                f.seek(0)
+            samples.extend(read_stat_log(f) if file_fmt == "log" else read_iperf_csv(f))
+            measured.add(file_fmt == "log")
+    if len(measured) > 1:
+        raise ValueError("Stat logs and iperf outputs cannot be mixed in one trace.")
+    return Trace.from_samples(samples, measured.pop())
+
+
+@dataclass
+class SimulationResult:
+    flows: List[FlowId]
+    round_times: np.ndarray  # Seconds since the start of the trace
+    limits: np.ndarray  # bits/s after each round, shape (len(round_times), len(flows))
+    queue_updates: int  # Number of rounds sending queue settings to the switches
+    queue_changes: int  # Number of queue limit changes
+    sla_violations: int  # Number of times a flow started to be limited below its load within its initial limit
+    sla_violation_seconds: float  # Total time of the SLA violations over the flows
+
+    def summary(self) -> Dict[str, float]:
+        return {"rounds": len(self.round_times), "queue_updates": self.queue_updates,
+                "queue_changes": self.queue_changes, "sla_violations": self.sla_violations,
+                "sla_violation_seconds": self.sla_violation_seconds}
+
+    def write_timeline(self, f: TextIO) -> None:
+        """
+        Write the limits after every round as CSV: time, then one column per flow in Mb/s.
+        """
+        writer = csv.writer(f)
+        writer.writerow(["time (s)"] + ["%s:%d (Mb/s)" % (flow.ipv4_dst, flow.udp_dst) for flow in self.flows])
+        for timestamp, limits in zip(self.round_times.tolist(), (self.limits / 10 ** 6).tolist()):
+            writer.writerow([timestamp] + limits)
+
+
+class Simulator:
+    TIME_STEP = 5  # The number of seconds between two adaptation rounds, as `AdaptingMonitor13.TIME_STEP`
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "time_step" in ch.config:
+            cls.TIME_STEP = int(ch.config["time_step"])
+            logger.info("time_step set to {}".format(cls.TIME_STEP))
+        else:
+            logger.debug("time_step not set")
+
+    def __init__(self, init_limits: Dict[FlowId, int]):
+        """
+        :param init_limits: The initial limit of the flows in bits/s, as in the flows of the config file.
+        """
+        self.init_limits = init_limits
+
+    def run(self, trace: Trace) -> SimulationResult:
+        """
+        Replay a trace through the adaptation of a fresh `QoSManager`.
+
+        The rates of the hosts of the trace are summed into the flows of the config containing them, e.g. prefix
+        slices. The flows of the config without a rate in the trace send nothing, the rest of the trace is ignored.
+        Queue settings are considered applied as soon as they are calculated.
+        """
+        flows = list(self.init_limits)
+        columns = {flow: i for i, flow in enumerate(flows)}
+        classifier = SliceClassifier(flows)
+        rates = np.zeros((len(trace.times), len(flows)))
+        for i, flow in enumerate(trace.flows):
+            if flow not in columns and flow.network()[1] == 32 and flow.udp_dst_max is None:
+                flow = classifier.classify(flow.ipv4_dst, flow.udp_dst)
+            if flow in columns:
+                rates[:, columns[flow]] += trace.rates[:, i]
+        durations = trace.durations()
+
+        manager = QoSManager(self.init_limits)
+        rows = manager.limit_rows(flows)
+        limits, init_limits = manager.get_limits_arrays()
+        round_times = np.arange(0, trace.times[-1] + durations[-1], self.__class__.TIME_STEP, dtype=np.float64)
+        timeline = np.empty((len(round_times), len(flows)), dtype=np.int64)
+
+        if trace.measured:
+            samples = np.searchsorted(trace.times, round_times, side="right") - 1
+        else:
+            # Byte counters of the flows at the start of each sample, and at the rounds
+            counters = np.vstack((np.zeros(len(flows)), np.cumsum(rates * durations[:, None] / 8, axis=0)))
+            edges = np.append(trace.times, trace.times[-1] + durations[-1])
+            round_counters = np.column_stack([np.interp(round_times, edges, counters[:, i])
+                                              for i in range(len(flows))])
+            stats = new_flow_stat_manager()
+
+        queue_updates = queue_changes = 0
+        for k, timestamp in enumerate(round_times.tolist()):
+            if trace.measured:
+                speeds = rates[samples[k]].tolist()
+            else:
+                for flow, counter in zip(flows, round_counters[k].tolist()):
+                    stats.put(flow, int(counter), timestamp)
+                speeds = stats.export_avg_speeds_bps_array().tolist()
+            changed = manager._pre_adapt(dict(zip(flows, speeds)))
+            if changed:
+                queue_updates += 1
+                queue_changes += len(changed)
+            timeline[k] = limits[rows]
+
+        # The limit in force during each sample of the trace. Before the first round the initial limits apply.
+        in_force = np.vstack((init_limits[rows], timeline))[np.searchsorted(round_times, trace.times, side="right")]
+        violated = np.minimum(rates, init_limits[rows]) > in_force
+        onsets = violated & ~np.vstack((np.zeros((1, len(flows)), dtype=bool), violated[:-1]))
+        return SimulationResult(flows, round_times, timeline, queue_updates, queue_changes, int(onsets.sum()),
+                                float((violated * durations[:, None]).sum()))
+
+
+# Class values set by `configure`, restored before every simulation of a sweep so combinations do not leak
+_DEFAULTS = [(QoSManager, "LIMIT_STEP", QoSManager.LIMIT_STEP), (FlowStat, "WINDOW_SIZE", FlowStat.WINDOW_SIZE),
+             (FlowStat, "ESTIMATOR", FlowStat.ESTIMATOR), (FlowStat, "TIME_CONSTANT", FlowStat.TIME_CONSTANT),
+             (Simulator, "TIME_STEP", Simulator.TIME_STEP)]
+
+
+def configure(ch: config_handler.ConfigHandler) -> None:
+    """
+    Configure the classes taking part in the simulation, starting from their defaults.
+    """
+    for cls, attr, value in _DEFAULTS:
+        setattr(cls, attr, value)
+    QoSManager.configure(ch)
+    FlowStat.configure(ch)
+    Simulator.configure(ch)
+
+
+def simulate(config_path: str, trace: Trace, overrides: Dict[str, object] = None) -> SimulationResult:
+    """
+    Replay a trace with the values of a config file.
+
+    :param overrides: Config values replacing the ones of the file.
+    """
+    ch = config_handler.ConfigHandler(config_path)
+    ch.config.update(overrides or {})
+    configure(ch)
+    init_limits = {FlowId.from_dict(flow): int(flow["base_ratelimit"]) for flow in ch.config["flows"]}
+    return Simulator(init_limits).run(trace)
+
+
+_worker_trace: Optional[Trace] = None
+
+
+def _init_worker(trace: Trace) -> None:
+    global _worker_trace
+    _worker_trace = trace
+
+
+def _simulate_summary(config_path: str, overrides: Dict[str, object]) -> Dict[str, float]:
+    return simulate(config_path, _worker_trace, overrides).summary()
+
+
+def sweep(config_path: str, trace: Trace, grid: Dict[str, List[object]],
+          workers: int = None) -> List[Tuple[Dict[str, object], Dict[str, float]]]:
+    """
+    Simulate every combination of the parameter values in a process pool.
+
+    :param grid: The values to try per config key.
+    :param workers: The number of processes. Defaults to the number of CPUs.
+    :return: The overrides and the summary of every combination, in the order of the grid.
+    """
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(trace,)) as executor:
+        summaries = executor.map(_simulate_summary, itertools.repeat(config_path), combinations,
+                                 chunksize=max(1, len(combinations) // (4 * workers)))
+        return list(zip(combinations, summaries))
+
+
+def _parse_grid(settings: List[str]) -> Dict[str, List[object]]:
+    grid = {}
+    for setting in settings:
+        key, sep, values = setting.partition("=")
+        if not sep or not values:
+            raise ValueError("Invalid setting, expected key=value[,value...]: %s" % setting)
+        grid[key] = [yaml.safe_load(value) for value in values.split(",")]
+    return grid
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("config", help="The config file of the controller")
+    parser.add_argument("traces", nargs="+", help="Stat logs or iperf client outputs")
+    parser.add_argument("--format", choices=("auto", "log", "iperf"), default="auto", help="The format of the traces")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE[,VALUE...]",
+                        help="Override a config value. With several values every combination is simulated.")
+    parser.add_argument("--workers", type=int, help="Processes of a sweep. Defaults to the number of CPUs")
+    parser.add_argument("--timeline", help="Write the limit timeline of a single simulation as CSV to this file")
+    parser.add_argument("--output", help="Write the results of a sweep as CSV to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    trace = read_trace(args.traces, args.format)
+    grid = _parse_grid(args.set)
+    if all(len(values) == 1 for values in grid.values()):
+        result = simulate(args.config, trace, {key: values[0] for key, values in grid.items()})
+        for key, value in result.summary().items():
+            print("%-22s %s" % (key, value))
+        if args.timeline:
+            with open(args.timeline, "w", newline="") as f:
+                result.write_timeline(f)
+        return
+
+    results = sweep(args.config, trace, grid, args.workers)
+    # Best combinations first: fewest SLA violations, then fewest queue updates
+    results.sort(key=lambda r: (r[1]["sla_violation_seconds"], r[1]["queue_updates"]))
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(list(grid) + list(results[0][1]))
+        for overrides, summary in results:
+            writer.writerow(list(overrides.values()) + list(summary.values()))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
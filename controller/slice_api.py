@@ -0,0 +1,93 @@
+import json
+import logging
+
+from ryu.app.wsgi import ControllerBase, Response, route
+
+from flow import FlowId
+
+SLICES_PATH = "/adaptive/slices"
+
+
+def _response(status: int, body) -> Response:
+    return Response(status=status, content_type="application/json", body=json.dumps(body).encode("utf-8"))
+
+
+class SliceController(ControllerBase):
+    """
+    REST API to manage the slices of `AdaptingMonitor13` at runtime, served by the WSGI application of Ryu next to
+    rest_qos.
+
+    The slices are identified by the same fields as in the config file, in a JSON body:
+
+    - GET    /adaptive/slices: list the slices with their queue and their initial and current limit
+    - POST   /adaptive/slices {"ipv4_dst": ..., "udp_dst": ..., "base_ratelimit": ...}: add a slice
+    - PUT    /adaptive/slices {"ipv4_dst": ..., "udp_dst": ..., "base_ratelimit": ...}: change the limit of a slice
+    - DELETE /adaptive/slices {"ipv4_dst": ..., "udp_dst": ...}: remove a slice
+
+    The changes are not written back to the config file.
+    """
+
+    def __init__(self, req, link, data, **config):
+        super(SliceController, self).__init__(req, link, data, **config)
+        self.monitor = data["monitor"]
+
+        self.__logger = logging.getLogger("slice_api")
+
+    @staticmethod
+    def _parse(req, with_limit: bool):
+        """
+        :return: The FlowId and the base_ratelimit of the slice in the body of the request, the latter if `with_limit`.
+        :raises ValueError: If the body is not a valid slice.
+        """
+        try:
+            body = json.loads(req.body)
+            flow = FlowId.from_dict(body)
+            limit = int(body["base_ratelimit"]) if with_limit else None
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError("Invalid slice: {}".format(e)) from e
+        if with_limit and limit <= 0:
+            raise ValueError("Invalid slice: base_ratelimit must be positive")
+        return flow, limit
+
+    def _update(self, **changes) -> Response:
+        try:
+            failures = self.monitor.update_slices(**changes)
+        except KeyError as e:
+            return _response(404, {"error": e.args[0]})
+        except ValueError as e:
+            return _response(409, {"error": str(e)})
+        self.__logger.info("Slices updated: %s", changes)
+        return _response(200, {"failures": {"%016x" % dpid: reason for dpid, reason in failures.items()}})
+
+    @route("slices", SLICES_PATH, methods=["GET"])
+    def list_slices(self, req, **_kwargs):
+        qos_manager = self.monitor.qos_manager
+        slices = []
+        for flow, entry in qos_manager.flows_limits.items():
+            slices.append(dict(flow.to_dict(), base_ratelimit=qos_manager.get_initial_limit(flow),
+                               ratelimit=entry.limit, queue_id=entry.queue_id))
+        return _response(200, slices)
+
+    @route("slices", SLICES_PATH, methods=["POST"])
+    def add_slice(self, req, **_kwargs):
+        try:
+            flow, limit = self._parse(req, True)
+        except ValueError as e:
+            return _response(400, {"error": str(e)})
+        return self._update(added={flow: limit})
+
+    @route("slices", SLICES_PATH, methods=["PUT"])
+    def resize_slice(self, req, **_kwargs):
+        try:
+            flow, limit = self._parse(req, True)
+        except ValueError as e:
+            return _response(400, {"error": str(e)})
+        return self._update(resized={flow: limit})
+
+    @route("slices", SLICES_PATH, methods=["DELETE"])
+    def remove_slice(self, req, **_kwargs):
+        try:
+            flow, _ = self._parse(req, False)
+        except ValueError as e:
+            return _response(400, {"error": str(e)})
+        return self._update(removed=[flow])
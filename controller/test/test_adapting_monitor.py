@@ -0,0 +1,344 @@
+import json
+import pathlib
+import struct
+import time
+
+import pytest
+
+try:
+    import ryu.app.wsgi  # noqa: F401
+except ImportError:  # Not importable with the eventlet releases of the newest Pythons
+    pytest.skip("ryu.app.wsgi is not importable", allow_module_level=True)
+
+import yaml
+from ryu.app.wsgi import WSGIApplication
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from webob import Request
+
+import config_handler
+import metrics
+from adapting_monitor_13 import CONFIGURED_CLASSES, AdaptingMonitor13
+from datapath_standin import DatapathStandIn, SyntheticTraffic
+from flow import FlowId
+from rest_standin import RestQoSStandIn
+from rule_installer import QOS_TABLE_ID, RULE_COOKIE, RULE_COOKIE_MASK, RuleInstaller
+from slice_api import SLICES_PATH, SliceController
+from topology import Topology
+
+FLOWS = [FlowId("10.0.0.11", 5001), FlowId("10.0.0.12", 5002), FlowId("10.0.0.13", 5003)]
+
+
+def write_config(path, flows, controller_baseurl, **settings):
+    config = {"flows": flows, "controller_baseurl": controller_baseurl, "ovsdb_addr": "tcp:127.0.0.1:6640",
+              "stat_log_format": "csv", "metrics_addr": "", "config_reload_interval": 0}
+    config.update(settings)
+    path.write_text(yaml.safe_dump(config))
+
+
+def flow_defs(limits):
+    return [dict(flow.to_dict(), base_ratelimit=limit) for flow, limit in limits.items()]
+
+
+@pytest.fixture
+def rest():
+    standin = RestQoSStandIn().start()
+    yield standin
+    standin.stop()
+
+
+@pytest.fixture
+def monitor_factory(tmp_path, rest, monkeypatch):
+    """
+    Create `AdaptingMonitor13` applications outside of ryu-manager, restoring the class settings afterwards.
+    """
+    settings = config_handler.class_settings(CONFIGURED_CLASSES + (AdaptingMonitor13,))
+    apps = []
+
+    def create(limits, **config):
+        config_path = tmp_path / "config.yml"
+        write_config(config_path, flow_defs(limits), rest.url, **config)
+        monkeypatch.setenv("CONFIG_FILE", str(config_path))
+        AdaptingMonitor13.FLOWS_LIMITS = {}
+        app = AdaptingMonitor13()
+        app_manager.register_app(app)
+        apps.append(app)
+        return app
+
+    yield create
+    for app in apps:
+        app_manager.unregister_app(app)
+    config_handler.restore_settings(settings)
+
+
+def connect(app, dpid, ports=2, traffic=None):
+    """
+    Connect a stand-in datapath, whose replies are handled at once, and wait for its configuration.
+    """
+    def deliver(buf):
+        ev = ofp_event.ofp_msg_to_ev(dp.parse(buf))
+        for handler in app.get_handlers(ev, MAIN_DISPATCHER):
+            handler(ev)
+
+    dp = DatapathStandIn(dpid, ports, deliver, traffic)
+    ev = ofp_event.EventOFPStateChange(dp)
+    ev.state = MAIN_DISPATCHER
+    app._state_change_handler(ev)
+    app.dispatcher.wait_all()
+    return dp
+
+
+def reload(app, rest, limits, flows=None, **settings):
+    config_path = pathlib.Path(app.config_file)
+    write_config(config_path, flow_defs(limits) if flows is None else flows, rest.url, **settings)
+    return app.reload_config(str(config_path))
+
+
+def rule_flows(dp):
+    return {flow for _, _, flow in dp.rules}
+
+
+def test_reload_config_keeps_the_slices_of_the_api(monitor_factory, rest):
+    limits = {FLOWS[0]: 10 ** 6, FLOWS[1]: 2 * 10 ** 6}
+    app = monitor_factory(limits)
+    dp = connect(app, 1)
+    assert app.update_slices(added={FLOWS[2]: 3 * 10 ** 6}) == {}
+
+    assert reload(app, rest, {FLOWS[0]: 5 * 10 ** 6, FLOWS[1]: 2 * 10 ** 6})
+    assert app.qos_manager.get_initial_limit(FLOWS[0]) == 5 * 10 ** 6
+    assert app.qos_manager.get_initial_limit(FLOWS[2]) == 3 * 10 ** 6
+    assert rule_flows(dp) == set(FLOWS)
+
+    assert reload(app, rest, {FLOWS[0]: 5 * 10 ** 6})
+    assert set(app.qos_manager.flows_limits) == {FLOWS[0], FLOWS[2]}
+    assert rule_flows(dp) == {FLOWS[0], FLOWS[2]}
+
+
+def test_reload_config_keeps_a_slice_removed_through_the_api(monitor_factory, rest):
+    limits = {FLOWS[0]: 10 ** 6, FLOWS[1]: 2 * 10 ** 6}
+    app = monitor_factory(limits)
+    dp = connect(app, 1)
+    assert app.update_slices(removed=[FLOWS[1]]) == {}
+
+    assert reload(app, rest, limits, time_step=3)
+    assert AdaptingMonitor13.TIME_STEP == 3
+    assert set(app.qos_manager.flows_limits) == {FLOWS[0]}
+    assert rule_flows(dp) == {FLOWS[0]}
+
+    # Changed in the file, so it is added again
+    assert reload(app, rest, {FLOWS[0]: 10 ** 6, FLOWS[1]: 4 * 10 ** 6})
+    assert app.qos_manager.get_initial_limit(FLOWS[1]) == 4 * 10 ** 6
+    assert rule_flows(dp) == {FLOWS[0], FLOWS[1]}
+
+
+def test_reload_config_rejects_an_invalid_flow_entry(monitor_factory, rest):
+    limits = {FLOWS[0]: 10 ** 6, FLOWS[1]: 2 * 10 ** 6}
+    app = monitor_factory(limits, time_step=5)
+    dp = connect(app, 1)
+
+    flows = flow_defs({FLOWS[0]: 10 ** 6}) + [{"ipv4_dst": "10.0.0.12", "base_ratelimit": 10 ** 6}]
+    assert not reload(app, rest, None, flows=flows, time_step=3)
+    assert AdaptingMonitor13.TIME_STEP == 5
+    assert set(app.qos_manager.flows_limits) == set(limits)
+    assert rule_flows(dp) == set(limits)
+
+    # Overlapping a slice added through the API
+    assert app.update_slices(added={FLOWS[2]: 3 * 10 ** 6}) == {}
+    overlapping = FlowId("10.0.0.0/24", 5003)
+    assert not reload(app, rest, {**limits, overlapping: 10 ** 6})
+    assert set(app.qos_manager.flows_limits) == set(limits) | {FLOWS[2]}
+
+
+def test_egress_placement_keeps_every_port_until_the_hosts_are_known(monitor_factory, rest):
+    app = monitor_factory({FLOWS[0]: 10 ** 6, FLOWS[1]: 2 * 10 ** 6}, queue_placement="egress")
+    connect(app, 1, ports=3)
+    assert app.qos_manager.placed_ports(1) == ["s1-eth1", "s1-eth2", "s1-eth3"]
+    assert list(rest.queues) == [("0000000000000001", "all")]
+
+    topology = Topology()
+    topology.add_host("10.0.0.11", 1, "s1-eth1")
+    app.topology = topology
+    assert app._place_queues() == []  # The host of the other slice is still unknown
+    topology.add_host("10.0.0.12", 1, "s1-eth2")
+    assert app._place_queues() == [1]
+    assert app.qos_manager.placed_ports(1) == ["s1-eth1", "s1-eth2"]
+
+    # A second datapath, until the links are known
+    connect(app, 2, ports=2)
+    assert app.qos_manager.placed_ports(1) == ["s1-eth1", "s1-eth2", "s1-eth3"]
+    assert app.qos_manager.placed_ports(2) == ["s2-eth1", "s2-eth2"]
+    topology.add_link(1, "s1-eth3", 2)
+    topology.add_link(2, "s2-eth1", 1)
+    assert sorted(app._place_queues()) == [1, 2]
+    assert app.qos_manager.placed_ports(1) == ["s1-eth1", "s1-eth2"]
+    assert app.qos_manager.placed_ports(2) == ["s2-eth1"]
+
+
+def test_update_slices_changes_only_the_affected_slices(monitor_factory, rest):
+    limits = {flow: (i + 1) * 10 ** 6 for i, flow in enumerate(FLOWS)}
+    app = monitor_factory(limits)
+    traffic = SyntheticTraffic({flow: 10 ** 5 for flow in FLOWS})
+    dp = connect(app, 1, traffic=traffic)
+    for _ in range(3):
+        app._request_stats(dp)  # The replies are handled at once
+        time.sleep(0.01)
+    fsm = app.stats[1]
+    speeds = {flow: fsm.get_avg_speed(flow) for flow in FLOWS}
+    assert all(speed > 0 for speed in speeds.values())
+    queue_ids = app.qos_manager.get_queue_ids()
+    rules = dict(dp.rules)
+    mods = dp.received["OFPFlowMod"]
+
+    new = FlowId("10.0.0.14", 5004)
+    assert app.update_slices(added={new: 4 * 10 ** 6}, removed=[FLOWS[0]], resized={FLOWS[1]: 5 * 10 ** 6}) == {}
+
+    # The new slice takes the queue of the removed one, the others keep theirs
+    assert app.qos_manager.get_queue_ids() == {FLOWS[1]: queue_ids[FLOWS[1]], FLOWS[2]: queue_ids[FLOWS[2]],
+                                               new: queue_ids[FLOWS[0]]}
+    assert rest.queues[("0000000000000001", "all")][queue_ids[FLOWS[0]]] == "4000000"
+    assert rest.queues[("0000000000000001", "all")][queue_ids[FLOWS[1]]] == "5000000"
+    # Only the rule of the removed slice is deleted, strictly, and only the one of the new slice is installed
+    assert dp.received["OFPFlowMod"] == mods + 2
+    assert rule_flows(dp) == {FLOWS[1], FLOWS[2], new}
+    for key, rule in dp.rules.items():
+        if key[2] != new:
+            assert rule is rules[key]
+    # The other slices keep their statistics
+    assert FLOWS[0] not in fsm and new not in fsm
+    assert {flow: fsm.get_avg_speed(flow) for flow in FLOWS[1:]} == {flow: speeds[flow] for flow in FLOWS[1:]}
+    app._request_stats(dp)
+    assert new in fsm and fsm.get_avg_speed(FLOWS[2]) > 0
+
+
+def test_update_slices_rejects_invalid_changes(monitor_factory):
+    limits = {flow: 10 ** 6 for flow in FLOWS}
+    app = monitor_factory(limits)
+    dp = connect(app, 1)
+    with pytest.raises(KeyError):
+        app.update_slices(removed=[FlowId("10.0.0.14", 5004)])
+    with pytest.raises(KeyError):
+        app.update_slices(resized={FlowId("10.0.0.14", 5004): 10 ** 6})
+    with pytest.raises(ValueError):
+        app.update_slices(added={FLOWS[0]: 10 ** 6})
+    with pytest.raises(ValueError):
+        app.update_slices(added={FlowId("10.0.0.0/24", 5001): 10 ** 6}, removed=[FLOWS[1]])
+    assert set(app.qos_manager.flows_limits) == set(FLOWS)
+    assert rule_flows(dp) == set(FLOWS)
+
+
+def test_slice_api(monitor_factory):
+    app = monitor_factory({FLOWS[0]: 10 ** 6})
+    dp = connect(app, 1)
+    wsgi = WSGIApplication()
+    wsgi.register(SliceController, {"monitor": app})
+
+    def request(method, body=None):
+        req = Request.blank(SLICES_PATH, method=method)
+        if body is not None:
+            req.body = json.dumps(body).encode()
+        res = req.get_response(wsgi)
+        return res.status_code, json.loads(res.body)
+
+    new = {"ipv4_dst": "10.0.1.0/24", "udp_dst": "6000-6001"}
+    assert request("POST", dict(new, base_ratelimit=2 * 10 ** 6)) == (200, {"failures": {}})
+    assert rule_flows(dp) == {FLOWS[0], FlowId("10.0.1.0/24", 6000), FlowId("10.0.1.0/24", 6001)}  # A rule per port
+    assert request("PUT", dict(new, base_ratelimit=3 * 10 ** 6)) == (200, {"failures": {}})
+    status, slices = request("GET")
+    assert status == 200
+    assert dict(new, udp_dst=6000, udp_dst_max=6001, base_ratelimit=3 * 10 ** 6, ratelimit=3 * 10 ** 6,
+                queue_id=2) in slices
+
+    assert request("POST", {"ipv4_dst": "10.0.0.14"})[0] == 400
+    assert request("POST", dict(new, base_ratelimit=0))[0] == 400
+    assert request("DELETE", {"ipv4_dst": "10.0.0.14", "udp_dst": 5004})[0] == 404
+    assert request("PUT", {"ipv4_dst": "10.0.0.14", "udp_dst": 5004, "base_ratelimit": 10 ** 6})[0] == 404
+    assert request("POST", dict(new, base_ratelimit=10 ** 6))[0] == 409
+    assert request("POST", {"ipv4_dst": "10.0.1.7", "udp_dst": 6001, "base_ratelimit": 10 ** 6})[0] == 409
+
+    assert request("DELETE", new) == (200, {"failures": {}})
+    assert rule_flows(dp) == {FLOWS[0]}
+    assert len(request("GET")[1]) == 1
+
+
+def queue_stats_reply(dp, xid, stats, more=False):
+    """
+    Encode a part of a queue stats reply of `dp`, and parse it into its event.
+
+    :param stats: (port_no, queue_id, tx_bytes, tx_errors) of every queue in the part.
+    """
+    ofproto = dp.ofproto
+    flags = ofproto.OFPMPF_REPLY_MORE if more else 0
+    body = struct.pack(ofproto.OFP_MULTIPART_REPLY_PACK_STR, ofproto.OFPMP_QUEUE, flags)
+    for port_no, queue_id, tx_bytes, tx_errors in stats:
+        body += struct.pack(ofproto.OFP_QUEUE_STATS_PACK_STR, port_no, queue_id, tx_bytes, 0, tx_errors, 0, 0)
+    header = struct.pack(ofproto.OFP_HEADER_PACK_STR, ofproto.OFP_VERSION, ofproto.OFPT_MULTIPART_REPLY,
+                         ofproto.OFP_HEADER_SIZE + len(body), xid)
+    return ofp_event.ofp_msg_to_ev(dp.parse(header + body))
+
+
+def test_queue_stats_reply_handler(monitor_factory):
+    app = monitor_factory({FLOWS[0]: 10 ** 6, FLOWS[1]: 2 * 10 ** 6}, measurement="queue")
+    dp = connect(app, 1)
+    q1, q2 = (app.qos_manager.get_queue_ids()[flow] for flow in FLOWS[:2])
+
+    def reply(xid, timestamp, *parts):
+        for i, stats in enumerate(parts):
+            ev = queue_stats_reply(dp, xid, stats, more=i < len(parts) - 1)
+            ev.queued_at = timestamp
+            app._queue_stats_reply_handler(ev)
+
+    # The queues of a slice are spread over the ports and the parts, queue 0 is not a slice
+    reply(1, 100.0, [(1, q1, 1000, 0), (1, q2, 500, 0)], [(2, q1, 1000, 0), (2, 0, 9999, 99)])
+    reply(2, 101.0, [(1, q1, 3000, 4), (1, q2, 1500, 0)], [(2, q1, 3000, 6), (2, 0, 99999, 999)])
+    stats, drops = app.stats[1], app.drop_stats[1]
+    assert stats.get_avg_speed(FLOWS[0]) == 4000 and stats.get_avg_speed(FLOWS[1]) == 1000
+    assert drops.get_avg_speed(FLOWS[0]) == 10 and drops.get_avg_speed(FLOWS[1]) == 0
+    assert app.max_speeds.get(FLOWS[0]) == 32000
+    app._collect_metrics()
+    assert metrics.QUEUE_DROPS.value == 10
+
+    # A port disappears from the sum: the counters of the slice restart
+    reply(3, 102.0, [(1, q1, 3500, 5), (1, q2, 2500, 0)])
+    assert stats.get_avg_speed(FLOWS[0]) == 0 and stats.get_avg_speed(FLOWS[1]) == 1000
+    reply(4, 103.0, [(1, q1, 4500, 7), (1, q2, 3500, 0)])
+    assert stats.get_avg_speed(FLOWS[0]) == 1000 and drops.get_avg_speed(FLOWS[0]) == 2
+    assert len(app.queue_replies[1]) == 0
+
+
+@pytest.mark.parametrize("rule_installation", ["openflow", "rest"])
+def test_request_stats_is_scoped_to_the_classification_rules(monitor_factory, rule_installation):
+    app = monitor_factory({flow: 10 ** 6 for flow in FLOWS[:2]}, rule_installation=rule_installation)
+    dp = connect(app, 1, traffic=SyntheticTraffic(default_rate=1000.0))
+    installer = RuleInstaller()
+    if rule_installation == "rest":  # Rules of rest_qos carry its rule id as cookie
+        for rule_id, flow in enumerate(FLOWS[:2], start=1):
+            mod = installer.flow_mod(dp, flow, rule_id)
+            mod.cookie = rule_id
+            dp.add_rule(mod)
+    # An entry of the MAC learning table, and a rule of another application in the table of the rules
+    learnt = installer.flow_mod(dp, FLOWS[2], 0)
+    learnt.table_id, learnt.cookie = QOS_TABLE_ID + 1, 0
+    dp.add_rule(learnt)
+    other = installer.flow_mod(dp, FlowId("10.0.0.14", 5004), 0)
+    other.cookie = 0x1234 << 16
+    dp.add_rule(other)
+
+    requests, replies = [], []
+    send_msg, deliver = dp.send_msg, dp.deliver
+    dp.send_msg = lambda msg, close_socket=False: requests.append(msg) or send_msg(msg)
+    dp.deliver = lambda buf: replies.append(dp.parse(buf)) or deliver(buf)
+    app._request_stats(dp)
+
+    req, = requests
+    assert req.table_id == QOS_TABLE_ID
+    if rule_installation == "openflow":
+        assert (req.cookie, req.cookie_mask) == (RULE_COOKIE, RULE_COOKIE_MASK)
+        expected = set(FLOWS[:2])
+    else:
+        assert req.cookie_mask == 0
+        expected = set(FLOWS[:2]) | {FlowId("10.0.0.14", 5004)}
+    entries = [stat for reply in replies for stat in reply.body]
+    assert all(stat.table_id == QOS_TABLE_ID for stat in entries)
+    assert {FlowId(stat.match["ipv4_dst"], stat.match["udp_dst"]) for stat in entries} == expected
+    assert set(app.stats[1].flows) == set(FLOWS[:2])
@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pytest
+
+from benchmark.allocation import pre_adapt_scalar
+from flow import FlowId
+from qos_manager import QoSManager
+
+
+def random_flows(rnd: random.Random, count: int):
+    return {FlowId("10.0.{}.{}".format(i // 250, i % 250 + 1), 5000 + i): rnd.choice([1, 5, 15, 25, 40]) * 10 ** 6
+            for i in range(count)}
+
+
+def random_load(rnd: random.Random, limit: int) -> float:
+    choice = rnd.random()
+    if choice < 0.2:
+        return 0.0
+    elif choice < 0.4:
+        return float(limit)  # Exactly at the limit
+    elif choice < 0.6:
+        return limit * rnd.choice([0.1, 0.25, 0.5, 0.7, 1.2])  # On the edges of the 10% steps
+    else:
+        return rnd.uniform(0, 1.5 * limit)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_vectorized_pre_adapt_matches_scalar(seed):
+    rnd = random.Random(seed)
+    flows = random_flows(rnd, rnd.randint(1, 60))
+    vectorized = QoSManager(flows)
+    scalar = QoSManager(flows)
+    original_limit_step = QoSManager.LIMIT_STEP
+    QoSManager.LIMIT_STEP = rnd.choice([0, 500000, 2 * 10 ** 6, 2500000])
+    try:
+        for _ in range(30):
+            # Not every flow is measured in every round
+            measured = rnd.sample(list(flows), rnd.randint(1, len(flows)))
+            flowstats = {flow: random_load(rnd, flows[flow]) for flow in measured}
+            changed = vectorized._pre_adapt(flowstats)
+            before = dict(scalar.flows_limits)
+            modified = pre_adapt_scalar(scalar, flowstats)
+
+            assert vectorized.flows_limits == scalar.flows_limits
+            assert bool(changed) == modified
+            # Every queue whose limit differs is reported, and only measured flows can be reported
+            assert {entry.queue_id for flow, entry in scalar.flows_limits.items() if entry != before[flow]} <= changed
+            assert changed <= {scalar.flows_limits[flow].queue_id for flow in measured}
+    finally:
+        QoSManager.LIMIT_STEP = original_limit_step
+
+
+def test_vectorized_pre_adapt_unmanaged_flow():
+    manager = QoSManager({FlowId("10.0.0.1", 5001): 5 * 10 ** 6})
+    with pytest.raises(KeyError):
+        manager._pre_adapt({FlowId("10.0.0.2", 5001): 10.0})
+
+
+def test_engine_add_and_remove_keep_the_other_limits():
+    flows = random_flows(random.Random(1), 5)
+    manager = QoSManager(flows)
+    manager._pre_adapt({flow: 0.0 for flow in flows})
+    engine = manager._engine
+    before = {flow: int(engine.limits[engine.index[flow]]) for flow in flows}
+    removed, kept = list(flows)[1], list(flows)[2:]
+    engine.remove(removed)
+    engine.add(FlowId("10.9.0.1", 5001), 10 ** 7, 9)
+    assert engine.flows == [list(flows)[0]] + kept + [FlowId("10.9.0.1", 5001)]
+    assert all(engine.limits[engine.index[flow]] == before[flow] for flow in kept)
+    changed = engine.adapt_rows(engine.rows([FlowId("10.9.0.1", 5001)]), np.array([0.0]), 0)
+    assert engine.queue_ids[changed].tolist() == [9]
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from classifier import SliceClassifier, _address
+from flow import FlowId
+
+slices = [FlowId("10.1.0.0/16", 5000, 5099), FlowId("10.1.2.0/24", 6000), FlowId("10.0.0.11", 5001),
+          FlowId("0.0.0.0/0", 7000, 7001)]
+
+
+def test_classify_hosts():
+    classifier = SliceClassifier(slices)
+    assert classifier.classify("10.1.200.3", 5099) == slices[0]
+    assert classifier.classify("10.1.2.3", 6000) == slices[1]
+    assert classifier.classify("10.1.2.3", 5000) == slices[0]
+    assert classifier.classify("10.0.0.11", 5001) == slices[2]
+    assert classifier.classify("192.0.2.1", 7001) == slices[3]
+    assert classifier.classify("10.0.0.12", 5001) is None
+    assert classifier.classify("10.1.2.3", 5100) is None
+
+
+def test_classify_masked_matches():
+    classifier = SliceClassifier(slices)
+    assert classifier.classify(("10.1.0.0", "255.255.0.0"), 5050) == slices[0]
+    assert classifier.classify(("10.1.2.0", "255.255.255.0"), 6000) == slices[1]
+    # A rule of a shorter prefix than the slice is not in the slice
+    assert classifier.classify(("10.0.0.0", "255.0.0.0"), 5001) is None
+
+
+def test_overlapping_slices_are_rejected():
+    with pytest.raises(ValueError):
+        SliceClassifier([FlowId("10.1.0.0/16", 5000, 5099), FlowId("10.1.2.0/24", 5050)])
+    with pytest.raises(ValueError):
+        SliceClassifier([FlowId("10.1.2.3", 5050), FlowId("10.1.0.0/16", 5000, 5099)])
+    with pytest.raises(ValueError):
+        SliceClassifier([FlowId("10.1.0.0/16", 5000, 5099), FlowId("10.1.0.0/16", 5099, 5100)])
+    SliceClassifier([FlowId("10.1.0.0/16", 5000, 5099), FlowId("10.1.0.0/16", 5100, 5199)])
+
+
+def test_lookup_matches_linear_scan():
+    rng = random.Random(2)
+    candidates = [FlowId("10.%d.%d.0/24" % (rng.randrange(4), rng.randrange(4)), port, port + rng.randrange(3))
+                  for port in range(5000, 5100, 5)]
+    classifier = SliceClassifier(candidates)
+
+    def linear(address, port):
+        for flow in candidates:
+            prefix, prefixlen = flow.network()
+            mask = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+            if address & mask == _address(prefix) and port in flow.ports():
+                return flow
+        return None
+
+    for _ in range(1000):
+        address = _address("10.%d.%d.%d" % (rng.randrange(5), rng.randrange(5), rng.randrange(256)))
+        port = rng.randrange(4995, 5110)
+        assert classifier.lookup(address, port) == linear(address, port)
@@ -3,7 +3,7 @@ from copy import deepcopy
 import pytest
 from yaml.parser import ParserError
 
-from config_handler import ConfigError, ConfigHandler
+from config_handler import ConfigError, ConfigHandler, ConfigWatcher, class_settings, restore_settings
 
 baseline = {
     'flows': [{'ipv4_dst': '10.0.0.1', 'udp_dst': 5009, 'base_ratelimit': 5000000},
@@ -48,3 +48,40 @@ def test_config_handler_empty_config():
 def test_config_handler_yaml_syntax_error():
     with pytest.raises(ParserError):
         ConfigHandler("configs/syntax_error.yml")
+
+
+def test_config_watcher_reports_a_change_once_it_is_stable(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("time_step: 2\n")
+    watcher = ConfigWatcher(str(path))
+    assert not watcher.changed()
+    path.write_text("time_step: 30\n")
+    assert not watcher.changed()  # Maybe still being written
+    assert watcher.changed()
+    assert not watcher.changed()
+    # Replaced by another file, and missing meanwhile
+    path.unlink()
+    assert not watcher.changed() and not watcher.changed()
+    (tmp_path / "new.yml").write_text("time_step: 4\n")
+    (tmp_path / "new.yml").rename(path)
+    assert not watcher.changed()
+    assert watcher.changed()
+
+
+class Settings:
+    LIMIT = 5
+    FLOWS = {"a": 1}
+    _PRIVATE = 1
+
+    @classmethod
+    def configure(cls, ch):
+        pass
+
+
+def test_class_settings_restore():
+    settings = class_settings([Settings])
+    assert settings == {(Settings, "LIMIT"): 5, (Settings, "FLOWS"): {"a": 1}}
+    Settings.LIMIT = 6
+    Settings.FLOWS["b"] = 2
+    restore_settings(settings)
+    assert Settings.LIMIT == 5 and Settings.FLOWS == {"a": 1}
@@ -0,0 +1,73 @@
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from datapath_standin import DatapathStandIn, SyntheticTraffic
+from flow import FlowId
+from rule_installer import QOS_TABLE_ID, RULE_COOKIE, RULE_COOKIE_MASK, RuleInstaller
+
+
+def standin(flows, rate=1000.0):
+    replies = []
+    traffic = SyntheticTraffic({flow: rate for flow in flows})
+    dp = DatapathStandIn(1, 2, replies.append, traffic)
+    installer = RuleInstaller()
+    for queue_id, flow in enumerate(flows, start=1):
+        dp.send_msg(installer.flow_mod(dp, flow, queue_id))
+    return dp, replies, traffic
+
+
+def flow_stats_request(dp, cookie=RULE_COOKIE, cookie_mask=RULE_COOKIE_MASK):
+    return ofproto_v1_3_parser.OFPFlowStatsRequest(dp, table_id=QOS_TABLE_ID, out_port=ofproto_v1_3.OFPP_ANY,
+                                                   out_group=ofproto_v1_3.OFPG_ANY, cookie=cookie,
+                                                   cookie_mask=cookie_mask)
+
+
+def test_standin_ports():
+    dp, _, _ = standin([])
+    assert sorted(port.name.decode() for port in dp.ports.values()) == ["s1", "s1-eth1", "s1-eth2"]
+
+
+def test_standin_flow_stats_are_parsed_by_ryu():
+    flows = [FlowId("10.0.0.11", 5001), FlowId("10.0.0.12", 5002)]
+    dp, replies, traffic = standin(flows)
+    traffic.set_rate(flows[1], 0.0)
+    req = flow_stats_request(dp)
+    dp.send_msg(req)
+    assert len(replies) == 1
+    msg = dp.parse(replies[0])
+    assert isinstance(msg, ofproto_v1_3_parser.OFPFlowStatsReply)
+    assert msg.xid == req.xid and msg.flags == 0
+    stats = {FlowId(stat.match["ipv4_dst"], stat.match["udp_dst"]): stat for stat in msg.body}
+    assert set(stats) == set(flows)
+    assert stats[flows[0]].byte_count >= 0 and stats[flows[0]].cookie == RULE_COOKIE | 1
+    assert stats[flows[1]].instructions[0].actions[0].queue_id == 2
+
+    dp.send_msg(flow_stats_request(dp, cookie=0x1234 << 16))
+    assert dp.parse(replies[1]).body == []
+
+
+def test_standin_multipart_reply():
+    flows = [FlowId("10.0.%d.%d" % (i >> 8, i & 255), 5000) for i in range(2000)]
+    dp, replies, _ = standin(flows)
+    dp.send_msg(flow_stats_request(dp))
+    messages = [dp.parse(buf) for buf in replies]
+    assert len(messages) > 1
+    assert [msg.flags for msg in messages] == [ofproto_v1_3.OFPMPF_REPLY_MORE] * (len(messages) - 1) + [0]
+    assert sum(len(msg.body) for msg in messages) == 2000
+
+
+def test_standin_queue_stats_and_barrier():
+    flows = [FlowId("10.0.0.11", 5001), FlowId("10.0.0.12", 5002)]
+    dp, replies, _ = standin(flows)
+    dp.send_msg(ofproto_v1_3_parser.OFPQueueStatsRequest(dp, 0, ofproto_v1_3.OFPP_ANY, ofproto_v1_3.OFPQ_ALL))
+    dp.send_msg(ofproto_v1_3_parser.OFPBarrierRequest(dp))
+    queue_stats, barrier = [dp.parse(buf) for buf in replies]
+    assert sorted(stat.queue_id for stat in queue_stats.body) == [1, 2]
+    assert isinstance(barrier, ofproto_v1_3_parser.OFPBarrierReply)
+
+
+def test_synthetic_traffic_rate_change_keeps_counters_monotonic():
+    flow = FlowId("10.0.0.11", 5001)
+    traffic = SyntheticTraffic({flow: 100.0})
+    before = traffic.bytes(flow, traffic._rates[flow][1] + 10)
+    traffic.set_rate(flow, 0.0, traffic._rates[flow][1] + 10)
+    assert traffic.bytes(flow, traffic._rates[flow][1] + 100) == before == 1000
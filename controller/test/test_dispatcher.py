@@ -0,0 +1,34 @@
+import ryu.lib.hub
+
+from dispatcher import DatapathDispatcher
+
+
+def test_dispatcher_concurrency_limit():
+    dispatcher = DatapathDispatcher(concurrency=3)
+    running = []
+    peak = []
+
+    def task(dpid):
+        running.append(dpid)
+        peak.append(len(running))
+        ryu.lib.hub.sleep(0.01)
+        running.remove(dpid)
+        return dpid * 2
+
+    futures = {dpid: dispatcher.submit(dpid, task, dpid) for dpid in range(10)}
+    assert dispatcher.wait_all(5)
+    assert max(peak) == 3
+    assert all(future.result == dpid * 2 for dpid, future in futures.items())
+
+
+def test_dispatcher_failing_task():
+    dispatcher = DatapathDispatcher()
+
+    def task():
+        raise RuntimeError("unreachable switch")
+
+    future = dispatcher.submit(1, task)
+    assert future.wait(5) and future.done()
+    assert isinstance(future.exception, RuntimeError) and future.result is None
+    dispatcher.forget(1)
+    assert dispatcher.futures == {}
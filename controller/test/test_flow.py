@@ -1,7 +1,11 @@
+import math
+import random
+
 import pytest
 
 import config_handler
-from flow import FlowId, FlowStat, FlowStatManager
+from flow import ESTIMATORS, BaseFlowStatManager, EwmaFlowStatManager, FlowId, FlowMaxIndex, FlowStat, \
+    FlowStatManager, PeakHoldFlowStatManager, new_flow_stat_manager
 
 
 # ====== FlowId tests ======
@@ -18,6 +22,19 @@ def test_flowid_from_dict_incorrect_field():
         FlowId.from_dict({"ipv4_dst": "192.0.2.1", "p": 5009})
 
 
+def test_flowid_from_dict_prefix_and_port_range():
+    flow = FlowId.from_dict({"ipv4_dst": "10.1.0.0/16", "udp_dst": "5000-5099"})
+    assert flow == FlowId("10.1.0.0/16", 5000, 5099)
+    assert flow.network() == ("10.1.0.0", 16)
+    assert flow.udp_dst_spec == "5000-5099"
+    assert len(flow.ports()) == 100
+    assert FlowId.from_dict(flow.to_dict()) == flow
+    assert FlowId.from_dict({"ipv4_dst": "10.0.0.11/32", "udp_dst": "5001-5001"}) == FlowId("10.0.0.11", 5001)
+    with pytest.raises(ValueError):
+        FlowId.from_dict({"ipv4_dst": "10.1.0.1/16", "udp_dst": 5000})  # Host bits set
+    with pytest.raises(ValueError):
+        FlowId.from_dict({"ipv4_dst": "10.1.0.0/16", "udp_dst": "5099-5000"})
+
 # def test_flowid_udp_dst_type_fix():
 #     assert FlowId("192.0.2.1", 5009) == FlowId("192.0.2.1", "5009")
 #
@@ -102,6 +119,41 @@ def test_flowstat_get_avg_speed_bps():
     assert f.get_avg_speed_bps() == 0.4 * 8
 
 
+def test_flowstat_window_overflow():
+    f = FlowStat(3)
+    timestamp = 0
+    for x in [1, 3, 5, 7, 15]:
+        f.put(x, timestamp)
+        timestamp += 1
+    assert len(f) == 3 and f.get_avg() == 5 and f.get_avg_speed() == 5
+
+
+def test_flowstat_resize_keeps_newest():
+    f = FlowStat(4)
+    timestamp = 0
+    for x in [1, 3, 5, 9]:
+        f.put(x, timestamp)
+        timestamp += 1
+    f.resize(2)
+    assert len(f) == 2 and f.get_avg_speed() == 4
+    f.resize(5)
+    f.put(11, timestamp)
+    assert len(f) == 3 and f.get_avg() == 3
+
+
+def test_flowstat_follows_window_size_config():
+    f = FlowStat()
+    original_window_size = FlowStat.WINDOW_SIZE
+    try:
+        for x in range(10):
+            f.put(x)
+        FlowStat.WINDOW_SIZE = 3
+        f.put(10)
+        assert f.window_size == 3 and len(f) == 3 and f.get_avg() == 1
+    finally:
+        FlowStat.WINDOW_SIZE = original_window_size
+
+
 # ====== FlowStatManager tests ======
 
 f1 = FlowId("192.0.2.1", 5001)
@@ -133,3 +185,253 @@ def test_export_avg_speeds():
         fm.put(f2, x, timestamp)
         timestamp += 5
     assert fm.export_avg_speeds() == {f1: 0.4, f2: 1.4}
+
+
+def test_flowstatmanager_put_out_of_order_number():
+    fm = FlowStatManager()
+    with pytest.raises(ValueError):
+        fm.put(f1, 5)
+        fm.put(f1, 4)
+
+
+def test_flowstatmanager_matches_flowstat():
+    fm = FlowStatManager()
+    flows = [FlowId("192.0.2.{}".format(i // 4), 5000 + i) for i in range(100)]  # More than the initial capacity
+    stats = {flow: FlowStat() for flow in flows}
+    for step in range(12):
+        for i, flow in enumerate(flows):
+            val = step * step * (i + 1) * 1031
+            timestamp = step * 1.7 + i / 100
+            fm.put(flow, val, timestamp)
+            stats[flow].put(val, timestamp)
+    assert fm.export_avg_speeds_bps('M') == {flow: stat.get_avg_speed_bps('M') for flow, stat in stats.items()}
+    assert all(fm.get_avg(flow) == stat.get_avg() for flow, stat in stats.items())
+
+
+def test_flowstatmanager_resize_keeps_newest():
+    fm = FlowStatManager()
+    timestamp = 0
+    for x in [1, 3, 5, 9]:
+        fm.put(f1, x, timestamp)
+        fm.put(f2, 2 * x, timestamp)
+        timestamp += 1
+    fm.resize(2)
+    assert fm.export_avg_speeds() == {f1: 4, f2: 8}
+    fm.resize(5)
+    fm.put(f1, 11, timestamp)
+    assert fm.get_avg(f1) == 3 and fm.get_avg(f2) == 8
+
+
+def test_flowstatmanager_reset():
+    fm = FlowStatManager()
+    for x in [1, 3, 5, 7]:
+        fm.put(f1, x)
+    fm.reset(f1)
+    fm.put(f1, 2)
+    assert fm.get_avg(f1) == 2 and fm.get_avg_speed(f1) == 0
+
+
+@pytest.mark.parametrize("manager_cls", [FlowStatManager, EwmaFlowStatManager])
+def test_flowstatmanager_remove_moves_the_last_row(manager_cls):
+    fm = manager_cls()
+    flows = [FlowId("192.0.2.%d" % i, 5000 + i) for i in range(3)]
+    for t in range(4):
+        for i, flow in enumerate(flows):
+            fm.put(flow, (i + 1) * 100 * t, float(t))
+    fm.remove(flows[0])
+    assert fm.flows == [flows[2], flows[1]] and flows[0] not in fm
+    assert fm.export_avg_speeds() == {flows[1]: 200.0, flows[2]: 300.0}
+    fm.put(flows[0], 50, 4.0)
+    assert fm.get_avg_speed(flows[0]) == 0 and fm.get_avg_speed(flows[2]) == 300.0
+
+
+@pytest.mark.parametrize("manager_cls", [FlowStatManager, EwmaFlowStatManager, PeakHoldFlowStatManager])
+def test_put_rows_matches_put(manager_cls):
+    rng = random.Random(7)
+    flows = [FlowId("192.0.2.%d" % i, 5000 + i) for i in range(20)]
+    by_put, by_rows = manager_cls(), manager_cls()
+    counters = {flow: 0 for flow in flows}
+    for t in range(30):
+        measured = rng.sample(flows, 10)
+        for flow in measured:
+            counters[flow] += rng.randint(0, 1000)
+            by_put.put(flow, counters[flow], float(t))
+        rows = [by_rows.row(flow) for flow in measured]
+        assert by_rows.put_rows(rows, [counters[flow] for flow in measured], float(t)) == []
+    assert by_rows.export_avg_speeds() == by_put.export_avg_speeds()
+    assert by_rows.export_speed_variances_array().tolist() == \
+        [by_put.export_speed_variances_array()[by_put.index[flow]] for flow in by_rows.flows]
+    # A decreasing value is rejected and leaves the row unchanged
+    row = by_rows.row(flows[0])
+    assert by_rows.put_rows([row, by_rows.row(flows[1])], [0, counters[flows[1]]], 30.0) == [row]
+    assert by_rows.get_avg_speed(flows[0]) == by_put.get_avg_speed(flows[0])
+
+
+# ====== FlowMaxIndex tests ======
+def test_flowmaxindex_matches_full_rebuild():
+    rng = random.Random(3)
+    flows = [FlowId("192.0.2.%d" % i, 5000 + i) for i in range(5)]
+    index = FlowMaxIndex()
+    measured = {}  # dpid -> {FlowId: speed}
+    for _ in range(500):
+        dpid = rng.randint(1, 4)
+        if rng.random() < 0.05:
+            index.remove_datapath(dpid)
+            measured.pop(dpid, None)
+            continue
+        speeds = {flow: float(rng.randint(0, 20)) for flow in rng.sample(flows, 3)}
+        index.update(dpid, speeds.items())
+        measured.setdefault(dpid, {}).update(speeds)
+
+        expected = {}
+        for speeds in measured.values():
+            for flow, speed in speeds.items():
+                expected[flow] = max(speed, expected.get(flow, speed))
+        assert index.export() == expected
+
+
+def test_flowmaxindex_remove_last_datapath():
+    index = FlowMaxIndex()
+    flow = FlowId("192.0.2.1", 5001)
+    index.update(1, [(flow, 10.0)])
+    index.update(2, [(flow, 5.0)])
+    index.remove_datapath(1)
+    assert index.get(flow) == 5.0
+    index.remove_datapath(2)
+    assert len(index) == 0 and index.export() == {}
+
+
+def test_flowmaxindex_remove_flow():
+    index = FlowMaxIndex()
+    f2 = FlowId("192.0.2.2", 5002)
+    index.update(1, [(f1, 10.0), (f2, 1.0)])
+    index.update(2, [(f1, 5.0)])
+    index.remove_flow(f1)
+    assert index.export() == {f2: 1.0}
+    index.remove_datapath(2)
+    index.update(2, [(f1, 3.0)])
+    assert index.export() == {f1: 3.0, f2: 1.0}
+
+
+def test_speed_variance_manager_matches_flowstat():
+    rng = random.Random(5)
+    manager = FlowStatManager(window_size=4)
+    flowstats = {}
+    counters = {}
+    for t in range(12):
+        for i in range(3):
+            flow = FlowId("192.0.2.%d" % i, 5000 + i)
+            counters[flow] = counters.get(flow, 0) + rng.randint(0, 1000) * (i + 1) * t
+            flowstats.setdefault(flow, FlowStat(window_size=4)).put(counters[flow], float(t))
+            manager.put(flow, counters[flow], float(t))
+        expected = [flowstats[flow].get_speed_variance() for flow in manager.flows]
+        assert manager.export_speed_variances_array().tolist() == pytest.approx(expected)
+
+
+def test_speed_variance_constant_speed():
+    flowstat = FlowStat(window_size=5)
+    for t in range(5):
+        flowstat.put(100 * t, float(t))
+    assert flowstat.get_speed_variance() == 0
+    flowstat.put(1000, 5.0)
+    assert flowstat.get_speed_variance() > 0
+
+
+# ====== Estimator tests ======
+def test_ewma_first_interval_sets_the_speed():
+    manager = EwmaFlowStatManager(time_constant=10)
+    flow = FlowId("192.0.2.1", 5001)
+    manager.put(flow, 0, 0.0)
+    assert manager.get_avg_speed(flow) == 0
+    manager.put(flow, 500, 2.0)
+    assert manager.get_avg_speed(flow) == 250
+    manager.put(flow, 1000, 4.0)
+    assert manager.get_avg_speed_bps(flow) == 2000
+    assert manager.export_speed_variances_array().tolist() == [0]
+
+
+def test_ewma_smoothing_follows_wall_time():
+    # After a step in the speed the estimate approaches the new speed by the same amount at the same time, whatever
+    # the measurement interval is
+    estimates = []
+    for interval in (1, 2, 5):
+        manager = EwmaFlowStatManager(time_constant=10)
+        flow = FlowId("192.0.2.1", 5001)
+        counter = 0
+        for t in range(0, 21, interval):
+            if t > 0:
+                counter += (100 if t <= 10 else 300) * interval
+            manager.put(flow, counter, float(t))
+        estimates.append(manager.get_avg_speed(flow))
+    expected = 300 - 200 * math.exp(-1)
+    assert estimates == pytest.approx([expected] * 3)
+
+
+def test_ewma_variance_of_changing_speed():
+    manager = EwmaFlowStatManager(time_constant=5)
+    flow = FlowId("192.0.2.1", 5001)
+    counter = 0
+    for t in range(20):
+        counter += 100 if t % 2 else 300
+        manager.put(flow, counter, float(t))
+    assert manager.export_avg_speeds_array().tolist() == pytest.approx([200], rel=0.1)
+    assert manager.export_speed_variances_array().tolist()[0] > 0
+
+
+def test_ewma_reset_and_out_of_order_number():
+    manager = EwmaFlowStatManager()
+    flow = FlowId("192.0.2.1", 5001)
+    manager.put(flow, 100, 0.0)
+    manager.put(flow, 200, 1.0)
+    with pytest.raises(ValueError):
+        manager.put(flow, 50, 2.0)
+    manager.reset(flow)
+    assert manager.get_avg_speed(flow) == 0
+    manager.put(flow, 50, 2.0)
+    manager.put(flow, 150, 3.0)
+    assert manager.export_avg_speeds() == {flow: 100}
+
+
+def test_peak_hold_rises_at_once_and_decays_slowly():
+    manager = PeakHoldFlowStatManager(time_constant=10)
+    flow = FlowId("192.0.2.1", 5001)
+    counter = 0
+    manager.put(flow, counter, 0.0)
+    for t, speed in enumerate((100, 100, 500, 100), start=1):
+        counter += speed
+        manager.put(flow, counter, float(t))
+        if t == 3:
+            assert manager.get_avg_speed(flow) == 500
+    assert manager.get_avg_speed(flow) == pytest.approx(500 - 400 * (1 - math.exp(-0.1)))
+
+
+def test_estimator_config(tmp_path):
+    config = tmp_path / "config.yml"
+    config.write_text("flows: []\ncontroller_baseurl: ''\novsdb_addr: ''\nflowstat_estimator: peak\n"
+                      "flowstat_time_constant: 3\n")
+    estimator, time_constant = FlowStat.ESTIMATOR, FlowStat.TIME_CONSTANT
+    try:
+        FlowStat.configure(config_handler.ConfigHandler(str(config)))
+        manager = new_flow_stat_manager()
+        assert type(manager) is PeakHoldFlowStatManager
+        assert manager.time_constant == 3
+
+        config.write_text("flows: []\ncontroller_baseurl: ''\novsdb_addr: ''\nflowstat_estimator: median\n")
+        with pytest.raises(config_handler.ConfigError):
+            FlowStat.configure(config_handler.ConfigHandler(str(config)))
+
+        for time_constant in (0, -1):
+            config.write_text("flows: []\ncontroller_baseurl: ''\novsdb_addr: ''\nflowstat_time_constant: {}\n".format(
+                time_constant))
+            with pytest.raises(config_handler.ConfigError):
+                FlowStat.configure(config_handler.ConfigHandler(str(config)))
+    finally:
+        FlowStat.ESTIMATOR, FlowStat.TIME_CONSTANT = estimator, time_constant
+    assert type(new_flow_stat_manager()) is FlowStatManager
+
+
+def test_estimators_share_the_base_class():
+    for manager_cls in ESTIMATORS.values():
+        assert issubclass(manager_cls, BaseFlowStatManager)
+    with pytest.raises(TypeError):
+        BaseFlowStatManager()
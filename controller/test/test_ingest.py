@@ -0,0 +1,101 @@
+from ryu.ofproto import ofproto_v1_3
+
+from classifier import SliceClassifier
+from datapath_standin import DatapathStandIn, SyntheticTraffic
+from flow import EwmaFlowStatManager, FlowId, FlowStatManager
+from ingest import FlowStatsIngest, MultipartReplies
+from metrics import STATS_REPLY_BYTES, STATS_REPLY_PARTS
+from rule_installer import RuleInstaller
+from test_datapath_standin import flow_stats_request
+
+host = FlowId("10.0.0.11", 5001)
+ranged = FlowId("10.1.0.0/16", 6000, 6002)
+
+
+def standin(flows, rates):
+    replies = []
+    dp = DatapathStandIn(1, 2, replies.append, SyntheticTraffic(rates))
+    installer = RuleInstaller()
+    for queue_id, flow in enumerate(flows, start=1):
+        for mod in installer.flow_mods(dp, flow, queue_id):
+            dp.send_msg(mod)
+    return dp, replies
+
+
+def poll(dp, replies, ingest, timestamp):
+    replies.clear()
+    dp.send_msg(flow_stats_request(dp))
+    for buf in replies:
+        msg = dp.parse(buf)
+        ingest.add(msg.xid, msg.body, timestamp)
+        if not msg.flags & ofproto_v1_3.OFPMPF_REPLY_MORE:
+            return ingest.finish(msg.xid)
+
+
+def test_ingest_sums_the_rules_of_a_slice():
+    dp, replies = standin([host, ranged], {FlowId("10.1.0.0/16", port): 100.0 * port for port in ranged.ports()})
+    fsm = FlowStatManager()
+    ingest = FlowStatsIngest(fsm, SliceClassifier([host, ranged]))
+    dp.send_msg(flow_stats_request(dp))
+    msg = dp.parse(replies[0])
+    assert len(msg.body) == 4
+    ingest.add(msg.xid, msg.body, 0.0)
+    assert ingest.finish(msg.xid) == 2
+    assert set(fsm.flows) == {host, ranged}
+    assert fsm.get_avg(ranged) == sum(stat.byte_count for stat in msg.body if stat.match["udp_dst"] >= 6000)
+    assert ingest.finish(msg.xid) == 0  # Already written
+
+
+def test_ingest_multipart_reply_and_counter_restart():
+    flows = [FlowId("10.0.%d.%d" % (i >> 8, i & 255), 5000) for i in range(2000)]
+    dp, replies = standin(flows, {})
+    fsm = EwmaFlowStatManager()
+    ingest = FlowStatsIngest(fsm, SliceClassifier(flows))
+    for flow in flows:
+        dp.traffic.set_rate(flow, 1000.0, 0.0)
+    dp.send_msg(flow_stats_request(dp))
+    messages = [dp.parse(buf) for buf in replies]
+    assert len(messages) > 1
+    parts = STATS_REPLY_PARTS.labels(type="flow")
+    counted = parts.sum
+    for i, msg in enumerate(messages):
+        ingest.add(msg.xid, msg.body, 10.0 + i, msg.msg_len)
+    # Nothing is written before the last part
+    assert all(count == 0 for count in fsm._count)
+    assert ingest.finish(messages[-1].xid) == 2000
+    # The whole reply has the time of its first part
+    assert set(fsm._last_timestamp) == {10.0}
+    assert parts.sum - counted == len(messages)
+
+    fsm.put_rows([fsm.index[flows[0]]], [10 ** 15], 20.0)
+    replies.clear()
+    poll(dp, replies, ingest, 30.0)  # The counter of flows[0] has decreased, its statistics restart
+    assert fsm._count[fsm.index[flows[0]]] == 1 and fsm._count[fsm.index[flows[1]]] == 2
+
+
+def test_ingest_ignores_other_rules_and_unknown_destinations():
+    other = FlowId("10.0.0.12", 5002)
+    dp, replies = standin([host, other], {host: 100.0, other: 100.0})
+    fsm = FlowStatManager()
+    ingest = FlowStatsIngest(fsm, SliceClassifier([host]))
+    assert poll(dp, replies, ingest, 0.0) == 1
+    assert fsm.flows == [host]
+    # After the slices change, the matches are classified again
+    ingest.reset(SliceClassifier([host, other]))
+    assert poll(dp, replies, ingest, 1.0) == 2
+    assert fsm.flows == [host, other]
+
+
+def test_multipart_replies():
+    replies = MultipartReplies("test")
+    replies.part(1, 5.0, 100).sums["a"] = 1
+    reply = replies.part(1, 6.0, 50)
+    assert reply.timestamp == 5.0 and reply.parts == 2 and reply.sums == {"a": 1}
+    replies.part(2, 7.0, 10)
+    assert replies.finish(1) is reply and replies.finish(1) is None
+    assert STATS_REPLY_PARTS.labels(type="test").sum == 2
+    assert STATS_REPLY_BYTES.labels(type="test").sum == 150
+    # A reply whose last part never arrives is expired, without being recorded
+    replies.part(3, 9.0)
+    assert replies.expire(8.0) == 1 and len(replies) == 1
+    assert replies.finish(2) is None and STATS_REPLY_PARTS.labels(type="test").sum == 2
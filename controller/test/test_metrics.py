@@ -0,0 +1,81 @@
+import pytest
+
+import config_handler
+from metrics import Counter, Gauge, Histogram, MetricsServer, Registry, _Metric
+
+
+def test_metrics_render():
+    registry = Registry()
+    counter = Counter("test_skipped", "Skipped operations.", ("operation",), registry=registry)
+    gauge = Gauge("test_flows", "Flows.", registry=registry)
+    histogram = Histogram("test_seconds", "Durations.", buckets=(0.1, 1), registry=registry)
+    counter.labels(operation="set_queues").inc()
+    counter.labels("set_queues").inc(2)
+    gauge.set(7)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.render().splitlines() == [
+        "# HELP test_skipped Skipped operations.",
+        "# TYPE test_skipped counter",
+        'test_skipped_total{operation="set_queues"} 3',
+        "# HELP test_flows Flows.",
+        "# TYPE test_flows gauge",
+        "test_flows 7",
+        "# HELP test_seconds Durations.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_count 3",
+        "test_seconds_sum 5.55",
+    ]
+
+
+def test_metrics_invalid_use():
+    registry = Registry()
+    counter = Counter("test_counter", "A counter.", ("a", "b"), registry=registry)
+    with pytest.raises(ValueError):
+        counter.labels("x")
+    with pytest.raises(ValueError):
+        counter.labels("x", "y").inc(-1)
+    with pytest.raises(ValueError):
+        Gauge("test_counter", "Same name.", registry=registry)
+    with pytest.raises(TypeError):
+        _Metric("test_abstract", "No value.", registry=registry)
+
+
+def test_metrics_collector_and_app():
+    registry = Registry()
+    gauge = Gauge("test_datapaths", "Datapaths.", registry=registry)
+    registry.add_collector(lambda: gauge.set(3))
+    responses = []
+    body = b"".join(MetricsServer(registry).app({}, lambda status, headers: responses.append((status, headers))))
+    assert responses[0][0] == "200 OK"
+    assert body.decode().endswith("test_datapaths 3\n")
+
+
+def test_metrics_addr_config(tmp_path):
+    config = tmp_path / "config.yml"
+    addr = MetricsServer.ADDR
+    try:
+        for value in ("", "~"):
+            config.write_text("flows: []\ncontroller_baseurl: ''\novsdb_addr: ''\nmetrics_addr: {}\n".format(value))
+            MetricsServer.configure(config_handler.ConfigHandler(str(config)))
+            assert MetricsServer.ADDR == ""
+    finally:
+        MetricsServer.ADDR = addr
+
+
+def test_histogram_quantile():
+    histogram = Histogram("test_quantile", "Durations.", buckets=(1, 2, 4), registry=Registry())
+    assert histogram.quantile(0.5) != histogram.quantile(0.5)  # NaN
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+    assert histogram.quantile(0.25) == 1
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1) == 4
+    histogram.observe(100)
+    assert histogram.quantile(1) == 4
+    histogram.reset()
+    assert sum(histogram.counts) == 0
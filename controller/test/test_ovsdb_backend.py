@@ -0,0 +1,80 @@
+import pytest
+
+from flow import FlowId
+from ovsdb_backend import OvsdbQoSBackend
+from ovsdb_standin import OvsdbStandIn
+from qos_manager import QoSManager
+
+
+@pytest.fixture
+def standin():
+    server = OvsdbStandIn().start()
+    for port in ("s1-eth1", "s1-eth2", "s2-eth1"):
+        server.add_port(port)
+    yield server
+    server.stop()
+
+
+def test_ovsdb_backend_creates_queues(standin):
+    backend = OvsdbQoSBackend(standin.addr)
+    diffs = {(1, "s1-eth1"): {0: -1, 1: 5000000, 2: 15000000}, (2, "s2-eth1"): {0: -1, 1: 5000000, 2: 15000000}}
+    assert backend.set_queues(diffs, [-1, 5000000, 15000000]) == set(diffs)
+    assert standin.port_queue_rates("s1-eth1") == {0: None, 1: "5000000", 2: "15000000"}
+    assert standin.port_queue_rates("s1-eth2") == {}
+    backend.close()
+
+
+def test_ovsdb_backend_updates_in_place_in_one_transaction(standin):
+    backend = OvsdbQoSBackend(standin.addr)
+    ports = [(1, "s1-eth1"), (1, "s1-eth2"), (2, "s2-eth1")]
+    backend.set_queues({key: {} for key in ports}, [-1, 5000000, 15000000])
+    queues_before = len(standin.tables["Queue"])
+    backend.set_queues({key: {} for key in ports}, [-1, 5000000, 15000000])  # Looks the new rows up
+
+    transactions = standin.transactions
+    assert backend.set_queues({key: {1: 2000000} for key in ports}, [-1, 2000000, 15000000]) == set(ports)
+    assert standin.transactions == transactions + 1
+    assert len(standin.tables["Queue"]) == queues_before
+    assert all(standin.port_queue_rates(port) == {0: None, 1: "2000000", 2: "15000000"} for _, port in ports)
+    backend.close()
+
+
+def test_ovsdb_backend_keeps_other_queue_settings(standin):
+    backend = OvsdbQoSBackend(standin.addr)
+    backend.set_queues({(1, "s1-eth1"): {}}, [-1, 5000000])
+    backend.set_queues({(1, "s1-eth1"): {}}, [-1, 5000000])  # Looks the new rows up
+    queue = backend._queues["s1-eth1"][1]
+    standin.tables["Queue"][queue]["other_config"][1].append(["min-rate", "1000000"])
+
+    backend.set_queues({(1, "s1-eth1"): {1: 2000000}}, [-1, 2000000])
+    assert dict(standin.tables["Queue"][queue]["other_config"][1]) == {"max-rate": "2000000", "min-rate": "1000000"}
+    backend.set_queues({(1, "s1-eth1"): {1: -1}}, [-1, -1])  # No limit, only max-rate is deleted
+    assert dict(standin.tables["Queue"][queue]["other_config"][1]) == {"min-rate": "1000000"}
+    backend.close()
+
+
+def test_ovsdb_backend_unknown_port(standin):
+    backend = OvsdbQoSBackend(standin.addr)
+    assert backend.set_queues({(1, "s9-eth1"): {1: 5000000}}, [-1, 5000000]) == set()
+    backend.close()
+
+
+def test_ovsdb_backend_unreachable_server():
+    backend = OvsdbQoSBackend("tcp:127.0.0.1:9")
+    assert backend.set_queues({(1, "s1-eth1"): {1: 5000000}}, [-1, 5000000]) == set()
+
+
+def test_qos_manager_with_ovsdb_backend(standin):
+    original = QoSManager.QUEUE_BACKEND, getattr(QoSManager, "OVSDB_ADDR", None)
+    QoSManager.QUEUE_BACKEND, QoSManager.OVSDB_ADDR = "ovsdb", standin.addr
+    try:
+        flow = FlowId("10.0.0.11", 5001)
+        manager = QoSManager({flow: 5 * 10 ** 6})
+        manager.register_datapath(1, ["s1-eth1", "s1-eth2"])
+        manager.set_queues()
+        assert not manager.has_stale_queues()
+        manager._update_limit(flow, 2 * 10 ** 6, force=True)
+        manager.set_queues()
+        assert standin.port_queue_rates("s1-eth2")[1] == "2000000"
+    finally:
+        QoSManager.QUEUE_BACKEND, QoSManager.OVSDB_ADDR = original
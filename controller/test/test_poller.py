@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from poller import AdaptivePoller
+
+
+def test_poller_backs_off_and_tightens():
+    poller = AdaptivePoller(5, min_interval=1, max_interval=8)
+    poller.add_datapath(1, 0)
+    now = poller.phase(1)
+    assert poller.due(now) == [1]
+    for expected in (2, 4, 8, 8):
+        poller.polled(1, now)
+        poller.update(1, urgent=False)
+        assert poller.intervals[1] == expected
+        assert poller.due(now + expected - 0.5) == []
+        now += expected
+        assert poller.due(now) == [1]
+    poller.polled(1, now)
+    poller.update(1, urgent=True)
+    assert poller.next_poll() == now + 1
+
+
+def test_poller_defaults_to_time_step():
+    poller = AdaptivePoller(5)
+    assert poller.min_interval == poller.max_interval == 5
+
+
+def test_poller_invalid_intervals():
+    with pytest.raises(ValueError):
+        AdaptivePoller(5, min_interval=10, max_interval=1)
+
+
+def test_poller_set_intervals():
+    poller = AdaptivePoller(5, min_interval=1, max_interval=8)
+    poller.add_datapath(1, 0)
+    poller.polled(1, poller.phase(1))
+    poller.update(1, urgent=False)
+    poller.set_intervals(10, 100, max_interval=20)
+    assert poller.min_interval == 10 and poller.max_interval == 20
+    assert poller.intervals[1] == 10 and poller.scheduled(1) == 100 + poller.phase(1)
+    with pytest.raises(ValueError):
+        poller.set_intervals(10, 100, max_interval=5)
+
+
+def test_poller_removed_datapath():
+    poller = AdaptivePoller(5)
+    poller.add_datapath(1, 0)
+    poller.remove_datapath(1)
+    poller.update(1, urgent=True)
+    assert poller.due(10) == [] and poller.next_poll() is None
+
+
+def test_poller_urgency():
+    speeds = np.array([100.0, 0.0])
+    assert not AdaptivePoller.is_urgent(speeds, np.array([1.0, 0.0]), [200, -1])
+    assert AdaptivePoller.is_urgent(speeds, np.array([400.0, 0.0]), [200, -1])  # Changing by 20%
+    assert AdaptivePoller.is_urgent(speeds, np.array([1.0, 0.0]), [100, -1])  # At its limit
+    assert not AdaptivePoller.is_urgent(np.array([]), np.array([]), [])
+
+
+def test_poller_spreads_phases():
+    poller = AdaptivePoller(10)
+    for dpid in range(1, 11):
+        poller.add_datapath(dpid, 100)
+    scheduled = [poller.scheduled(dpid) for dpid in poller.due(110)]
+    assert len(scheduled) == 10 and scheduled == sorted(scheduled)
+    assert all(100 <= t < 110 for t in scheduled)
+    # No two polls closer than a third of the even spacing
+    assert min(b - a for a, b in zip(scheduled, scheduled[1:])) > 1 / 3
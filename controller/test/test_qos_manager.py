@@ -0,0 +1,187 @@
+import pytest
+import ryu.lib.hub
+
+from flow import FlowId
+import metrics
+from qos_manager import QoSManager, ThreadedQoSManager
+
+f1 = FlowId("10.0.0.11", 5001)
+f2 = FlowId("10.0.0.13", 5003)
+
+
+class RecordingQoSManager(QoSManager):
+    """Records the queue settings instead of sending them, failing the ones in `failing`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.posts = []
+        self.failing = set()
+
+    def _post_queues(self, dpid, port_name, queue_limits):
+        self.posts.append((dpid, port_name))
+        return (dpid, port_name) not in self.failing
+
+
+def make_manager():
+    manager = RecordingQoSManager({f1: 5 * 10 ** 6, f2: 15 * 10 ** 6})
+    manager.register_datapath(1, ["s1-eth1", "s1-eth2"])
+    manager.register_datapath(2, ["s2-eth1"])
+    return manager
+
+
+def test_get_queue_limits():
+    manager = make_manager()
+    assert manager.get_queue_limits() == [QoSManager.DEFAULT_MAX_RATE, 5 * 10 ** 6, 15 * 10 ** 6]
+
+
+def test_set_queues_all_at_once_when_everything_is_stale():
+    manager = make_manager()
+    manager.set_queues()
+    assert manager.posts == [("all", None)]
+    assert not manager.has_stale_queues()
+
+
+def test_set_queues_skips_up_to_date_switches():
+    manager = make_manager()
+    manager.set_queues()
+    manager.posts.clear()
+    manager.set_queues()
+    manager.set_queues(2)
+    assert manager.posts == []
+
+
+def test_set_queues_only_stale_ports():
+    manager = make_manager()
+    manager.failing.add(("all", None))
+    manager.set_queues()
+    manager.set_queues(2)
+    manager.posts.clear()
+    manager.applied_queues[(1, "s1-eth1")] = tuple(manager.get_queue_limits())
+    manager.set_queues()
+    assert manager.posts == [(1, "s1-eth2")]
+    assert not manager.has_stale_queues()
+
+
+def test_set_queues_after_limit_change():
+    manager = make_manager()
+    manager.set_queues()
+    manager.posts.clear()
+    manager._update_limit(f1, 2 * 10 ** 6, force=True)
+    assert manager.queue_diff(1, "s1-eth1") == {1: 2 * 10 ** 6}
+    manager.set_queues()
+    assert manager.posts == [("all", None)]
+
+
+def test_set_queues_unregistered_datapath():
+    manager = make_manager()
+    manager.unregister_datapath(2)
+    assert (2, "s2-eth1") not in manager.applied_queues
+    manager.set_queues(3)
+    assert manager.posts == [(3, None)]
+
+
+def test_add_and_remove_flows_recycle_queue_ids():
+    manager = make_manager()
+    manager._update_limit(f2, 10 ** 7, True)
+    f3 = FlowId("10.1.0.0/16", 6000, 6009)
+    assert manager.remove_flow(f1) == 1
+    assert manager.get_queue_limits() == [QoSManager.DEFAULT_MAX_RATE] * 2 + [10 ** 7]
+    assert manager.add_flow(f3, 20 * 10 ** 6) == 1
+    assert manager.add_flow(f1, 5 * 10 ** 6) == 3
+    assert manager.get_queue_limits() == [QoSManager.DEFAULT_MAX_RATE, 20 * 10 ** 6, 10 ** 7, 5 * 10 ** 6]
+    # The other flows keep their limits in the engine too
+    current, initial = manager.get_limits_arrays()
+    rows = manager.limit_rows([f1, f2, f3])
+    assert current[rows].tolist() == [5 * 10 ** 6, 10 ** 7, 20 * 10 ** 6]
+    assert initial[rows].tolist() == [5 * 10 ** 6, 15 * 10 ** 6, 20 * 10 ** 6]
+    with pytest.raises(ValueError):
+        manager.add_flow(f3, 10 ** 6)
+
+
+def test_resize_flow_restarts_from_the_new_limit():
+    manager = make_manager()
+    manager._update_limit(f1, 2 * 10 ** 6, True)
+    manager._update_limit(f2, 18 * 10 ** 6, True)
+    manager.set_queues()
+    manager.resize_flow(f1, 8 * 10 ** 6)
+    assert manager.get_initial_limit(f1) == manager.get_current_limit(f1) == 8 * 10 ** 6
+    assert manager.get_current_limit(f2) == 18 * 10 ** 6
+    assert manager.queue_diff(2, "s2-eth1") == {1: 8 * 10 ** 6}
+    # The next round starts from the new limit
+    manager._pre_adapt({f1: 8 * 10 ** 6, f2: 15 * 10 ** 6})
+    assert manager.get_current_limit(f2) == 15 * 10 ** 6
+
+
+def test_threaded_manager_locks_per_datapath():
+    manager = ThreadedQoSManager({f1: 5 * 10 ** 6})
+    assert manager._resource_sem(1) is manager._resource_sem(1)
+    assert manager._resource_sem(1) is not manager._resource_sem(2)
+    assert manager._resource_sem("all") is manager._resource_set_sem
+    assert manager._resource_sem(1).acquire(False) and manager._resource_sem(2).acquire(False)
+    manager.unregister_datapath(1)
+    assert 1 not in manager._datapath_sems
+
+
+class SlowThreadedQoSManager(ThreadedQoSManager):
+    """Yields in every queue setting, as a REST request does, and records how many run at the same time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = 0
+        self.max_running = 0
+
+    def _post_queues(self, dpid, port_name, queue_limits):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        ryu.lib.hub.sleep(0.01)
+        self.running -= 1
+        return True
+
+
+def test_threaded_manager_serialises_queues_of_all_and_single_datapaths():
+    manager = SlowThreadedQoSManager({f1: 5 * 10 ** 6, f2: 15 * 10 ** 6})
+    manager.register_datapath(1, ["s1-eth1", "s1-eth2"])
+    manager.register_datapath(2, ["s2-eth1"])
+    threads = [ryu.lib.hub.spawn(manager.set_queues, blocking=True),
+               ryu.lib.hub.spawn(manager.set_queues, 1, blocking=True)]
+    ryu.lib.hub.joinall(threads)
+    assert manager.max_running == 1
+    assert not manager.has_stale_queues()
+    # Held by a single datapath, a non-blocking operation on all of them is skipped and releases what it has taken
+    assert manager._resource_sem(2).acquire(False)
+    assert manager.set_queues(blocking=False) is None
+    assert manager._resource_set_sem.acquire(False) and manager._resource_sem(1).acquire(False)
+
+
+def test_threaded_manager_fans_out_rules():
+    manager = ThreadedQoSManager({f1: 5 * 10 ** 6})
+    manager.register_datapath(1, ["s1-eth1"])
+    assert manager._acquire("all", False, False) == [manager._resource_set_sem]
+    assert manager._acquire(1, True, False) == [manager._resource_sem(1)]
+
+
+def test_threaded_manager_counts_skipped_operations():
+    manager = ThreadedQoSManager({f1: 5 * 10 ** 6})
+    skipped = metrics.SKIPPED_OPERATIONS.labels(operation="adapt_queues")
+    before = skipped.value
+    assert manager._adapt_sem.acquire(False)
+    assert manager.adapt_queues({f1: 10 ** 6}, False) is None
+    assert skipped.value == before + 1
+
+
+def test_egress_placement_sets_queues_only_on_placed_ports(monkeypatch):
+    monkeypatch.setattr(QoSManager, "QUEUE_PLACEMENT", "egress")
+    manager = make_manager()
+    assert manager.placed_ports(1) == manager.datapath_ports[1]  # Every port until the topology is known
+    assert manager.place_queues(1, ["s1-eth2", "s9-eth1"])
+    assert not manager.place_queues(1, ["s1-eth2"])
+    assert manager.placed_ports(1) == ["s1-eth2"]
+    manager.set_queues()
+    assert manager.posts == [(1, "s1-eth2"), (2, None)]  # Every port of datapath 2 is placed
+    manager.posts.clear()
+    assert manager.place_queues(2, [])
+    assert manager.placed_ports(2) == []
+    manager.set_queues()
+    assert manager.posts == [] and not manager.has_stale_queues()
+    manager.unregister_datapath(2)
+    assert 2 not in manager.queue_ports
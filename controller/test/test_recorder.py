@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+
+import recorder
+from flow import FlowId
+from recorder import Recorder
+
+FLOWS = [FlowId("192.0.2.2", 5002), FlowId("192.0.2.1", 5001)]
+
+
+def record(directory, snapshots, **kwargs):
+    rec = Recorder(str(directory), **kwargs)
+    rec.set_datapath_name(1, "s1")
+    rec.set_datapath_name(2, "s2")
+    for timestamp in range(snapshots):
+        for dpid in (2, 1):
+            rec.append(float(timestamp), dpid, rec.flow_indices(FLOWS), np.array([1.5e6, 2e6]) * dpid,
+                       np.array([3000000, 4000000]), np.array([5000000, 5000000]))
+    rec.close()
+
+
+def test_recorder_roundtrip(tmp_path):
+    record(tmp_path, 10)
+    data = recorder.read(str(tmp_path))
+    assert len(data) == 40
+    assert data["timestamp"][-1] == 9 and data["dpid"][-1] == 1
+    flows, names = recorder.read_sidecar(str(tmp_path))
+    assert flows == FLOWS and names == {1: "s1", 2: "s2"}
+    assert data["speed"][:4].tolist() == [3e6, 4e6, 1.5e6, 2e6]
+
+
+def test_recorder_rotation(tmp_path):
+    record(tmp_path, 10, segment_records=3, max_segments=4)
+    segments = list(recorder.read_segments(str(tmp_path)))
+    assert len(segments) == 4 and [len(s) for s in segments] == [3, 3, 3, 1]
+    assert recorder.read(str(tmp_path))["timestamp"][-1] == 9
+
+
+def test_recorder_continues(tmp_path):
+    record(tmp_path, 1, segment_records=3)
+    record(tmp_path, 1, segment_records=3)
+    assert len(recorder.read(str(tmp_path))) == 8
+    assert recorder.read_sidecar(str(tmp_path))[0] == FLOWS
+
+
+def test_recorder_convert(tmp_path):
+    record(tmp_path, 2)
+    out = io.StringIO()
+    recorder.convert(str(tmp_path), "csv", out)
+    lines = out.getvalue().splitlines()
+    assert lines[:4] == [
+        "0,INFO,adapting_monitor,s1,192.0.2.1,5001,2.0,4.0,5.0",
+        "0,INFO,adapting_monitor,s2,192.0.2.1,5001,4.0,4.0,5.0",
+        "0,INFO,adapting_monitor,s1,192.0.2.2,5002,1.5,3.0,5.0",
+        "0,INFO,adapting_monitor,s2,192.0.2.2,5002,3.0,3.0,5.0",
+    ]
+    assert len(lines) == 8
+
+    out = io.StringIO()
+    recorder.convert(str(tmp_path), "human", out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 14
+    assert lines[3] == "0,INFO,adapting_monitor," + '%10s %10s %7d %16.2f %20.2f %20.2f' % (
+        "s1", "192.0.2.1", 5001, 2, 4, 5)
@@ -0,0 +1,72 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from rest_client import RestClient
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Needed for keep-alive
+    connections = set()
+
+    def _reply(self):
+        CountingHandler.connections.add(self.client_address)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) or b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    CountingHandler.connections = set()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_rest_client_keeps_connection_alive(server):
+    client = RestClient(pool_size=1)
+    for i in range(5):
+        assert client.post(server + "/qos/rules/%016x" % i, "POST /qos/rules", data='{"a": 1}').json() == {"a": 1}
+        client.get(server + "/qos/queue/all")
+    assert len(CountingHandler.connections) == 1
+    client.close()
+
+
+def test_rest_client_latency_per_endpoint(server):
+    client = RestClient()
+    for i in range(3):
+        client.put(server + "/v1.0/conf/switches/%016x/ovsdb_addr" % i, "PUT /v1.0/conf/switches/ovsdb_addr")
+    r = client.get(server + "/qos/queue/all")
+    client.send(r.request, "GET /qos/queue")
+    assert client.latencies["PUT /v1.0/conf/switches/ovsdb_addr"].count == 3
+    assert client.latencies["GET " + server + "/qos/queue/all"].count == 1
+    assert client.latencies["GET /qos/queue"].count == 1
+    assert client.latencies["GET /qos/queue"].max_time >= client.latencies["GET /qos/queue"].avg_time() > 0
+    client.close()
+
+
+def test_rest_client_bounded_retries():
+    client = RestClient(retries=2, backoff_factor=0)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get("http://127.0.0.1:9/unreachable", "GET /unreachable")  # Discard port, nothing listens there
+    assert client.latencies["GET /unreachable"].errors == 1
+    client.close()
+
+
+def test_rest_client_shared_instance():
+    assert RestClient.shared() is RestClient.shared()
@@ -0,0 +1,33 @@
+import pytest
+
+from flow import FlowId
+from qos_manager import QoSManager
+from rest_standin import RestQoSStandIn
+
+f1 = FlowId("10.0.0.11", 5001)
+f2 = FlowId("10.0.0.13", 5003)
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    server = RestQoSStandIn().start()
+    monkeypatch.setattr(QoSManager, "CONTROLLER_BASEURL", server.url, raising=False)
+    monkeypatch.setattr(QoSManager, "OVSDB_ADDR", "tcp:127.0.0.1:6640", raising=False)
+    yield server
+    server.stop()
+
+
+def test_rest_standin_serves_qos_manager(standin):
+    manager = QoSManager({f1: 5 * 10 ** 6, f2: 15 * 10 ** 6})
+    manager.register_datapath(1, ["s1-eth1", "s1-eth2"])
+    manager.set_ovsdb_addr(1)
+    manager.set_rules(1)
+    manager.set_queues(1)
+    assert standin.ovsdb_addrs == {"0000000000000001": "tcp:127.0.0.1:6640"}
+    assert standin.requests["POST /qos/rules"] == 2
+    assert standin.queues[("0000000000000001", "all")] == ["-1", "5000000", "15000000"]
+    assert not manager.has_stale_queues()
+
+
+def test_rest_standin_unknown_path(standin):
+    assert standin.handle("GET", "/unknown", "")[0] == 404
@@ -0,0 +1,38 @@
+from rounds import RoundTracker
+
+
+def test_round_completes_when_every_datapath_answered():
+    tracker = RoundTracker()
+    stats_round = tracker.start([1, 2])
+    tracker.register_request(1, 10)
+    tracker.register_request(2, 11)
+    assert tracker.reply(1, 10)
+    assert not stats_round.complete() and not stats_round.done.is_set()
+    assert tracker.reply(2, 11, more=True)
+    assert not stats_round.complete()
+    assert tracker.reply(2, 11)
+    assert stats_round.complete() and stats_round.done.is_set() and stats_round.answered == {1, 2}
+
+
+def test_round_ignores_late_replies():
+    tracker = RoundTracker()
+    tracker.start([1])
+    tracker.register_request(1, 10)
+    stats_round = tracker.start([1])
+    tracker.register_request(1, 12)
+    assert not tracker.reply(1, 10)
+    assert not stats_round.complete()
+    assert not tracker.reply(2, 12)
+
+
+def test_round_removed_datapath():
+    tracker = RoundTracker()
+    stats_round = tracker.start([1, 2])
+    tracker.register_request(1, 10)
+    tracker.reply(1, 10)
+    tracker.remove_datapath(2)
+    assert stats_round.done.is_set() and stats_round.answered == {1}
+
+
+def test_empty_round():
+    assert RoundTracker().start([]).done.is_set()
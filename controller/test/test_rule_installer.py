@@ -0,0 +1,91 @@
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from flow import FlowId
+from rule_installer import RULE_COOKIE_MASK, RULE_COOKIE, RuleInstaller
+
+
+class FakeDatapath:
+    """Answers FlowMods and barriers synchronously, failing the FlowMods of `failing_ports`."""
+
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, installer: RuleInstaller, failing_ports=(), answer_barrier=True):
+        self.id = 1
+        self.xid = 0
+        self.installer = installer
+        self.failing_ports = failing_ports
+        self.answer_barrier = answer_barrier
+        self.flowmods = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        msg.serialize()
+        if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod):
+            self.flowmods.append(msg)
+            if msg.match["udp_dst"] in self.failing_ports:
+                error = ofproto_v1_3_parser.OFPErrorMsg(self, ofproto_v1_3.OFPET_FLOW_MOD_FAILED,
+                                                        ofproto_v1_3.OFPFMFC_TABLE_FULL)
+                error.xid = msg.xid
+                self.installer.error_handler(error)
+        elif isinstance(msg, ofproto_v1_3_parser.OFPBarrierRequest) and self.answer_barrier:
+            reply = ofproto_v1_3_parser.OFPBarrierReply(self)
+            reply.xid = msg.xid
+            self.installer.barrier_reply_handler(reply)
+        return True
+
+
+rules = {FlowId("10.0.0.11", 5001): 1, FlowId("10.0.0.13", 5003): 2, FlowId("10.0.0.12", 5002): 3}
+
+
+def test_rule_installer_success():
+    installer = RuleInstaller()
+    dp = FakeDatapath(installer)
+    assert installer.install(dp, rules) == {}
+    assert len(dp.flowmods) == 3
+    for mod in dp.flowmods:
+        assert mod.table_id == 0 and mod.priority == 1
+        assert mod.cookie & RULE_COOKIE_MASK == RULE_COOKIE
+        assert rules[FlowId(mod.match["ipv4_dst"], mod.match["udp_dst"])] == mod.cookie & ~RULE_COOKIE_MASK
+
+
+def test_rule_installer_prefix_and_port_range():
+    installer = RuleInstaller()
+    dp = FakeDatapath(installer)
+    flow = FlowId("10.1.0.0/16", 6000, 6002)
+    assert installer.install(dp, {flow: 4}) == {}
+    assert [mod.match["udp_dst"] for mod in dp.flowmods] == [6000, 6001, 6002]
+    for mod in dp.flowmods:
+        assert mod.match["ipv4_dst"] == ("10.1.0.0", "255.255.0.0")
+        assert mod.cookie & ~RULE_COOKIE_MASK == 4
+
+
+def test_rule_installer_remove():
+    installer = RuleInstaller()
+    dp = FakeDatapath(installer)
+    flow = FlowId("10.1.0.0/16", 6000, 6001)
+    assert installer.remove(dp, {flow: 4}) == {}
+    assert [mod.match["udp_dst"] for mod in dp.flowmods] == [6000, 6001]
+    for mod in dp.flowmods:
+        assert mod.command == ofproto_v1_3.OFPFC_DELETE_STRICT
+        assert mod.table_id == 0 and mod.priority == 1
+
+
+def test_rule_installer_reports_failed_rules():
+    installer = RuleInstaller()
+    failures = installer.install(FakeDatapath(installer, failing_ports=(5003,)), rules)
+    assert list(failures) == [FlowId("10.0.0.13", 5003)]
+
+
+def test_rule_installer_barrier_timeout():
+    installer = RuleInstaller()
+    RuleInstaller.BARRIER_TIMEOUT, original_timeout = 0.01, RuleInstaller.BARRIER_TIMEOUT
+    try:
+        failures = installer.install(FakeDatapath(installer, answer_barrier=False), rules)
+    finally:
+        RuleInstaller.BARRIER_TIMEOUT = original_timeout
+    assert set(failures) == set(rules)
@@ -0,0 +1,119 @@
+import io
+
+import pytest
+
+from flow import FlowId
+from simulator import Simulator, Trace, read_iperf_csv, read_stat_log, simulate, sweep
+
+f1 = FlowId("10.0.0.11", 5001)
+f2 = FlowId("10.0.0.13", 5003)
+
+CONFIG = """
+flows:
+  - ipv4_dst: 10.0.0.11
+    udp_dst: 5001
+    base_ratelimit: 10000000
+  - ipv4_dst: 10.0.0.13
+    udp_dst: 5003
+    base_ratelimit: 10000000
+controller_baseurl: 'http://localhost:8080'
+ovsdb_addr: 'tcp:127.0.0.1:6632'
+time_step: 2
+limit_step: 2000000
+"""
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG)
+    return str(path)
+
+
+def measured_trace(f1_rates, f2_rate=10 ** 7):
+    samples = [(float(t), f1, rate) for t, rate in enumerate(f1_rates)]
+    samples += [(float(t), f2, f2_rate) for t in range(len(f1_rates))]
+    return Trace.from_samples(samples, measured=True)
+
+
+def test_read_iperf_csv_skips_titles_and_summaries():
+    samples = read_iperf_csv(io.StringIO("========== 5Mbps for 2 seconds ==========\n"
+                                         "100,10.0.0.2,4000,10.0.0.11,5001,0.0-1.0,5000000\n"
+                                         "101,10.0.0.2,4000,10.0.0.11,5001,1.0-2.0,4000000\n"
+                                         "102,10.0.0.2,4000,10.0.0.11,5001,0.0-2.0,4500000\n"))
+    assert samples == [(100.0, f1, 5e6), (101.0, f1, 4e6)]
+
+
+def test_read_stat_log_takes_the_highest_speed_across_datapaths():
+    samples = read_stat_log(io.StringIO("100,INFO,config,time_step set to 2\n"
+                                        "100,INFO,adapting_monitor,s1,10.0.0.11,5001,4.5,5.0,5.0\n"
+                                        "100,INFO,adapting_monitor,s2,10.0.0.11,5001,4.75,5.0,5.0\n"))
+    assert samples == [(100.0, f1, 4.75e6)]
+
+
+def test_trace_fills_gaps_within_the_samples_of_a_flow():
+    trace = Trace.from_samples([(10.0, f1, 1.0), (13.0, f1, 3.0), (11.0, f2, 2.0)], measured=False)
+    assert trace.flows == [f1, f2]
+    assert trace.times.tolist() == [0.0, 1.0, 3.0]
+    assert trace.rates.tolist() == [[1.0, 0.0], [1.0, 2.0], [3.0, 0.0]]
+    assert trace.durations().tolist() == [1.0, 2.0, 1.0]
+
+
+def test_steady_trace_needs_no_update(config_path):
+    result = simulate(config_path, measured_trace([10 ** 7] * 20))
+    assert result.queue_updates == 0
+    assert result.sla_violations == 0
+    assert len(result.round_times) == 10
+    assert (result.limits == 10 ** 7).all()
+
+
+def test_hysteresis_causes_sla_violation(config_path):
+    # f1 drops to 3 Mb/s: it is limited to 3 Mb/s and f2 gets the rest. Then it rises to 4.5 Mb/s, which is within
+    # the limit step, so it stays limited below its load.
+    result = simulate(config_path, measured_trace([3 * 10 ** 6] * 10 + [4.5 * 10 ** 6] * 10))
+    assert result.queue_updates == 1
+    assert result.queue_changes == 2
+    assert result.limits[-1].tolist() == [3 * 10 ** 6, 17 * 10 ** 6]
+    assert result.sla_violations == 1
+    assert result.sla_violation_seconds == 10.0
+
+    # With a smaller limit step the limit follows the load in the round it changes
+    result = simulate(config_path, measured_trace([3 * 10 ** 6] * 10 + [4.5 * 10 ** 6] * 10), {"limit_step": 10 ** 6})
+    assert result.queue_updates == 2
+    assert result.limits[-1].tolist() == [5 * 10 ** 6, 15 * 10 ** 6]
+    assert result.sla_violations == 0
+
+
+def test_offered_rates_are_measured_over_the_window(config_path):
+    samples = [(float(t), flow, 10 ** 7) for t in range(20) for flow in (f1, f2)]
+    result = simulate(config_path, Trace.from_samples(samples, measured=False))
+    # The first round has a single counter sample and measures no traffic, like the controller
+    assert result.limits[0].tolist() == [2.5 * 10 ** 6] * 2
+    assert (result.limits[1:] == 10 ** 7).all()
+
+
+def test_sweep_runs_every_combination(config_path):
+    trace = measured_trace([3 * 10 ** 6] * 10 + [4.5 * 10 ** 6] * 10)
+    results = sweep(config_path, trace, {"limit_step": [10 ** 6, 2 * 10 ** 6], "time_step": [1, 2]}, workers=2)
+    assert [overrides for overrides, _ in results] == [
+        {"limit_step": 10 ** 6, "time_step": 1}, {"limit_step": 10 ** 6, "time_step": 2},
+        {"limit_step": 2 * 10 ** 6, "time_step": 1}, {"limit_step": 2 * 10 ** 6, "time_step": 2}]
+    for overrides, summary in results:
+        assert summary == simulate(config_path, trace, overrides).summary()
+    # The values of a combination do not leak into the next simulation
+    assert simulate(config_path, trace).summary() == results[-1][1]
+    assert Simulator.TIME_STEP == 2
+    assert results[0][1]["rounds"] == 20
+
+
+def test_hosts_are_summed_into_their_slice(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG.replace("10.0.0.13\n    udp_dst: 5003", "10.1.0.0/16\n    udp_dst: 6000-6009"))
+    # Two hosts of the slice send 4 Mb/s each, another one is outside of its ports
+    samples = [(float(t), host, 4 * 10 ** 6) for t in range(10)
+               for host in (FlowId("10.1.0.1", 6000), FlowId("10.1.7.7", 6009), FlowId("10.1.0.1", 7000))]
+    samples += [(float(t), f1, 10 ** 7) for t in range(10)]
+    result = simulate(str(path), Trace.from_samples(samples, measured=True))
+    # The slice uses 8 of its 10 Mb/s, which is within the limit step
+    assert result.queue_updates == 0
+    assert result.flows == [f1, FlowId("10.1.0.0/16", 6000, 6009)]
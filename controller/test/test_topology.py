@@ -0,0 +1,43 @@
+from flow import FlowId
+from topology import Topology
+
+ue1 = FlowId("10.0.0.11", 5001)
+ue2 = FlowId("10.0.0.12", 5002)
+ue3 = FlowId("10.0.0.13", 5003)
+
+
+def experiment_topology():
+    """The topology of mininet/topologies/experiment.py: nb(1) - rb1(2) - a1(4), nb(1) - rb2(3) - a2(5)."""
+    topology = Topology()
+    for src, src_port, dst, dst_port in ((1, "nb-eth3", 2, "rb1-eth1"), (1, "nb-eth4", 3, "rb2-eth1"),
+                                         (2, "rb1-eth2", 4, "a1-eth1"), (3, "rb2-eth2", 5, "a2-eth1")):
+        topology.add_link(src, src_port, dst)
+        topology.add_link(dst, dst_port, src)
+    for address, dpid, port in (("10.0.0.1", 1, "nb-eth1"), ("10.0.0.2", 1, "nb-eth2"), ("10.0.0.11", 4, "a1-eth2"),
+                                ("10.0.0.12", 4, "a1-eth3"), ("10.0.0.13", 5, "a2-eth2")):
+        topology.add_host(address, dpid, port)
+    return topology
+
+
+def test_egress_ports_follow_the_path_to_the_hosts():
+    topology = experiment_topology()
+    # The senders are not known, so every datapath forwards towards the host
+    assert topology.egress_ports([ue1]) == {1: {"nb-eth3"}, 2: {"rb1-eth2"}, 3: {"rb2-eth1"}, 4: {"a1-eth2"},
+                                            5: {"a2-eth1"}}
+    # The ports of the hosts not in any slice, b and c on nb, carry none
+    assert topology.egress_ports([ue1, ue2, ue3]) == {1: {"nb-eth3", "nb-eth4"}, 2: {"rb1-eth1", "rb1-eth2"},
+                                                      3: {"rb2-eth1", "rb2-eth2"}, 4: {"a1-eth1", "a1-eth2", "a1-eth3"},
+                                                      5: {"a2-eth1", "a2-eth2"}}
+    # A prefix covers every host in it
+    assert topology.egress_ports([FlowId("10.0.0.8/29", 5000)]) == topology.egress_ports([ue1, ue2, ue3])
+
+
+def test_egress_ports_of_unknown_hosts():
+    topology = experiment_topology()
+    # The traffic of a slice without a known host may leave anywhere
+    assert topology.egress_ports([FlowId("10.0.0.99", 5000)]) is None
+    assert topology.egress_ports([ue1, FlowId("10.0.0.99", 5000)]) is None
+    assert topology.egress_ports([]) == {}
+    assert Topology().egress_ports([ue1]) is None
+    assert topology.linked(5) and not topology.linked(6)
+    assert topology == experiment_topology() and topology != Topology()
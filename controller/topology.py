@@ -0,0 +1,117 @@
+import collections
+import ipaddress
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import config_handler
+from flow import FlowId
+
+
+class Topology:
+    """
+    The links between the datapaths and the hosts attached to them, to find the ports the traffic of the slices leaves
+    the datapaths through.
+
+    The switches forward by learning, which needs a loop free topology, so the traffic towards a host takes the only
+    path to the datapath the host is attached to. On that datapath it leaves through the port of the host, on every
+    other one through the port of the link towards it.
+    """
+
+    REFRESH_INTERVAL = 5.0  # Seconds between two refreshes of the topology from the topology discovery of Ryu
+
+    @classmethod
+    def configure(cls, ch: config_handler.ConfigHandler) -> None:
+        """
+        Configure common class values based on the config file.
+
+        :param ch: The config_handler object.
+        """
+        logger = logging.getLogger("config")
+
+        # Optional fields
+        if "topology_refresh_interval" in ch.config:
+            cls.REFRESH_INTERVAL = float(ch.config["topology_refresh_interval"])
+            if cls.REFRESH_INTERVAL <= 0:
+                raise config_handler.ConfigError("config: topology_refresh_interval must be positive")
+            logger.info("topology_refresh_interval set to {}".format(cls.REFRESH_INTERVAL))
+        else:
+            logger.debug("topology_refresh_interval not set")
+
+    def __init__(self):
+        self.links: Dict[int, Dict[int, str]] = {}  # Key: datapath id, the port towards each neighbour datapath
+        self._incoming: Dict[int, Set[int]] = {}  # Key: datapath id, the datapaths with a link towards it
+        self.hosts: Dict[str, Tuple[int, str]] = {}  # Key: IPv4 address, the datapath and port of the host
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Topology) and self.links == other.links and self.hosts == other.hosts
+
+    def add_link(self, src_dpid: int, src_port: str, dst_dpid: int) -> None:
+        """
+        Add a link in one direction.
+
+        :param src_port: The name of the port of the source datapath the link starts at.
+        """
+        self.links.setdefault(src_dpid, {})[dst_dpid] = src_port
+        self._incoming.setdefault(dst_dpid, set()).add(src_dpid)
+
+    def add_host(self, address: str, dpid: int, port: str) -> None:
+        """
+        :param port: The name of the port of the datapath the host is attached to.
+        """
+        self.hosts[address] = (dpid, port)
+
+    def linked(self, dpid: int) -> bool:
+        """
+        :return: Whether a link from or towards the datapath has been learnt.
+        """
+        return dpid in self.links or dpid in self._incoming
+
+    def _ports_towards(self, dpid: int) -> Dict[int, str]:
+        """
+        :return: The port of every datapath that reaches `dpid` through its links, towards `dpid`.
+        """
+        ports = {}
+        visited = {dpid}
+        queue = collections.deque([dpid])
+        while queue:
+            current = queue.popleft()
+            for neighbour in self._incoming.get(current, ()):
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    ports[neighbour] = self.links[neighbour][current]
+                    queue.append(neighbour)
+        return ports
+
+    def egress_ports(self, flows: Iterable[FlowId]) -> Optional[Dict[int, Set[str]]]:
+        """
+        Find the ports the traffic of the slices leaves the datapaths through.
+
+        Only the known hosts of the slices are taken into account. The senders are not known, so every datapath linked
+        to the datapath of a host gets its port towards it.
+
+        :return: The names of the egress ports per datapath id. The datapaths without any are missing. None if a slice
+        has no known host yet, as its destinations have not been seen sending anything, not even answering ARP, so its
+        traffic may leave through any port.
+        """
+        networks = set()  # (prefix length, network address) of every slice
+        for flow in flows:
+            address, prefixlen = flow.network()
+            networks.add((prefixlen, int(ipaddress.IPv4Address(address))))
+        masks = {prefixlen: (0xffffffff << (32 - prefixlen)) & 0xffffffff for prefixlen, _ in networks}
+
+        egress: Dict[int, Set[str]] = {}
+        destinations = set()  # The datapaths the hosts of the slices are attached to
+        found = set()  # The networks with a known host
+        for address, (dpid, port) in self.hosts.items():
+            address = int(ipaddress.IPv4Address(address))
+            matched = {(prefixlen, address & mask) for prefixlen, mask in masks.items()} & networks
+            if matched:
+                found |= matched
+                egress.setdefault(dpid, set()).add(port)
+                destinations.add(dpid)
+        if found != networks:
+            return None
+        for destination in destinations:
+            for dpid, port in self._ports_towards(destination).items():
+                egress.setdefault(dpid, set()).add(port)
+        return egress